@@ -5,8 +5,8 @@ Responsável por selecionar fornecedores e validar dados via BrasilAPI.
 import json
 from google.adk.agents import Agent
 from iacompras.tools.external_tools import brasilapi_cnpj_lookup
-from iacompras.tools.analysis_tools import score_supplier
-from iacompras.tools.ml_tools import train_supplier_classifier, get_classified_suppliers
+from iacompras.tools.analysis_tools import score_supplier_batch
+from iacompras.tools.ml_tools import train_supplier_classifier, get_classified_suppliers, score_suppliers
 from iacompras.tools.db_tools import db_get_latest_classified_suppliers
 
 
@@ -20,13 +20,17 @@ def negociar_fornecedores_tool(recomendacoes_compras: list) -> list:
     Returns:
         Lista de fornecimentos com dados validados e score calculado
     """
+    # Scores de todos os fornecedores em uma única chamada vetorizada
+    scores = score_supplier_batch(
+        [item.get('prazo_medio', 10) for item in recomendacoes_compras],
+        [item.get('volume_historico', 0) for item in recomendacoes_compras]
+    )
+
     fornecimentos = []
-    for item in recomendacoes_compras:
+    for item, score in zip(recomendacoes_compras, scores.tolist()):
         
         nome_fornecedor = item.get('RAZAO_FORNECEDOR') or item.get('fornecedor') or item.get('nome', 'N/A')
         cnpj_fornecedor = item.get('CNPJ_FORNECEDOR') or item.get('cnpj', '')
-        prazo_medio = item.get('prazo_medio', 10)
-        volume_historico = item.get('volume_historico', 0)
         
         print(f"[*] Negociador: validando fornecedor {nome_fornecedor}")
                 
@@ -34,9 +38,6 @@ def negociar_fornecedores_tool(recomendacoes_compras: list) -> list:
         if cnpj_fornecedor:
             info_cadastral = brasilapi_cnpj_lookup(cnpj_fornecedor)
         
-        
-        score = score_supplier(prazo_medio, volume_historico)
-        
         fornecimentos.append({
             **item,
             "fornecedor_sugerido": info_cadastral.get("razao_social", nome_fornecedor),
@@ -68,6 +69,21 @@ def atualizar_inteligencia_tool() -> list:
     return listar_fornecedores_tool()
 
 
+def pontuar_fornecedores_tool(cnpjs: list) -> dict:
+    """
+    Classifica fornecedores pontualmente pelo CNPJ usando o modelo já treinado,
+    sem executar a classificação completa.
+
+    Args:
+        cnpjs: Lista de CNPJs (com ou sem formatação)
+
+    Returns:
+        Dicionário com 'status' e 'fornecedores' (rating e classificação de cada fornecedor)
+    """
+    print(f"[*] Negociador: pontuando {len(cnpjs)} fornecedor(es) sob demanda")
+    return score_suppliers(cnpjs)
+
+
 def filter_suppliers_tool(data: list, filter_query: str) -> list:
     """
     Aplica filtro de classificação aos dados com suporte a sinônimos.
@@ -192,12 +208,14 @@ class AgenteNegociadorFornecedores(Agent):
     - Treinar/atualizar o modelo de classificação (atualizar_inteligencia_tool)
     - Listar fornecedores classificados (listar_fornecedores_tool)
     - Filtrar fornecedores por categoria (filter_suppliers_tool)
+    - Classificar um fornecedor específico pelo CNPJ (pontuar_fornecedores_tool)
     - Negociar fornecedores para recomendações (negociar_fornecedores_tool)
     """
     tools: list = [
         negociar_fornecedores_tool,
         atualizar_inteligencia_tool,
         filter_suppliers_tool,
+        pontuar_fornecedores_tool,
         listar_fornecedores_tool,
         executar_negociador_tool
     ]
@@ -6,6 +6,7 @@ import json
 import ast
 from google.adk.agents import Agent
 from iacompras.tools.db_tools import db_insert_orcamento, db_list_orcamentos
+from iacompras.tools.resolucao_tools import chaves_dimensoes
 
 
 
@@ -75,19 +76,29 @@ def confirmar_orcamentos_tool(orcamentos_resumo: list) -> dict:
     """
     ids_gerados = []
     for orc in orcamentos_resumo:
+        # Chaves das dimensões (NULL quando os dados de notas não estão disponíveis)
+        codigos = [i['codigo_produto'] for i in orc['itens']]
+        try:
+            fornecedor_ids, produto_ids = chaves_dimensoes([orc.get('cnpj_fornecedor') or orc['fornecedor']], codigos)
+        except Exception as e:
+            print(f"[!] Orçamento: Não foi possível resolver as chaves de {orc['fornecedor']}: {e}")
+            fornecedor_ids, produto_ids = [None], [None] * len(codigos)
+
         itens_db = [
             {
                 "codigo_produto": i['codigo_produto'],
                 "preco_unitario": i['preco_base'],
-                "recorrencia": i['recorrencia']
-            } for i in orc['itens']
+                "recorrencia": i['recorrencia'],
+                "produto_id": produto_id
+            } for i, produto_id in zip(orc['itens'], produto_ids)
         ]
         
         orc_id = db_insert_orcamento(
             razao_fornecedor=orc['fornecedor'],
             valor_total=orc['valor_total_estimado'],
             itens=itens_db,
-            cnpj_fornecedor=orc.get('cnpj_fornecedor')
+            cnpj_fornecedor=orc.get('cnpj_fornecedor'),
+            fornecedor_id=fornecedor_ids[0]
         )
         ids_gerados.append(orc_id)
         
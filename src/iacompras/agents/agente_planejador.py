@@ -4,10 +4,17 @@ Responsável por prever demanda e facilitar seleção de fornecedores.
 """
 import json
 import ast
+import numpy as np
 import pandas as pd
 from google.adk.agents import Agent
 from iacompras.tools.ml_tools import get_classified_suppliers, train_supplier_classifier
-from iacompras.tools.data_tools import load_nf_items, load_nf_headers
+from iacompras.tools.warehouse_tools import consultar_produtos_mais_comprados
+from iacompras.tools.incidencia_tools import get_incidencia
+from iacompras.tools.resolucao_tools import get_indice_fornecedores
+from iacompras.tools.forecast_tools import get_previsao_demanda
+from iacompras.tools.feature_tools import get_features_fornecedores
+from iacompras.tools.analysis_tools import reposicao_pares
+from iacompras.tools.ranking_tools import top_fornecedores
 from iacompras.tools.gemini_client import gemini_client
 
 
@@ -47,8 +54,7 @@ def get_top_products_tool() -> list:
     Returns:
         Lista de códigos dos 20 produtos mais frequentes
     """
-    df_items = load_nf_items()
-    return df_items['CODIGO_PRODUTO'].value_counts().head(20).index.tolist()
+    return consultar_produtos_mais_comprados(20)
 
 
 def sugerir_produtos_tool(fornecedores_selecionados: list) -> dict:
@@ -70,56 +76,54 @@ def sugerir_produtos_tool(fornecedores_selecionados: list) -> dict:
     if not fornecedores_selecionados:
         return {"fornecedores_selecionados": [], "produtos_sugeridos": []}
 
-    df_items = load_nf_items()
-    df_headers = load_nf_headers()
-
-    df_headers['RAZAO_FORNECEDOR'] = df_headers['RAZAO_FORNECEDOR'].str.strip()
     fornecedores_selecionados = [f.strip() for f in fornecedores_selecionados]
 
-    df = df_items.merge(df_headers[['CODIGO_COMPRA', 'RAZAO_FORNECEDOR']], on='CODIGO_COMPRA', how='left')
-    
-    df_filtered = df[df['RAZAO_FORNECEDOR'].isin(fornecedores_selecionados)]
-
-    prod_forn_count = df_filtered.groupby('CODIGO_PRODUTO')['RAZAO_FORNECEDOR'].nunique()
-    total_forn_selecionados = len(fornecedores_selecionados)
-    produtos_em_todos = prod_forn_count[prod_forn_count == total_forn_selecionados].index.tolist()
+    # Pares dos selecionados e contagens por produto a partir das linhas da matriz fornecedor x produto
+    incidencia = get_incidencia()
+    ids = incidencia.indice_fornecedores.resolver_varios(fornecedores_selecionados)
+    linhas = incidencia.linhas_ids(ids)
+    df_filtered = incidencia.pares.iloc[incidencia.posicoes_pares(linhas)].reset_index(drop=True)
 
+    # Fornecedores distintos selecionados (não encontrados contam pelo nome)
+    total_forn_selecionados = len(set(ids[ids >= 0].tolist())) + len(
+        {f for f, i in zip(fornecedores_selecionados, ids) if i < 0})
+    prod_forn_count = incidencia.fornecedores_por_produto(linhas)
+    produtos_em_todos = incidencia.produtos[prod_forn_count == total_forn_selecionados].tolist()
 
-    prod_frequencia = df_filtered.groupby(['RAZAO_FORNECEDOR', 'CODIGO_PRODUTO']).size().reset_index(name='count')
-    produtos_frequentes = prod_frequencia[prod_frequencia['count'] > 1]['CODIGO_PRODUTO'].unique().tolist()
+    produtos_frequentes = incidencia.produtos[incidencia.max_compras_por_produto(linhas) > 1].tolist()
 
     sugestoes_codigos = list(set(produtos_em_todos + produtos_frequentes))
     
     if not sugestoes_codigos:
         print("[*] Planejador: Nenhuma sugestão estrita encontrada. Usando fallback por volume.")
-        sugestoes_codigos = df_filtered['CODIGO_PRODUTO'].value_counts().head(20).index.tolist()
-
-    df_grouped = df_filtered.groupby(['RAZAO_FORNECEDOR', 'CODIGO_PRODUTO']).agg({
-        'PRODUTO': 'last',
-        'VALOR_UNITARIO': 'last'
-    }).reset_index()
-
-    recomendacoes = []
-    for _, row in df_grouped.iterrows():
-        cod = row['CODIGO_PRODUTO']
-        forn = row['RAZAO_FORNECEDOR']
-        
-        motivos = []
-        if cod in produtos_em_todos:
-            motivos.append("Presente em todos os fornecedores")
-        if cod in produtos_frequentes:
-            motivos.append("Histórico recorrente")
-        
-        if not motivos:
-            motivos.append("Disponível neste fornecedor")
-
-        recomendacoes.append({
-            "RAZAO_FORNECEDOR": forn,
-            "codigo_produto": cod,
-            "descricao": row['PRODUTO'],
-            "ultimo_preco": float(row['VALOR_UNITARIO']),
-            "justificativa": " | ".join(motivos)
-        })
+        total_compras = incidencia.compras_por_produto(linhas)
+        ordem = np.argsort(-total_compras, kind='stable')[:20]
+        sugestoes_codigos = incidencia.produtos[ordem[total_compras[ordem] > 0]].tolist()
+
+    df_grouped = _estimar_reposicao(df_filtered)
+
+    # Justificativa por par, montada sobre as colunas inteiras
+    em_todos = df_grouped['CODIGO_PRODUTO'].isin(produtos_em_todos)
+    frequente = df_grouped['CODIGO_PRODUTO'].isin(produtos_frequentes)
+    justificativa = np.select(
+        [em_todos & frequente, em_todos, frequente],
+        ["Presente em todos os fornecedores | Histórico recorrente",
+         "Presente em todos os fornecedores", "Histórico recorrente"],
+        default="Disponível neste fornecedor"
+    )
+
+    recomendacoes = pd.DataFrame({
+        "RAZAO_FORNECEDOR": df_grouped['RAZAO_FORNECEDOR'].astype(object),
+        "codigo_produto": df_grouped['CODIGO_PRODUTO'].astype(object),
+        "descricao": df_grouped['PRODUTO'].astype(object),
+        "ultimo_preco": df_grouped['VALOR_UNITARIO'].astype('float64'),
+        "quantidade_prevista": df_grouped['quantidade_prevista'],
+        "quantidade_sugerida": df_grouped['quantidade_sugerida'],
+        "custo_estimado": df_grouped['custo_estimado'],
+        "risco_ruptura": df_grouped['risco_ruptura'],
+        "prazo_dias": df_grouped['prazo_dias'],
+        "justificativa": justificativa
+    }).to_dict('records')
         
     return {
         "type": "dual_grid_selection",
@@ -128,6 +132,39 @@ def sugerir_produtos_tool(fornecedores_selecionados: list) -> dict:
     }
 
 
+# Colunas de reposição levadas para o resultado do planejador
+COLUNAS_REPOSICAO = ['quantidade_sugerida', 'custo_estimado', 'risco_ruptura', 'prazo_dias']
+
+
+def _estimar_reposicao(df_pares):
+    """
+    Acrescenta aos pares fornecedor x produto o preço médio (se ausente), a demanda prevista,
+    o prazo de entrega do fornecedor e a reposição sugerida
+    (quantidade_sugerida, custo_estimado e risco_ruptura), tudo por colunas.
+    """
+    previsao = get_previsao_demanda()['quantidade_prevista'].round(2)
+
+    # Prazos por fornecedor unidos pela chave inteira (fornecedor_id), não pela razão social;
+    # as features já somam as notas de todos os CNPJs do fornecedor
+    indice = get_indice_fornecedores()
+    prazos = get_features_fornecedores()[['avg_lead_time', 'std_lead_time']]
+
+    df = df_pares.reset_index(drop=True)
+    if 'fornecedor_id' not in df:
+        df['fornecedor_id'] = indice.ids_razoes(df['RAZAO_FORNECEDOR'])
+    prazos = prazos.reindex(df['fornecedor_id']).reset_index(drop=True)
+    if 'preco_medio' not in df:
+        df['preco_medio'] = df['soma_valor_unitario'] / df['n_valor_unitario']
+    df = df.assign(
+        quantidade_prevista=previsao.reindex(df['CODIGO_PRODUTO'].astype(object)).fillna(0.0).to_numpy(),
+        avg_lead_time=prazos['avg_lead_time'],
+        std_lead_time=prazos['std_lead_time'],
+    )
+    df = reposicao_pares(df)
+    df['prazo_dias'] = df['avg_lead_time'].round().astype(int)
+    return df
+
+
 def filter_suppliers_planejador_tool(data: list, filter_query: str) -> list:
     """
     Aplica filtros de classificação ou detecta 'Selecionar Desejados'.
@@ -176,43 +213,36 @@ def recomendar_fornecedores_por_produto_tool(produtos_selecionados: list) -> dic
     if not produtos_selecionados:
         return {"produtos": []}
 
-    df_items = load_nf_items()
-    df_headers = load_nf_headers()
-    suppliers_classified = get_classified_suppliers()
-    
-    if isinstance(suppliers_classified, dict) and "error" in suppliers_classified:
-        df_class = pd.DataFrame(columns=['RAZAO_FORNECEDOR', 'rating', 'classificacao'])
-    else:
-        df_class = pd.DataFrame(suppliers_classified)
+    # Top 3 de cada produto lido do índice materializado de fornecedores (ranking_tools)
+    top_3 = _estimar_reposicao(top_fornecedores(produtos_selecionados, k=3))
+
+    colunas = ['RAZAO_FORNECEDOR', 'preco_medio', 'recurrencia_local'] + COLUNAS_REPOSICAO + \
+              ['CNPJ_FORNECEDOR', 'rating', 'classificacao']
+    codigos = top_3['CODIGO_PRODUTO'].tolist()
+    registros = top_3[colunas].to_dict('records')
+    top_por_produto = {}
+    for cod, registro in zip(codigos, registros):
+        top_por_produto.setdefault(cod, []).append(registro)
+
+    # Descrição do registro mais recente e demanda prevista de cada produto
+    produto = top_3.drop_duplicates('CODIGO_PRODUTO').set_index('CODIGO_PRODUTO')[['PRODUTO', 'quantidade_prevista']]
+    produto = produto.to_dict('index')
 
-    df_full = df_items.merge(df_headers[['CODIGO_COMPRA', 'RAZAO_FORNECEDOR']], on='CODIGO_COMPRA', how='left')
-    
     resultados = []
     for prod_cod in produtos_selecionados:
-        df_prod = df_full[df_full['CODIGO_PRODUTO'] == prod_cod].copy()
-        if df_prod.empty:
+        if prod_cod not in top_por_produto:
             continue
 
-        local_metrics = df_prod.groupby('RAZAO_FORNECEDOR').agg({
-            'VALOR_UNITARIO': 'mean',
-            'CODIGO_PRODUTO': 'count' 
-        }).rename(columns={'VALOR_UNITARIO': 'preco_medio', 'CODIGO_PRODUTO': 'recurrencia_local'}).reset_index()
-
-        recommendations = local_metrics.merge(df_class[['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'rating', 'classificacao']], on='RAZAO_FORNECEDOR', how='left')
-        recommendations['rating'] = recommendations['rating'].fillna(1)  # Neutro se não classificado
-        recommendations['classificacao'] = recommendations['classificacao'].fillna('N/A')
-
-        top_3 = recommendations.sort_values(
-            by=['rating', 'preco_medio', 'recurrencia_local'], 
-            ascending=[False, True, False]
-        ).head(3)
-
-        desc = df_prod['PRODUTO'].iloc[-1]
+        # Reposição calculada com o fornecedor mais recomendado
+        melhor = top_por_produto[prod_cod][0]
 
         resultados.append({
             "codigo_produto": prod_cod,
-            "descricao": desc,
-            "fornecedores_recomendados": top_3.to_dict('records')
+            "descricao": produto[prod_cod]['PRODUTO'],
+            "quantidade_prevista": float(produto[prod_cod]['quantidade_prevista']),
+            **{col: melhor[col] for col in COLUNAS_REPOSICAO},
+            "fornecedor_sugerido": melhor['RAZAO_FORNECEDOR'],
+            "fornecedores_recomendados": top_por_produto[prod_cod]
         })
 
     return {
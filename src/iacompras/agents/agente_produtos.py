@@ -2,10 +2,17 @@
 Agente Produtos ADK - IACOMPRAS
 Responsável por sugerir produtos com base nos fornecedores selecionados.
 """
+import os
 import ast
+import numpy as np
 import pandas as pd
 from google.adk.agents import Agent
-from iacompras.tools.data_tools import load_nf_items, load_nf_headers
+from iacompras.tools.incidencia_tools import get_incidencia
+from iacompras.tools.cache_tools import CacheLRU
+from iacompras.tools.search_tools import buscar_produtos
+
+# Sugestões por seleção de fornecedores, compartilhadas entre sessões
+CACHE_SUGESTOES = CacheLRU(int(os.getenv("IACOMPRAS_CACHE_SUGESTOES", "128")), "sugestoes_produtos")
 
 
 def sugerir_produtos_fornecedores_tool(fornecedores_selecionados: list) -> dict:
@@ -25,33 +32,53 @@ def sugerir_produtos_fornecedores_tool(fornecedores_selecionados: list) -> dict:
     if not fornecedores_selecionados:
         return {"fornecedores_selecionados": [], "produtos_sugeridos": []}
 
-    df_items = load_nf_items()
-    df_headers = load_nf_headers()
-
-    df_headers['RAZAO_FORNECEDOR'] = df_headers['RAZAO_FORNECEDOR'].str.strip()
     fornecedores_selecionados = [f.strip() for f in fornecedores_selecionados]
 
-    df = df_items.merge(df_headers[['CODIGO_COMPRA', 'RAZAO_FORNECEDOR']], on='CODIGO_COMPRA', how='left')
-    
-    df_filtered = df[df['RAZAO_FORNECEDOR'].isin(fornecedores_selecionados)]
+    # Seleção resolvida para ids de fornecedor: grafias, CNPJs e ordem diferentes
+    # do mesmo conjunto (na mesma versão dos dados) reaproveitam o resultado
+    incidencia = get_incidencia()
+    linhas = incidencia.linhas(fornecedores_selecionados)
+    chave = (frozenset(linhas.tolist()), incidencia.versao)
+    recomendacoes = CACHE_SUGESTOES.obter(chave, lambda: _sugerir_produtos(incidencia, linhas))
 
-    if df_filtered.empty:
+    if recomendacoes is None:
         return {
             "type": "dual_grid_selection",
             "fornecedores_selecionados": [{"RAZAO_FORNECEDOR": f} for f in fornecedores_selecionados],
             "produtos_sugeridos": []
         }
 
-    #identificando produtos por número de fornecedores
-    prod_forn_count = df_filtered.groupby('CODIGO_PRODUTO')['RAZAO_FORNECEDOR'].nunique()
+    return {
+        "type": "product_suggestion_grid",
+        "produtos_sugeridos": [dict(r) for r in recomendacoes]
+    }
+
+
+def _sugerir_produtos(incidencia, linhas):
+    """
+    Produtos sugeridos (lista de registros) para os fornecedores (linhas da
+    matriz), ou None se nenhum deles tem compras no período.
+    """
+    # Pares dos selecionados a partir das linhas da matriz fornecedor x produto
+    df_filtered = incidencia.pares.iloc[incidencia.posicoes_pares(linhas)].reset_index(drop=True)
+
+    if df_filtered.empty:
+        return None
+
+    #identificando produtos por número de fornecedores (soma das linhas selecionadas da matriz)
+    prod_forn_count = pd.Series(incidencia.fornecedores_por_produto(linhas), index=incidencia.produtos)
     auto_include_cods = prod_forn_count[prod_forn_count >= 2].index.tolist()
     single_forn_cods = prod_forn_count[prod_forn_count == 1].index.tolist()
 
     #lógica para produtos de apenas 1 fornecedor: Recorrência
-    recurrencia = df_filtered[df_filtered['CODIGO_PRODUTO'].isin(single_forn_cods)].groupby(['RAZAO_FORNECEDOR', 'CODIGO_PRODUTO']).size().reset_index(name='compras')
+    #(grafias da mesma razão social somadas no fornecedor canônico)
+    recurrencia = df_filtered[df_filtered['CODIGO_PRODUTO'].isin(single_forn_cods)].groupby(
+        ['fornecedor_id', 'CODIGO_PRODUTO'], sort=False, observed=True
+    )['compras'].sum().reset_index()
+    recurrencia.insert(0, 'RAZAO_FORNECEDOR', incidencia.indice_fornecedores.nomes(recurrencia['fornecedor_id']))
     
     #pega Top 10 por fornecedor
-    top_n = recurrencia.sort_values(['RAZAO_FORNECEDOR', 'compras'], ascending=[True, False]).groupby('RAZAO_FORNECEDOR').head(10)
+    top_n = recurrencia.sort_values(['RAZAO_FORNECEDOR', 'compras'], ascending=[True, False]).groupby('RAZAO_FORNECEDOR', observed=True).head(10)
     single_include_cods = top_n['CODIGO_PRODUTO'].tolist()
 
     #unir todos os códigos selecionados
@@ -60,40 +87,58 @@ def sugerir_produtos_fornecedores_tool(fornecedores_selecionados: list) -> dict:
     #montar a lista de retorno consolidada por PRODUTO (Grid Única)
     df_final = df_filtered[df_filtered['CODIGO_PRODUTO'].isin(selecionados_final_cods)]
     
-    #agrupamos por Produto para consolidar metadados
-    df_grouped = df_final.groupby('CODIGO_PRODUTO').agg({
-        'PRODUTO': 'last',
-        'VALOR_UNITARIO': 'last',
-        'GRUPO': 'last',
-        'MARCA': 'last',
-        'RAZAO_FORNECEDOR': lambda x: ", ".join(x.unique())  
-    }).reset_index()
-
-    recomendacoes = []
-    for _, row in df_grouped.iterrows():
-        cod = row['CODIGO_PRODUTO']
-        
-        motivo = ""
-        if cod in auto_include_cods:
-            motivo = f"Disponível em {prod_forn_count[cod]} fornecedores"
-        else:
-            row_rec = recurrencia[recurrencia['CODIGO_PRODUTO'] == cod].iloc[0]
-            motivo = f"Alta recorrência em {row_rec['RAZAO_FORNECEDOR']} ({row_rec['compras']} compras)"
-
-        recomendacoes.append({
-            "codigo_produto": cod,
-            "descricao": row['PRODUTO'],
-            "marca": row['MARCA'] if pd.notna(row['MARCA']) else "N/A",
-            "grupo": row['GRUPO'] if pd.notna(row['GRUPO']) else "N/A",
-            "ultimo_preco": float(row['VALOR_UNITARIO']),
-            "fornecedores": row['RAZAO_FORNECEDOR'],
-            "justificativa": motivo
-        })
-        
-    return {
-        "type": "product_suggestion_grid",
-        "produtos_sugeridos": recomendacoes
-    }
+    #agrupamos por Produto para consolidar metadados (última compra e fornecedores na ordem de aparição)
+    ultimos = df_final.sort_values('ultima_linha', kind='stable').groupby('CODIGO_PRODUTO', observed=True)[['PRODUTO', 'VALOR_UNITARIO', 'GRUPO', 'MARCA']].last()
+    fornecedores = df_final.sort_values('primeira_linha', kind='stable').groupby('CODIGO_PRODUTO', observed=True)['RAZAO_FORNECEDOR'].agg(", ".join)
+    df_grouped = ultimos.join(fornecedores).reset_index()
+
+    #justificativas montadas por coluna: produtos de 1 fornecedor têm um único par em recurrencia
+    cods = df_grouped['CODIGO_PRODUTO']
+    motivo_auto = "Disponível em " + prod_forn_count.reindex(cods).astype(str) + " fornecedores"
+    motivo_recorrencia = (
+        "Alta recorrência em " + recurrencia['RAZAO_FORNECEDOR'].astype(str) +
+        " (" + recurrencia['compras'].astype(str) + " compras)"
+    ).set_axis(recurrencia['CODIGO_PRODUTO'])
+    motivo = np.where(cods.isin(auto_include_cods), motivo_auto.to_numpy(), motivo_recorrencia.reindex(cods).to_numpy())
+
+    recomendacoes = pd.DataFrame({
+        "codigo_produto": cods.astype(object),
+        "descricao": df_grouped['PRODUTO'].astype(object),
+        "marca": df_grouped['MARCA'].astype(object).where(df_grouped['MARCA'].notna(), "N/A"),
+        "grupo": df_grouped['GRUPO'].astype(object).where(df_grouped['GRUPO'].notna(), "N/A"),
+        "ultimo_preco": df_grouped['VALOR_UNITARIO'].astype('float64'),
+        "fornecedores": df_grouped['RAZAO_FORNECEDOR'],
+        "justificativa": motivo
+    }).to_dict('records')
+    return recomendacoes
+
+
+def buscar_produtos_tool(consulta: str, limite: int = 10) -> dict:
+    """
+    Busca produtos pela descrição em texto livre (ex.: "parafuso inox"),
+    tolerando trechos parciais e erros de digitação.
+    
+    Args:
+        consulta: Texto com descrição, grupo, marca ou código do produto
+        limite: Número máximo de produtos retornados
+    
+    Returns:
+        dict com os produtos encontrados em ordem de relevância
+    """
+    if not consulta or not consulta.strip():
+        return {"consulta": consulta, "produtos_encontrados": []}
+
+    df = buscar_produtos(consulta, limite=limite)
+    produtos = pd.DataFrame({
+        "codigo_produto": df['CODIGO_PRODUTO'].astype(object),
+        "descricao": df['PRODUTO'].astype(object),
+        "marca": df['MARCA'].astype(object).where(df['MARCA'].notna(), "N/A"),
+        "grupo": df['GRUPO'].astype(object).where(df['GRUPO'].notna(), "N/A"),
+        "compras": df['compras'].astype(int),
+        "score": df['score'].astype('float64'),
+    }).to_dict('records')
+    print(f"[*] Agente Produtos: {len(produtos)} produto(s) para '{consulta}'")
+    return {"consulta": consulta, "produtos_encontrados": produtos}
 
 
 def executar_produtos_tool(query: str = None) -> dict:
@@ -101,7 +146,7 @@ def executar_produtos_tool(query: str = None) -> dict:
     Executa o fluxo principal do Agente de Produtos.
     
     Args:
-        query: Consulta contendo comando de confirmação de seleção
+        query: Consulta contendo comando de confirmação de seleção ou de busca
     
     Returns:
         Resultado da operação
@@ -119,6 +164,14 @@ def executar_produtos_tool(query: str = None) -> dict:
             print(f"[!] Erro no Agente Produtos: {e}")
             return {"status": "error", "message": f"Erro ao processar produtos: {e}"}
 
+    if "buscar_produtos:" in query_lower:
+        try:
+            consulta = query[query_lower.index("buscar_produtos:") + len("buscar_produtos:"):].strip()
+            return buscar_produtos_tool(consulta)
+        except Exception as e:
+            print(f"[!] Erro no Agente Produtos: {e}")
+            return {"status": "error", "message": f"Erro ao buscar produtos: {e}"}
+
     return {"status": "error", "message": "Comando não reconhecido pelo Agente Produtos."}
 
 
@@ -137,10 +190,12 @@ class AgenteProdutos(Agent):
     Responsável por filtrar e sugerir os melhores produtos para fornecedores selecionados.
     Use as tools disponíveis para:
     - Sugerir produtos para fornecedores (sugerir_produtos_fornecedores_tool)
+    - Encontrar produtos pela descrição em texto livre (buscar_produtos_tool)
     Priorize itens comuns a múltiplos fornecedores e produtos recorrentes.
     """
     tools: list = [
         sugerir_produtos_fornecedores_tool,
+        buscar_produtos_tool,
         executar_produtos_tool
     ]
     
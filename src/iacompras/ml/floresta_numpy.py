@@ -0,0 +1,92 @@
+"""
+Preditor NumPy do classificador de fornecedores - IACOMPRAS
+A floresta (RandomForestRegressor) e o StandardScaler treinados são achatados em
+arrays NumPy (feature, threshold, filhos e valores de todas as árvores) gravados
+em um .npz. A predição percorre todas as árvores para todas as amostras de uma
+vez, sem importar scikit-learn, e reproduz exatamente a predição do sklearn.
+"""
+import os
+from pathlib import Path
+import numpy as np
+
+FOLHA = -1  # marcador de folha do sklearn (children_left)
+
+
+def exportar_floresta(model, scaler, path):
+    """
+    Grava a floresta e o escalonador treinados em `path` (.npz).
+    Os índices dos filhos passam a ser globais (nós de todas as árvores
+    concatenados) e as folhas apontam para si mesmas, de modo que a descida
+    pode rodar um número fixo de passos (a profundidade máxima) sem desvios.
+    """
+    features, thresholds, esquerda, direita, valores, raizes = [], [], [], [], [], []
+    deslocamento = 0
+    for estimador in model.estimators_:
+        arvore = estimador.tree_
+        folha = arvore.children_left == FOLHA
+        raizes.append(deslocamento)
+        features.append(np.where(folha, 0, arvore.feature))
+        thresholds.append(arvore.threshold)
+        indices = np.arange(arvore.node_count) + deslocamento
+        esquerda.append(np.where(folha, indices, arvore.children_left + deslocamento))
+        direita.append(np.where(folha, indices, arvore.children_right + deslocamento))
+        valores.append(arvore.value.reshape(arvore.node_count))
+        deslocamento += arvore.node_count
+
+    path = Path(path)
+    tmp_path = path.with_name(path.stem + ".tmp.npz")
+    np.savez(
+        tmp_path,
+        feature=np.concatenate(features).astype(np.int32),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        esquerda=np.concatenate(esquerda).astype(np.int32),
+        direita=np.concatenate(direita).astype(np.int32),
+        valor=np.concatenate(valores).astype(np.float64),
+        raizes=np.array(raizes, dtype=np.int32),
+        profundidade=np.array(max(e.tree_.max_depth for e in model.estimators_)),
+        features=np.asarray(getattr(scaler, 'feature_names_in_', []), dtype=str),
+        media=np.asarray(scaler.mean_, dtype=np.float64),
+        escala=np.asarray(scaler.scale_, dtype=np.float64),
+    )
+    os.replace(tmp_path, path)
+
+
+class FlorestaNumpy:
+    """
+    Floresta exportada por exportar_floresta, com predição vetorizada em NumPy.
+    predict(X) recebe as features sem escalonar (mesma ordem do treino).
+    """
+
+    def __init__(self, path):
+        with np.load(path) as dados:
+            self.feature = dados['feature']
+            self.threshold = dados['threshold']
+            self.esquerda = dados['esquerda']
+            self.direita = dados['direita']
+            self.valor = dados['valor']
+            self.raizes = dados['raizes']
+            self.profundidade = int(dados['profundidade'])
+            self.media = dados['media']
+            self.escala = dados['escala']
+            # Nomes das features na ordem do treino (vazio em exportações antigas)
+            self.features = dados['features'].tolist() if 'features' in dados else []
+
+    def predict(self, X):
+        X = np.array(X, dtype=np.float64)
+        X -= self.media
+        X /= self.escala
+        # O sklearn compara as features em float32 com os thresholds em float64
+        X = X.astype(np.float32).astype(np.float64)
+
+        linhas = np.arange(len(X))[:, None]
+        nos = np.broadcast_to(self.raizes, (len(X), len(self.raizes))).copy()
+        for _ in range(self.profundidade):
+            vai_esquerda = X[linhas, self.feature[nos]] <= self.threshold[nos]
+            nos = np.where(vai_esquerda, self.esquerda[nos], self.direita[nos])
+
+        # Soma árvore a árvore, na mesma ordem do sklearn, para resultados idênticos
+        valores = self.valor[nos]
+        soma = np.zeros(len(X))
+        for t in range(valores.shape[1]):
+            soma += valores[:, t]
+        return soma / valores.shape[1]
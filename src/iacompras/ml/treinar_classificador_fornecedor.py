@@ -3,16 +3,50 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
-
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import mean_absolute_error
+import sys
+import json
+import time
+import hashlib
+
+# Permite executar este arquivo como script (python .../treinar_classificador_fornecedor.py)
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from iacompras.tools.data_tools import nf_paths, precarregar_nf, fingerprint_arquivo
+from iacompras.ml.floresta_numpy import exportar_floresta
+from iacompras.tools.db_tools import db_get_active_model_version, db_register_model_version
+from iacompras.tools.resolucao_tools import get_indice_fornecedores
+from iacompras.tools.feature_tools import (
+    JANELAS_DIAS,
+    colunas_janelas,
+    fs_disponivel,
+    get_features_fornecedores
+)
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
 DATA_DIR = BASE_DIR / "data" / "samples"
 MODEL_DIR = BASE_DIR / "models"
 
+# Processos/threads usados no treino (-1 = todos os núcleos)
+N_JOBS = int(os.getenv("IACOMPRAS_N_JOBS", "-1"))
+
+# Features recentes (90/180/365 dias) entram no modelo com IACOMPRAS_FEATURES_JANELAS=1
+USAR_FEATURES_JANELAS = os.getenv("IACOMPRAS_FEATURES_JANELAS", "0") == "1"
+
+FEATURES_MODELO = [
+    'avg_lead_time', 'std_lead_time', 'recurrence',
+    'total_spent', 'discount_rate', 'avg_item_price'
+] + (colunas_janelas(JANELAS_DIAS) if USAR_FEATURES_JANELAS else [])
+HIPERPARAMETROS_FLORESTA = {
+    'n_estimators': 300,
+    'max_depth': 6,
+    'min_samples_leaf': 5,
+    'random_state': 42,
+}
+# Pesos do score contínuo usado como rótulo
+PESOS_SCORE = {'avg_lead_time': 0.4, 'recurrence': 0.3, 'discount_rate': 0.3}
+
+# Manifesto do último treino: hash das entradas que geraram os artefatos salvos
+MANIFESTO_TREINO = "manifesto_treino.json"
+
 def normalize(series):
     return (series - series.min()) / (series.max() - series.min() + 1e-6)
 
@@ -32,65 +66,106 @@ def rating_to_label(rating: int) -> str:
         return "Ótimo / Recomendado"
 
 
-def engenharia_features_fornecedores(df_nf, df_items):
+def salvar_modelo(obj, path):
     """
-    Realiza a engenharia de features para os fornecedores com base nas notas fiscais e itens.
+    Grava o modelo em um arquivo temporário e o move para `path`: processos que
+    mantêm a versão anterior mapeada em memória (ml_tools) continuam lendo o
+    arquivo antigo em vez de um arquivo truncado.
     """
-    supplier_features = df_nf.groupby(['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR']).agg({
-        'PRAZO_ENTREGA_DIAS': ['mean', 'std'],
-        'CODIGO_COMPRA': 'count',
-        'TOTAL_NOTAFISCAL': 'sum',
-        'TOTAL_PRODUTOS': 'sum',
-        'TOTAL_DESCONTO': 'sum'
-    })
-
-    supplier_features.columns = [
-        'avg_lead_time', 'std_lead_time', 'recurrence',
-        'total_spent', 'total_products_value', 'total_discount'
-    ]
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
 
-    supplier_features = supplier_features.fillna(0)
 
-    supplier_features['discount_rate'] = (
-        supplier_features['total_discount'] /
-        (supplier_features['total_products_value'] + 1e-6)
-    )
+def hash_treino(paths):
+    """
+    Hash das entradas do treino: conteúdo dos workbooks, agrupamento das
+    features, hiperparâmetros, features e pesos do score. Mesmo hash => mesmos artefatos.
+    """
+    entradas = {
+        'dados': [(Path(p).name, fingerprint_arquivo(p)['sha1']) for p in paths],
+        'agrupamento': 'fornecedor_id',
+        'hiperparametros': HIPERPARAMETROS_FLORESTA,
+        'features': FEATURES_MODELO,
+        'pesos_score': PESOS_SCORE,
+    }
+    return hashlib.sha1(json.dumps(entradas, sort_keys=True).encode()).hexdigest()
 
-    avg_price = (
-        df_items
-        .merge(df_nf[['CODIGO_COMPRA', 'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR']], on='CODIGO_COMPRA')
-        .groupby(['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR'])['VALOR_UNITARIO']
-        .mean()
-        .rename('avg_item_price')
-    )
 
-    supplier_features = supplier_features.join(avg_price).fillna(0)
-    return supplier_features
+def _treino_em_dia(hash_atual, db_path):
+    """
+    Indica se os artefatos salvos (modelo, escalonador e versão ativa da
+    classificação) foram gerados com as mesmas entradas.
+    """
+    manifesto_path = MODEL_DIR / MANIFESTO_TREINO
+    artefatos = [
+        MODEL_DIR / "modelo_classificacao_fornecedores.pkl",
+        MODEL_DIR / "escalonador_fornecedores.pkl",
+        MODEL_DIR / "classificador_fornecedores.npz",
+    ]
+    if not manifesto_path.exists() or not all(p.exists() for p in artefatos):
+        return False
+    try:
+        manifesto = json.loads(manifesto_path.read_text())
+    except (OSError, ValueError):
+        return False
+    if manifesto.get('hash') != hash_atual:
+        return False
+
+    versao = db_get_active_model_version(db_path=str(db_path))
+    return versao is not None and versao.get('hash_treino') == hash_atual
+
+
+def treinar_modelo_avaliacao_fornecedores(n_jobs=None, forcar=False):
+    """
+    Treina o modelo de avaliação de fornecedores. As árvores da floresta e os
+    folds da validação cruzada são processados em paralelo com `n_jobs`
+    workers (padrão: IACOMPRAS_N_JOBS). Retorna o tempo de cada etapa em segundos.
+    Se as entradas (dados, hiperparâmetros e features) não mudaram desde o último
+    treino, os artefatos salvos são reaproveitados, a menos que forcar=True.
+    """
+    # scikit-learn só é necessário para treinar; a predição usa o preditor NumPy
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import train_test_split, cross_val_score
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.base import clone
 
+    n_jobs = N_JOBS if n_jobs is None else n_jobs
+    tempos = {}
+    inicio = time.perf_counter()
 
-def treinar_modelo_avaliacao_fornecedores():
     base_path = DATA_DIR
-    nf_path = base_path / "IACOMPRAS_NOTASFISCAIS_2023_2024.xlsx"
-    items_path = base_path / "IACOMPRAS_NOTAFISCALITENS_2023_2024.xlsx"
+    nf_path, items_path = nf_paths("2023_2024", base_path)
+    db_path = BASE_DIR / "data" / "iacompras.db"
 
     print(f"Carregando dados de treino de: {base_path}")
     if not nf_path.exists() or not items_path.exists():
         print("Erro: Arquivos de dados de treino não encontrados em data/samples/")
         return
 
-    df_nf = pd.read_excel(nf_path)
-    df_items = pd.read_excel(items_path)
+    hash_atual = hash_treino([nf_path, items_path])
+    if not forcar and _treino_em_dia(hash_atual, db_path):
+        tempos['verificacao'] = time.perf_counter() - inicio
+        print(f"Dados e parâmetros inalterados (hash {hash_atual[:12]}): reaproveitando o modelo salvo.")
+        return tempos
 
     print("Criando features por fornecedor...")
-    supplier_features = engenharia_features_fornecedores(df_nf, df_items)
+    if not fs_disponivel("2023_2024", base_path):
+        precarregar_nf(["2023_2024"], base_path)
+    supplier_features = get_features_fornecedores(
+        ["2023_2024"], base_path, janelas=JANELAS_DIAS if USAR_FEATURES_JANELAS else None
+    )
+    tempos['features'] = time.perf_counter() - inicio
 
 
     print("Calculando score contínuo...")
 
     score = (
-        0.4 * (1 - normalize(supplier_features['avg_lead_time'])) +
-        0.3 * normalize(supplier_features['recurrence']) +
-        0.3 * normalize(supplier_features['discount_rate'])
+        PESOS_SCORE['avg_lead_time'] * (1 - normalize(supplier_features['avg_lead_time'])) +
+        PESOS_SCORE['recurrence'] * normalize(supplier_features['recurrence']) +
+        PESOS_SCORE['discount_rate'] * normalize(supplier_features['discount_rate'])
     )
 
     supplier_features['score'] = score
@@ -101,10 +176,7 @@ def treinar_modelo_avaliacao_fornecedores():
     print(supplier_features['classificacao'].value_counts())
 
 
-    X = supplier_features[[
-        'avg_lead_time', 'std_lead_time', 'recurrence',
-        'total_spent', 'discount_rate', 'avg_item_price'
-    ]]
+    X = supplier_features[FEATURES_MODELO]
 
     y = supplier_features['rating']
 
@@ -117,16 +189,13 @@ def treinar_modelo_avaliacao_fornecedores():
     X_test_scaled = scaler.transform(X_test)
 
 
-    print("Treinando modelo...")
+    print(f"Treinando modelo (n_jobs={n_jobs})...")
+    inicio = time.perf_counter()
 
-    model = RandomForestRegressor(
-        n_estimators=300,
-        max_depth=6,
-        min_samples_leaf=5,
-        random_state=42
-    )
+    model = RandomForestRegressor(**HIPERPARAMETROS_FLORESTA, n_jobs=n_jobs)
 
     model.fit(X_train_scaled, y_train)
+    tempos['treino'] = time.perf_counter() - inicio
 
     preds = model.predict(X_test_scaled)
     preds_rounded = np.clip(np.round(preds), 1, 5)
@@ -134,20 +203,29 @@ def treinar_modelo_avaliacao_fornecedores():
     mae = mean_absolute_error(y_test, preds_rounded)
     print(f"MAE (escala 1–5): {mae:.3f}")
 
+    # Paraleliza entre folds; cada floresta do CV usa um único núcleo para não
+    # disputar CPU com os demais folds
+    inicio = time.perf_counter()
     cv_scores = cross_val_score(
-        model,
+        clone(model).set_params(n_jobs=1),
         scaler.fit_transform(X),
         y,
         cv=5,
-        scoring='neg_mean_absolute_error'
+        scoring='neg_mean_absolute_error',
+        n_jobs=n_jobs
     )
+    tempos['validacao_cruzada'] = time.perf_counter() - inicio
 
     print("MAE médio CV:", -cv_scores.mean())
 
     os.makedirs(MODEL_DIR, exist_ok=True)
 
-    joblib.dump(model, MODEL_DIR / "modelo_classificacao_fornecedores.pkl")
-    joblib.dump(scaler, MODEL_DIR / "escalonador_fornecedores.pkl")
+    # A predição no classificador roda com poucos fornecedores por vez: o modelo
+    # salvo não herda o paralelismo do treino
+    inicio = time.perf_counter()
+    salvar_modelo(model.set_params(n_jobs=None), MODEL_DIR / "modelo_classificacao_fornecedores.pkl")
+    salvar_modelo(scaler, MODEL_DIR / "escalonador_fornecedores.pkl")
+    exportar_floresta(model, scaler, MODEL_DIR / "classificador_fornecedores.npz")
     
     # Adicionando timestamp de execução
     current_time = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -156,26 +234,29 @@ def treinar_modelo_avaliacao_fornecedores():
     # Salvando CSV para compatibilidade foi removido conforme solicitado.
     # supplier_features.to_csv(MODEL_DIR / "fornecedores_classificados.csv")
     
-    # Persistindo no Banco de Dados SQLite
-    import sqlite3
-    db_path = BASE_DIR / "data" / "iacompras.db"
-    os.makedirs(db_path.parent, exist_ok=True)
-    
+    # Persistindo no Banco de Dados SQLite como nova versão ativa do classificador
+    # (ids posicionais, sem dim_fornecedor no banco, não são gravados)
+    classificacao = supplier_features.reset_index()
+    if not get_indice_fornecedores(data_path=base_path).persistido:
+        classificacao['fornecedor_id'] = None
     try:
-        conn = sqlite3.connect(db_path)
-        # Resetar o índice para incluir RAZAO_FORNECEDOR e CNPJ_FORNECEDOR como colunas
-        df_to_save = supplier_features.reset_index()
-        # Salvando o DataFrame na tabela 'fornecedores_classificados'
-        # Usamos 'replace' para recriar a tabela com a nova estrutura incluindo CNPJ_FORNECEDOR
-        df_to_save.to_sql('fornecedores_classificados', conn, if_exists='replace', index=False)
-        print(f"Dados salvos com sucesso no banco de dados: {db_path}")
+        version_id = db_register_model_version(
+            classificacao,
+            current_time,
+            hash_treino=hash_atual,
+            mae=float(mae),
+            mae_cv=float(-cv_scores.mean()),
+            db_path=str(db_path)
+        )
+        print(f"Classificação salva no banco de dados: {db_path} (versão {version_id})")
+        (MODEL_DIR / MANIFESTO_TREINO).write_text(json.dumps({'hash': hash_atual, 'dt_execucao': current_time}))
     except Exception as e:
         print(f"Erro ao salvar no banco de dados: {e}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
+    tempos['gravacao'] = time.perf_counter() - inicio
 
     print(f"Modelo salvo em: {MODEL_DIR}")
+    print("Tempo por etapa (s): " + ", ".join(f"{etapa}={t:.2f}" for etapa, t in tempos.items()))
+    return tempos
 
 
 if __name__ == "__main__":
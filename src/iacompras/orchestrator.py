@@ -1,6 +1,8 @@
 import sqlite3
 import json
+import pandas as pd
 from iacompras.tools.db_tools import db_init, db_insert_run, DB_PATH
+from iacompras.tools.resolucao_tools import chaves_dimensoes
 from iacompras.agents.agente_planejador import AgentePlanejadorCompras
 from iacompras.agents.agente_negociador import AgenteNegociadorFornecedores
 from iacompras.agents.agente_orcamento import AgenteGerenciadorOrcamento
@@ -159,30 +161,50 @@ class OrquestradorIACompras:
         return self.roteador.analisar_requisicao(mensagem_usuario, current_stage=current_stage)
 
     def _save_run_items(self, run_id, items):
+        tipo = type(items)
+        if isinstance(items, dict):
+            # Resultados em grade (ex.: produtos_sugeridos, selecao_final): usa a lista de itens por produto
+            items = next(
+                (v for v in items.values()
+                 if isinstance(v, list) and any(isinstance(i, dict) and 'codigo_produto' in i for i in v)),
+                None
+            )
         if not isinstance(items, list):
-            print(f"[*] Orquestrador: Resultado não é uma lista, ignorando salvamento de itens individuais. Tipo: {type(items)}")
+            print(f"[*] Orquestrador: Resultado não é uma lista, ignorando salvamento de itens individuais. Tipo: {tipo}")
             return
 
+        df = pd.DataFrame([item for item in items if isinstance(item, dict) and 'codigo_produto' in item])
+        if df.empty:
+            return
+
+        if 'fornecedor_sugerido' not in df and 'RAZAO_FORNECEDOR' in df:
+            df['fornecedor_sugerido'] = df['RAZAO_FORNECEDOR']
+        padroes = {
+            'codigo_produto': 'N/A', 'quantidade_prevista': 0.0, 'quantidade_sugerida': 0.0,
+            'fornecedor_sugerido': 'N/A', 'custo_estimado': 0.0, 'prazo_dias': 0, 'risco_ruptura': 0.0,
+            'flags_auditoria': 'N/A'
+        }
+        df = df.reindex(columns=list(padroes))
+        df = df.astype(object).fillna(padroes)
+        df.insert(0, 'run_id', run_id)
+
+        # Chaves das dimensões (NULL quando o fornecedor/produto não é resolvido)
+        try:
+            fornecedor_ids, produto_ids = chaves_dimensoes(df['fornecedor_sugerido'].tolist(), df['codigo_produto'].tolist())
+            df['fornecedor_id'] = pd.Series(fornecedor_ids, index=df.index, dtype=object)
+            df['produto_id'] = pd.Series(produto_ids, index=df.index, dtype=object)
+        except Exception as e:
+            print(f"[!] Orquestrador: Não foi possível resolver as chaves dos itens: {e}")
+            df['fornecedor_id'], df['produto_id'] = None, None
+
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        for item in items:
-            if not isinstance(item, dict) or 'codigo_produto' not in item:
-                continue
-
-            cursor.execute('''
-            INSERT INTO run_items (run_id, codigo_produto, quantidade_prevista, quantidade_sugerida, 
-                                 fornecedor_sugerido, custo_estimado, prazo_estimado, flags_auditoria)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                run_id, 
-                item.get('codigo_produto', 'N/A'), 
-                item.get('quantidade_prevista', 0.0), 
-                item.get('quantidade_sugerida', 0.0),
-                item.get('fornecedor_sugerido', 'N/A'),
-                item.get('custo_estimado', 0.0),
-                item.get('prazo_dias', 0),
-                item.get('flags_auditoria', 'N/A')
-            ))
+        cursor.executemany('''
+        INSERT INTO run_items (run_id, codigo_produto, quantidade_prevista, quantidade_sugerida, 
+                             fornecedor_sugerido, custo_estimado, prazo_estimado, risco_ruptura,
+                             flags_auditoria, fornecedor_id, produto_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', df.itertuples(index=False, name=None))
         conn.commit()
         conn.close()
 
@@ -1,19 +1,134 @@
+import os
 import numpy as np
+import pandas as pd
+
+# Dias de consumo cobertos por um pedido
+COBERTURA_PEDIDO_DIAS = int(os.getenv("IACOMPRAS_COBERTURA_PEDIDO_DIAS", "30"))
+# Atraso tolerado sobre o prazo médio do fornecedor quando o estoque não é informado
+FOLGA_PRAZO_DIAS = int(os.getenv("IACOMPRAS_FOLGA_PRAZO_DIAS", "7"))
+# Quantil normal do estoque de segurança (1.65 ~ 95% de nível de serviço)
+Z_SERVICO = float(os.getenv("IACOMPRAS_Z_SERVICO", "1.65"))
+DIAS_MES = 30
+
+# Regras do score de fornecedor (0 a 100). Faixas de prazo: (prazo médio máximo em dias, pontos),
+# vale a primeira faixa atendida.
+REGRAS_SCORE = {
+    'base': 50,
+    'faixas_prazo': [(7, 20), (15, 10)],
+    'uf_preferencial': 'GO',  # UF do projeto (logística facilitada)
+    'pontos_uf': 10,
+    'volume_minimo': 1000,  # histórico de volume acima deste valor indica confiança
+    'pontos_volume': 20,
+    'maximo': 100,
+}
+
 
 def score_supplier(prazo_medio, historico_volume, uf_fixa="GO"):
     """
     Calcula um score para o fornecedor (0 a 100).
     """
-    score = 50 # Base
-    
-    # Prazo (quanto menor, melhor)
-    if prazo_medio <= 7: score += 20
-    elif prazo_medio <= 15: score += 10
-    
-    # UF do projeto (Logística facilitada em GO)
-    if uf_fixa == "GO": score += 10
-    
-    # Histórico de volume (confiança)
-    if historico_volume > 1000: score += 20
-    
-    return min(100, score)
+    return int(score_supplier_batch([prazo_medio], [historico_volume], uf_fixa)[0])
+
+
+def score_supplier_batch(prazo_medio, historico_volume, uf="GO", regras=None):
+    """
+    Score (0 a 100) de vários fornecedores de uma vez. Prazos, volumes e UFs
+    são arrays alinhados (uma UF única vale para todos); `regras` sobrescreve
+    chaves de REGRAS_SCORE. Retorna um array de inteiros.
+    """
+    regras = {**REGRAS_SCORE, **(regras or {})}
+    prazo = np.asarray(prazo_medio, dtype='float64')
+    volume = np.asarray(historico_volume, dtype='float64')
+    uf = np.broadcast_to(np.asarray(uf, dtype=object), prazo.shape)
+
+    faixas = regras['faixas_prazo']
+    score = np.full(prazo.shape, regras['base'], dtype='int64')
+    score += np.select([prazo <= limite for limite, _ in faixas], [pontos for _, pontos in faixas], default=0)
+    score += np.where(uf == regras['uf_preferencial'], regras['pontos_uf'], 0)
+    score += np.where(volume > regras['volume_minimo'], regras['pontos_volume'], 0)
+    return np.minimum(score, regras['maximo'])
+
+
+def score_supplier_df(df, regras=None, col_prazo='prazo_medio', col_volume='volume_historico', col_uf='uf'):
+    """
+    score_supplier_batch sobre as colunas de um DataFrame (sem a coluna de UF,
+    usa a UF preferencial). Retorna uma Series alinhada ao índice.
+    """
+    uf = df[col_uf].to_numpy(dtype=object) if col_uf in df else REGRAS_SCORE['uf_preferencial']
+    scores = score_supplier_batch(df[col_prazo].to_numpy(), df[col_volume].to_numpy(), uf, regras)
+    return pd.Series(scores, index=df.index, name='score')
+
+
+def _erf(x):
+    """Função erro (Abramowitz & Stegun 7.1.26, erro máximo 1.5e-7) vetorizada."""
+    sinal = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poli = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return sinal * (1.0 - poli * np.exp(-x * x))
+
+
+def cdf_normal(x):
+    """Distribuição acumulada da normal padrão, elemento a elemento."""
+    return 0.5 * (1.0 + _erf(np.asarray(x, dtype='float64') / np.sqrt(2.0)))
+
+
+def calcular_reposicao(demanda_mensal, preco_medio, prazo_medio, prazo_desvio, estoque=None,
+                       cobertura_dias=COBERTURA_PEDIDO_DIAS, z=Z_SERVICO):
+    """
+    Quantidade sugerida, custo estimado e risco de ruptura de cada par
+    produto x fornecedor, com todos os argumentos como arrays alinhados.
+
+    - quantidade_sugerida: consumo do prazo de entrega mais `cobertura_dias`,
+      acrescido do estoque de segurança z * demanda diária * desvio do prazo.
+    - custo_estimado: quantidade sugerida x preço médio do fornecedor.
+    - risco_ruptura: probabilidade de o prazo de entrega (normal com a média e o
+      desvio do fornecedor) superar os dias cobertos pelo `estoque` atual
+      (em unidades, dias = estoque / demanda diária). Os dados de compras não
+      trazem estoque: sem ele, é a probabilidade de um atraso maior que
+      FOLGA_PRAZO_DIAS sobre o prazo médio, isto é, mede só a variabilidade do
+      prazo do fornecedor.
+    """
+    demanda_diaria = np.asarray(demanda_mensal, dtype='float64') / DIAS_MES
+    preco_medio = np.asarray(preco_medio, dtype='float64')
+    prazo_medio = np.asarray(prazo_medio, dtype='float64')
+    prazo_desvio = np.asarray(prazo_desvio, dtype='float64')
+
+    quantidade = np.ceil(demanda_diaria * (prazo_medio + cobertura_dias) + z * demanda_diaria * prazo_desvio)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if estoque is None:
+            dias_estoque = prazo_medio + FOLGA_PRAZO_DIAS
+        else:
+            dias_estoque = np.asarray(estoque, dtype='float64') / demanda_diaria
+        escore = (dias_estoque - prazo_medio) / prazo_desvio
+    # Desvio zero: o prazo é determinístico e o risco vira 0 ou 1
+    risco = np.where(prazo_desvio > 0, 1.0 - cdf_normal(escore), (prazo_medio > dias_estoque).astype('float64'))
+    risco = np.where(demanda_diaria > 0, risco, 0.0)
+
+    return {
+        'quantidade_sugerida': quantidade,
+        'custo_estimado': np.round(quantidade * preco_medio, 2),
+        'risco_ruptura': np.round(np.clip(risco, 0.0, 1.0), 4),
+    }
+
+
+def reposicao_pares(df_pares, estoque=None):
+    """
+    Aplica calcular_reposicao a um DataFrame de pares com as colunas
+    quantidade_prevista, preco_medio, avg_lead_time e std_lead_time
+    (prazos ausentes usam a mediana dos demais fornecedores). Retorna uma cópia
+    com os prazos preenchidos e quantidade_sugerida, custo_estimado e risco_ruptura.
+    """
+    prazo_medio = df_pares['avg_lead_time'].astype('float64')
+    prazo_medio = prazo_medio.fillna(prazo_medio.median()).fillna(0.0)
+    prazo_desvio = df_pares['std_lead_time'].astype('float64').fillna(0.0)
+
+    reposicao = calcular_reposicao(
+        df_pares['quantidade_prevista'].to_numpy(dtype='float64', na_value=0.0),
+        df_pares['preco_medio'].to_numpy(dtype='float64', na_value=0.0),
+        prazo_medio.to_numpy(),
+        prazo_desvio.to_numpy(),
+        estoque=estoque,
+    )
+    return df_pares.assign(avg_lead_time=prazo_medio, std_lead_time=prazo_desvio, **reposicao)
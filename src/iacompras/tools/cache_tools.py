@@ -0,0 +1,76 @@
+"""
+Cache LRU compartilhado entre sessões - IACOMPRAS
+Guarda os resultados mais recentes em um OrderedDict limitado a `tamanho`
+entradas: cada acerto move a entrada para o fim e, ao exceder o limite, a
+menos usada é descartada. Os contadores de acertos/faltas ajudam a calibrar
+o tamanho (IACOMPRAS_CACHE_*).
+"""
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache LRU seguro para threads. obter(chave, construtor) devolve o valor em
+    cache ou constrói e guarda o resultado. A construção roda fora do lock do
+    cache, sob um lock da própria chave: chaves diferentes são construídas em
+    paralelo e cada chave uma única vez.
+    """
+
+    def __init__(self, tamanho=128, nome="cache"):
+        self.tamanho = tamanho
+        self.nome = nome
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._construindo = {}
+        self.acertos = 0
+        self.faltas = 0
+        self.descartes = 0
+
+    def _acerto(self, chave):
+        """Valor em cache (e marca como mais recente); chamado com o lock do cache."""
+        self._entradas.move_to_end(chave)
+        self.acertos += 1
+        return self._entradas[chave]
+
+    def obter(self, chave, construtor):
+        with self._lock:
+            if chave in self._entradas:
+                return self._acerto(chave)
+            trava = self._construindo.setdefault(chave, threading.Lock())
+
+        with trava:
+            # Outra thread pode ter construído a chave enquanto esta esperava
+            with self._lock:
+                if chave in self._entradas:
+                    return self._acerto(chave)
+                self.faltas += 1
+            try:
+                valor = construtor()
+                with self._lock:
+                    self._entradas[chave] = valor
+                    if len(self._entradas) > self.tamanho:
+                        self._entradas.popitem(last=False)
+                        self.descartes += 1
+                return valor
+            finally:
+                with self._lock:
+                    self._construindo.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estatisticas(self):
+        """Acertos, faltas, descartes e ocupação atual do cache."""
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "cache": self.nome,
+                "entradas": len(self._entradas),
+                "tamanho": self.tamanho,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "descartes": self.descartes,
+                "taxa_acerto": round(self.acertos / consultas, 4) if consultas else 0.0,
+            }
@@ -1,18 +1,554 @@
 import pandas as pd
 import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from pathlib import Path
 
 DATA_PATH = Path("data/samples")
 
-def load_nf_headers():
-    path = DATA_PATH / "IACOMPRAS_NOTASFISCAIS_2025.xlsx"
-    if not path.exists():
-        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
-    return pd.read_excel(path)
+# Workbooks de notas fiscais por período: (cabeçalhos, itens)
+NF_ARQUIVOS = {
+    "2023_2024": ("IACOMPRAS_NOTASFISCAIS_2023_2024.xlsx", "IACOMPRAS_NOTAFISCALITENS_2023_2024.xlsx"),
+    "2025": ("IACOMPRAS_NOTASFISCAIS_2025.xlsx", "IACOMPRAS_NOTAFISCALITENS_2025.xlsx"),
+}
+PERIODO_ATUAL = "2025"
+
+# Colunas do cabeçalho levadas para a tabela fato (itens x cabeçalhos)
+COLUNAS_FATO_HEADER = ['CODIGO_COMPRA', 'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'DATA_COMPRA']
+
+# Tipos compactos dos DataFrames carregados: textos repetitivos como categorias e
+# inteiros reduzidos ao menor tipo que comporta os valores. Valores monetários e
+# quantidades permanecem float64 para não perder precisão nas somas.
+SCHEMA_NF_HEADERS = {
+    'CODIGO_COMPRA': 'integer',
+    'ANO_COMPRA': 'integer', 'MES_COMPRA': 'integer', 'DIA_COMPRA': 'integer',
+    'SEMESTRE_COMPRA': 'integer', 'TRIMESTRE_COMPRA': 'integer', 'BIMESTRE_COMPRA': 'integer',
+    'ANO_ENTREGA': 'integer', 'MES_ENTREGA': 'integer', 'DIA_ENTREGA': 'integer',
+    'PARCELAS_FINANCEIRA': 'integer', 'PRAZO_ENTREGA_DIAS': 'integer',
+    'FORMA_PAGTO': 'category', 'CIDADE_DESTINO': 'category', 'UF_DESTINO': 'category',
+    'CNPJ_FORNECEDOR': 'category', 'RAZAO_FORNECEDOR': 'category',
+    'CIDADE_FORNECEDOR': 'category', 'UF_FORNECEDOR': 'category',
+}
+SCHEMA_NF_ITENS = {
+    'CODIGO_COMPRA': 'integer', 'ITEM': 'integer', 'NCM': 'integer', 'ANO_COMPRA': 'integer',
+    'CODIGO_PRODUTO': 'category', 'PRODUTO': 'category', 'GRUPO': 'category',
+    'MARCA': 'category', 'UNIDADE_MEDIDA': 'category',
+}
+
+# Cache colunar (Parquet) dos workbooks, gravado ao lado de cada arquivo de origem
+CACHE_DIRNAME = ".cache"
+
+# Processos usados na leitura paralela dos workbooks (0 = um por arquivo, até o nº de CPUs)
+WORKERS_LEITURA = int(os.getenv("IACOMPRAS_WORKERS_LEITURA", "0"))
+
+
+def fingerprint_arquivo(path):
+    """
+    Retorna a impressão digital do arquivo de origem (tamanho, mtime e hash do conteúdo).
+    """
+    path = Path(path)
+    stat = path.stat()
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(bloco)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()}
+
+
+def _cache_paths(path):
+    cache_dir = path.parent / CACHE_DIRNAME
+    return cache_dir / f"{path.stem}.parquet", cache_dir / f"{path.stem}.json"
+
+
+def _cache_valido(path, meta_path):
+    """
+    Verifica se o cache corresponde ao arquivo de origem.
+    Tamanho e mtime iguais bastam; se só o mtime mudou, o hash do conteúdo decide.
+    """
+    if not meta_path.exists():
+        return False, None
+    try:
+        meta = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return False, None
+
+    stat = path.stat()
+    if meta.get("size") == stat.st_size and meta.get("mtime_ns") == stat.st_mtime_ns:
+        return True, meta
+
+    if meta.get("size") != stat.st_size:
+        return False, None
 
-def load_nf_items():
-    path = DATA_PATH / "IACOMPRAS_NOTAFISCALITENS_2025.xlsx"
+    atual = fingerprint_arquivo(path)
+    if atual["sha1"] == meta.get("sha1"):
+        # Conteúdo idêntico (ex.: arquivo copiado/tocado): apenas atualiza o mtime registrado
+        meta_path.write_text(json.dumps(atual))
+        return True, atual
+    return False, None
+
+
+def read_excel_cached(path):
+    """
+    Lê um workbook Excel usando o cache colunar em Parquet.
+    Na primeira leitura (ou quando o arquivo muda) converte o XLSX e grava o cache;
+    nas seguintes lê direto do Parquet.
+    """
+    path = Path(path)
     if not path.exists():
         raise FileNotFoundError(f"Arquivo não encontrado: {path}")
-    return pd.read_excel(path)
 
+    parquet_path, meta_path = _cache_paths(path)
+    valido, _ = _cache_valido(path, meta_path)
+    if valido and parquet_path.exists():
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception as e:
+            print(f"[!] Cache inválido para {path.name}, relendo o Excel: {e}")
+
+    df = pd.read_excel(path)
+
+    try:
+        os.makedirs(parquet_path.parent, exist_ok=True)
+        tmp_path = parquet_path.with_suffix(".parquet.tmp")
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        meta_path.write_text(json.dumps(fingerprint_arquivo(path)))
+    except Exception as e:
+        print(f"[!] Não foi possível gravar o cache de {path.name}: {e}")
+
+    return df
+
+
+def _cache_em_dia(path):
+    parquet_path, meta_path = _cache_paths(path)
+    return parquet_path.exists() and _cache_valido(path, meta_path)[0]
+
+
+def ler_workbooks_paralelo(paths, max_workers=None):
+    """
+    Lê vários workbooks de uma vez e retorna {path: DataFrame}.
+    O parse do XLSX é limitado por CPU, então os arquivos sem cache válido são
+    convertidos em paralelo num pool de processos (cada processo grava o seu
+    cache Parquet); os demais são lidos direto do cache.
+    """
+    paths = [Path(p) for p in paths]
+    for path in paths:
+        if not path.exists():
+            raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    frames = {}
+    pendentes = [p for p in paths if not _cache_em_dia(p)]
+    if len(pendentes) > 1:
+        workers = max_workers or WORKERS_LEITURA or min(len(pendentes), os.cpu_count() or 1)
+        print(f"[*] Lendo {len(pendentes)} workbooks em paralelo ({workers} processos)...")
+        try:
+            # spawn: o processo pai pode ter threads (servidor ADK), o que torna o fork inseguro
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as pool:
+                frames = dict(zip(pendentes, pool.map(read_excel_cached, pendentes)))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"[!] Pool de processos indisponível, lendo sequencialmente: {e}")
+
+    return {p: frames[p] if p in frames else read_excel_cached(p) for p in paths}
+
+
+def nf_paths(periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Retorna os caminhos (cabeçalhos, itens) dos workbooks do período.
+    """
+    if periodo not in NF_ARQUIVOS:
+        raise ValueError(f"Período desconhecido: {periodo}. Disponíveis: {list(NF_ARQUIVOS)}")
+    base = Path(data_path) if data_path else DATA_PATH
+    headers_file, items_file = NF_ARQUIVOS[periodo]
+    return base / headers_file, base / items_file
+
+
+def normalizar_cnpj(series):
+    """
+    Normaliza CNPJs (numéricos ou formatados) para texto com 14 dígitos.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        series = series.astype('Int64')
+    cnpj = series.astype(str).str.replace(r'\D', '', regex=True).str.zfill(14)
+    return cnpj.where(series.notna())
+
+
+def cnpj_canonico(cnpj):
+    """
+    Mesma normalização de normalizar_cnpj para um único valor (número, texto
+    formatado ou só dígitos). Retorna None quando não há dígitos.
+    """
+    if cnpj is None or (isinstance(cnpj, float) and pd.isna(cnpj)):
+        return None
+    if isinstance(cnpj, float) and cnpj.is_integer():
+        cnpj = int(cnpj)
+    digitos = "".join(filter(str.isdigit, str(cnpj)))
+    return digitos.zfill(14) if digitos else None
+
+
+def normalizar_headers(df_headers):
+    """
+    Remove espaços das razões sociais e normaliza os CNPJs dos cabeçalhos.
+    """
+    df_headers = df_headers.copy()
+    df_headers['RAZAO_FORNECEDOR'] = df_headers['RAZAO_FORNECEDOR'].str.strip()
+    df_headers['CNPJ_FORNECEDOR'] = normalizar_cnpj(df_headers['CNPJ_FORNECEDOR'])
+    return df_headers
+
+
+def aplicar_schema(df, schema):
+    """
+    Converte as colunas presentes no DataFrame para os tipos do schema
+    ('category' ou 'integer', este reduzido com pd.to_numeric(downcast=...)).
+    """
+    df = df.copy()
+    for col, tipo in schema.items():
+        if col not in df.columns:
+            continue
+        if tipo == 'category':
+            df[col] = df[col].astype('category')
+        elif tipo == 'integer' and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+@dataclass(frozen=True)
+class DatasetNF:
+    """
+    Conjunto imutável de notas fiscais de um período, compartilhado entre sessões.
+    Os DataFrames são somente leitura: use as funções load_nf_* para obter visões.
+    """
+    periodo: str
+    versao: str
+    assinatura: tuple
+    headers: pd.DataFrame
+    items: pd.DataFrame
+    fatos: pd.DataFrame
+
+
+_REGISTRO = {}
+_REGISTRO_LOCK = threading.RLock()
+
+# Arquivos de itens acima deste tamanho são agregados em modo streaming
+STREAMING_LIMIAR_BYTES = int(os.getenv("IACOMPRAS_STREAMING_LIMIAR_MB", "64")) * 1024 * 1024
+CHUNK_LINHAS = 50_000
+# Parciais acumulados antes de cada combinação (o acumulado não é reagrupado a cada bloco)
+BLOCOS_POR_COMBINACAO = 16
+
+# Atributos descritivos mantidos do registro mais recente de cada grupo
+ATRIBUTOS_ITEM = ['PRODUTO', 'VALOR_UNITARIO', 'GRUPO', 'MARCA']
+CHAVES_AGREGADOS = {
+    'fornecedor': ['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR'],
+    'produto': ['CODIGO_PRODUTO'],
+    'fornecedor_produto': ['RAZAO_FORNECEDOR', 'CODIGO_PRODUTO'],
+}
+
+
+def _assinatura(paths):
+    return tuple((p.name, p.stat().st_size, p.stat().st_mtime_ns) for p in paths)
+
+
+def _versao(assinatura):
+    return hashlib.sha1(json.dumps(assinatura).encode()).hexdigest()[:12]
+
+
+def versao_nf(periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Versão dos dados do período (hash do nome, tamanho e mtime dos workbooks),
+    a mesma de DatasetNF.versao, obtida sem carregar os arquivos.
+    """
+    return _versao(_assinatura(_paths_existentes(periodo, data_path)))
+
+
+def _registro_obter(chave, assinatura, construtor):
+    """
+    Busca um objeto no registro do processo, construindo-o (uma única vez,
+    sob lock) quando ausente ou quando a assinatura dos arquivos mudou.
+    """
+    entrada = _REGISTRO.get(chave)
+    if entrada is not None and entrada[0] == assinatura:
+        return entrada[1]
+
+    with _REGISTRO_LOCK:
+        entrada = _REGISTRO.get(chave)
+        if entrada is None or entrada[0] != assinatura:
+            entrada = (assinatura, construtor())
+            _REGISTRO[chave] = entrada
+    return entrada[1]
+
+
+def _paths_existentes(periodo, data_path):
+    paths = nf_paths(periodo, data_path)
+    for path in paths:
+        if not path.exists():
+            raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+    return paths
+
+
+def _chave_registro(paths, periodo, tipo):
+    return (str(paths[0].parent.resolve()), periodo, tipo)
+
+
+def _registro_em_dia(chave, assinatura):
+    entrada = _REGISTRO.get(chave)
+    return entrada is not None and entrada[0] == assinatura
+
+
+def _ler(path, frames):
+    return frames[path] if frames and path in frames else read_excel_cached(path)
+
+
+def _get_headers(periodo, data_path, frames=None):
+    paths = _paths_existentes(periodo, data_path)
+    return _registro_obter(
+        _chave_registro(paths, periodo, 'headers'),
+        _assinatura(paths[:1]),
+        lambda: aplicar_schema(normalizar_headers(_ler(paths[0], frames)), SCHEMA_NF_HEADERS)
+    )
+
+
+def _montar_dataset(periodo, paths, assinatura, df_headers, frames=None):
+    df_items = aplicar_schema(_ler(paths[1], frames), SCHEMA_NF_ITENS)
+
+    df_fatos = df_items.merge(df_headers[COLUNAS_FATO_HEADER], on='CODIGO_COMPRA', how='left')
+
+    versao = _versao(assinatura)
+    print(f"[*] Registro de dados: período {periodo} carregado (versão {versao})")
+    return DatasetNF(periodo, versao, assinatura, df_headers, df_items, df_fatos)
+
+
+def get_nf_dataset(periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Retorna o DatasetNF do período a partir do registro do processo.
+    Os workbooks são lidos, normalizados e unidos uma única vez; o registro só
+    recarrega quando algum arquivo de origem muda no disco.
+    """
+    return _obter_dataset(periodo, data_path)
+
+
+def _obter_dataset(periodo, data_path, frames=None):
+    paths = _paths_existentes(periodo, data_path)
+    assinatura = _assinatura(paths)
+    df_headers = _get_headers(periodo, data_path, frames)
+    return _registro_obter(
+        _chave_registro(paths, periodo, 'dataset'),
+        assinatura,
+        lambda: _montar_dataset(periodo, paths, assinatura, df_headers, frames)
+    )
+
+
+def precarregar_nf(periodos=None, data_path=None, max_workers=None):
+    """
+    Carrega no registro os workbooks dos períodos informados (padrão: todos),
+    lendo em paralelo apenas os arquivos que ainda não estão no registro.
+    Arquivos de itens acima de STREAMING_LIMIAR_BYTES não são materializados
+    (seus agregados são calculados em blocos); desses períodos só os cabeçalhos
+    são carregados. Retorna {periodo: DatasetNF} dos períodos carregados por completo.
+    """
+    periodos = list(periodos or NF_ARQUIVOS)
+    paths_periodo = {periodo: _paths_existentes(periodo, data_path) for periodo in periodos}
+    completos = [p for p, paths in paths_periodo.items() if paths[1].stat().st_size < STREAMING_LIMIAR_BYTES]
+
+    pendentes = []
+    for periodo, paths in paths_periodo.items():
+        if not _registro_em_dia(_chave_registro(paths, periodo, 'headers'), _assinatura(paths[:1])):
+            pendentes.append(paths[0])
+        if periodo in completos and not _registro_em_dia(_chave_registro(paths, periodo, 'dataset'), _assinatura(paths)):
+            pendentes.append(paths[1])
+
+    frames = ler_workbooks_paralelo(pendentes, max_workers) if pendentes else {}
+
+    for periodo in periodos:
+        _get_headers(periodo, data_path, frames)
+    return {periodo: _obter_dataset(periodo, data_path, frames) for periodo in completos}
+
+
+def load_nf_headers(periodo=PERIODO_ATUAL, data_path=None):
+    """Cabeçalhos das notas fiscais (razão social e CNPJ normalizados)."""
+    return _get_headers(periodo, data_path).copy(deep=False)
+
+
+def load_nf_items(periodo=PERIODO_ATUAL, data_path=None):
+    """Itens das notas fiscais."""
+    return get_nf_dataset(periodo, data_path).items.copy(deep=False)
+
+
+def load_nf_fatos(periodo=PERIODO_ATUAL, data_path=None):
+    """Itens unidos aos dados do fornecedor de cada nota (CODIGO_COMPRA)."""
+    return get_nf_dataset(periodo, data_path).fatos.copy(deep=False)
+
+
+def iter_excel_chunks(path, chunksize=CHUNK_LINHAS):
+    """
+    Lê a primeira planilha do workbook em blocos de até `chunksize` linhas,
+    iterando as linhas em modo somente leitura (sem materializar o arquivo inteiro).
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        colunas = next(linhas, None)
+        if colunas is None:
+            return
+
+        bloco = []
+        for linha in linhas:
+            if all(v is None for v in linha):
+                continue
+            bloco.append(linha)
+            if len(bloco) >= chunksize:
+                yield pd.DataFrame(bloco, columns=colunas)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=colunas)
+    finally:
+        wb.close()
+
+
+def iter_blocos_excel(path, chunksize=CHUNK_LINHAS):
+    """
+    Itera um workbook em blocos: em streaming para arquivos acima de
+    STREAMING_LIMIAR_BYTES, senão um único bloco lido do cache Parquet.
+    """
+    path = Path(path)
+    if path.stat().st_size >= STREAMING_LIMIAR_BYTES:
+        yield from iter_excel_chunks(path, chunksize)
+    else:
+        yield read_excel_cached(path)
+
+
+def _agregar_bloco(df_fatos, tipo):
+    """
+    Estatísticas suficientes de um bloco de itens (com coluna 'linha' = posição
+    da linha no arquivo), agrupadas pelas chaves do tipo de agregado.
+    """
+    spec = {
+        'compras': ('CODIGO_PRODUTO', 'size'),
+        'soma_quantidade': ('QUANTIDADE_COMPRA', 'sum'),
+        'soma_valor_unitario': ('VALOR_UNITARIO', 'sum'),
+        'n_valor_unitario': ('VALOR_UNITARIO', 'count'),
+        'primeira_linha': ('linha', 'min'),
+        'ultima_linha': ('linha', 'max'),
+    }
+    spec.update({col: (col, 'last') for col in ATRIBUTOS_ITEM})
+    return df_fatos.groupby(CHAVES_AGREGADOS[tipo], sort=False, observed=True).agg(**spec)
+
+
+def _combinar_agregados(partes, tipo):
+    """
+    Combina agregados parciais: somas e contagens somam, posições usam min/max e
+    os atributos descritivos vêm do registro mais recente (maior 'ultima_linha').
+    """
+    df = pd.concat(partes).sort_values('ultima_linha', kind='stable')
+    grupos = df.groupby(level=CHAVES_AGREGADOS[tipo], observed=True)
+    combinado = grupos[['compras', 'soma_quantidade', 'soma_valor_unitario', 'n_valor_unitario']].sum()
+    combinado['primeira_linha'] = grupos['primeira_linha'].min()
+    combinado['ultima_linha'] = grupos['ultima_linha'].max()
+    combinado[ATRIBUTOS_ITEM] = grupos[ATRIBUTOS_ITEM].last()
+    return combinado
+
+
+def agregar_itens(df_fatos):
+    """
+    Calcula os agregados de itens (por fornecedor, por produto e por
+    fornecedor x produto) a partir de uma tabela fato em memória.
+    """
+    df = df_fatos.assign(linha=range(len(df_fatos)))
+    return {tipo: _combinar_agregados([_agregar_bloco(df, tipo)], tipo) for tipo in CHAVES_AGREGADOS}
+
+
+def agregar_itens_streaming(periodo=PERIODO_ATUAL, data_path=None, chunksize=CHUNK_LINHAS):
+    """
+    Calcula os mesmos agregados de agregar_itens lendo o workbook de itens em
+    blocos. Os parciais de cada bloco são combinados a cada BLOCOS_POR_COMBINACAO
+    blocos e uma última vez no fim; a memória fica limitada ao bloco mais os
+    parciais pendentes (combinações distintas de fornecedor e produto),
+    independente do total de linhas.
+    """
+    paths = _paths_existentes(periodo, data_path)
+    df_headers = _get_headers(periodo, data_path)[COLUNAS_FATO_HEADER]
+
+    parciais = {tipo: [] for tipo in CHAVES_AGREGADOS}
+    inicio = 0
+    for bloco in iter_excel_chunks(paths[1], chunksize):
+        bloco = bloco.merge(df_headers, on='CODIGO_COMPRA', how='left')
+        bloco['linha'] = range(inicio, inicio + len(bloco))
+        inicio += len(bloco)
+        for tipo in CHAVES_AGREGADOS:
+            parciais[tipo].append(_agregar_bloco(bloco, tipo))
+            if len(parciais[tipo]) > BLOCOS_POR_COMBINACAO:
+                parciais[tipo] = [_combinar_agregados(parciais[tipo], tipo)]
+        print(f"[*] Streaming de itens ({periodo}): {inicio} linhas processadas")
+    return {tipo: _combinar_agregados(partes, tipo) for tipo, partes in parciais.items() if partes}
+
+
+def get_agregados_itens(periodo=PERIODO_ATUAL, data_path=None, streaming=None):
+    """
+    Retorna os agregados de itens do período, calculados uma vez por versão dos dados.
+    Com streaming=None o modo é escolhido pelo tamanho do arquivo de itens
+    (STREAMING_LIMIAR_BYTES); em modo streaming a tabela fato não é materializada.
+    """
+    paths = _paths_existentes(periodo, data_path)
+    if streaming is None:
+        streaming = paths[1].stat().st_size >= STREAMING_LIMIAR_BYTES
+
+    if streaming:
+        construtor = lambda: agregar_itens_streaming(periodo, data_path)
+    else:
+        construtor = lambda: agregar_itens(get_nf_dataset(periodo, data_path).fatos)
+
+    return _registro_obter(
+        _chave_registro(paths, periodo, 'agregados'),
+        _assinatura(paths),
+        construtor
+    )
+
+
+def _somar_demanda(df_fatos):
+    datas = pd.to_datetime(df_fatos['DATA_COMPRA'])
+    df = df_fatos.assign(mes=datas.dt.strftime('%Y-%m'))
+    return df.groupby(['CODIGO_PRODUTO', 'mes'], observed=True)['QUANTIDADE_COMPRA'].sum()
+
+
+def demanda_mensal_streaming(periodo=PERIODO_ATUAL, data_path=None, chunksize=CHUNK_LINHAS):
+    """
+    Mesma demanda mensal de get_demanda_mensal, lendo o workbook de itens em blocos.
+    """
+    paths = _paths_existentes(periodo, data_path)
+    df_headers = _get_headers(periodo, data_path)[['CODIGO_COMPRA', 'DATA_COMPRA']]
+
+    parciais = []
+    for bloco in iter_excel_chunks(paths[1], chunksize):
+        parciais.append(_somar_demanda(bloco.merge(df_headers, on='CODIGO_COMPRA', how='left')))
+        if len(parciais) > BLOCOS_POR_COMBINACAO:
+            parciais = [pd.concat(parciais).groupby(level=[0, 1]).sum()]
+    if not parciais:
+        return pd.Series(dtype='float64', index=pd.MultiIndex.from_arrays([[], []], names=['CODIGO_PRODUTO', 'mes']))
+    return pd.concat(parciais).groupby(level=[0, 1]).sum()
+
+
+def get_demanda_mensal(periodo=PERIODO_ATUAL, data_path=None, streaming=None):
+    """
+    Quantidade comprada por produto e mês ('AAAA-MM') do período, calculada uma
+    vez por versão dos dados (Series indexada por CODIGO_PRODUTO e mes).
+    """
+    paths = _paths_existentes(periodo, data_path)
+    if streaming is None:
+        streaming = paths[1].stat().st_size >= STREAMING_LIMIAR_BYTES
+
+    if streaming:
+        construtor = lambda: demanda_mensal_streaming(periodo, data_path)
+    else:
+        construtor = lambda: _somar_demanda(get_nf_dataset(periodo, data_path).fatos)
+
+    return _registro_obter(
+        _chave_registro(paths, periodo, 'demanda'),
+        _assinatura(paths),
+        construtor
+    )
@@ -4,12 +4,22 @@ from datetime import datetime
 
 DB_PATH = "data/iacompras.db"
 
+def get_connection(db_path=None):
+    """
+    Conexão para gravar no banco, em modo WAL: consultas em andamento continuam
+    lendo o último commit enquanto o treino, a ingestão ou o índice de
+    fornecedores gravam. O modo fica registrado no arquivo do banco.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
 def db_init():
     """
     Inicializa o banco de dados SQLite com as tabelas necessárias.
     """
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
 
     # Tabela de execuções (runs)
@@ -33,6 +43,7 @@ def db_init():
         fornecedor_sugerido TEXT,
         custo_estimado REAL,
         prazo_estimado INTEGER,
+        risco_ruptura REAL,
         flags_auditoria TEXT,
         FOREIGN KEY (run_id) REFERENCES runs (id)
     )
@@ -115,10 +126,280 @@ def db_init():
     )
     ''')
 
+    # Notas fiscais ingeridas dos workbooks (mesmos nomes de coluna do Excel)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS notas_fiscais (
+        CODIGO_COMPRA INTEGER PRIMARY KEY,
+        NUMERO_NOTAFISCAL INTEGER,
+        DATA_COMPRA TEXT,
+        DATA_ENTREGA TEXT,
+        TOTAL_PRODUTOS REAL,
+        TOTAL_DESCONTO REAL,
+        TOTAL_NOTAFISCAL REAL,
+        FORMA_PAGTO TEXT,
+        CNPJ_FORNECEDOR TEXT,
+        RAZAO_FORNECEDOR TEXT,
+        CIDADE_FORNECEDOR TEXT,
+        UF_FORNECEDOR TEXT,
+        PRAZO_ENTREGA_DIAS INTEGER,
+        arquivo_origem TEXT,
+        fornecedor_id INTEGER
+    )
+    ''')
+
+    # Itens das notas fiscais (o id preserva a ordem de ingestão)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS nota_fiscal_itens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CODIGO_COMPRA INTEGER,
+        ITEM INTEGER,
+        CODIGO_PRODUTO TEXT,
+        PRODUTO TEXT,
+        QUANTIDADE_COMPRA REAL,
+        VALOR_UNITARIO REAL,
+        VALOR_DESCONTO REAL,
+        VALOR_LIQUIDO REAL,
+        GRUPO TEXT,
+        MARCA TEXT,
+        UNIDADE_MEDIDA TEXT,
+        arquivo_origem TEXT,
+        UNIQUE (CODIGO_COMPRA, ITEM)
+    )
+    ''')
+
+    # Índices do warehouse de notas fiscais (consultas por fornecedor e por produto).
+    # CODIGO_COMPRA já é indexado pela chave primária das notas e pelo UNIQUE dos itens.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nf_cnpj ON notas_fiscais (CNPJ_FORNECEDOR)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nf_razao ON notas_fiscais (RAZAO_FORNECEDOR)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nfi_produto ON nota_fiscal_itens (CODIGO_PRODUTO, arquivo_origem)")
+
+    # Marca d'água da ingestão incremental por arquivo de origem
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS nf_watermark (
+        arquivo TEXT PRIMARY KEY,
+        ultimo_codigo_compra INTEGER,
+        ultima_data_compra TEXT,
+        linhas INTEGER DEFAULT 0,
+        atualizado_em TEXT DEFAULT CURRENT_TIMESTAMP,
+        mtime_ns INTEGER,
+        tamanho INTEGER
+    )
+    ''')
+
+    # Migração: assinatura (mtime e tamanho) do arquivo ingerido
+    cursor.execute("PRAGMA table_info(nf_watermark)")
+    existing_columns = [col[1] for col in cursor.fetchall()]
+    for coluna in ('mtime_ns', 'tamanho'):
+        if coluna not in existing_columns:
+            cursor.execute(f"ALTER TABLE nf_watermark ADD COLUMN {coluna} INTEGER")
+
+    # Agregados mantidos incrementalmente pela ingestão
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agg_fornecedor (
+        CNPJ_FORNECEDOR TEXT PRIMARY KEY,
+        RAZAO_FORNECEDOR TEXT,
+        notas INTEGER DEFAULT 0,
+        valor_total REAL DEFAULT 0,
+        itens INTEGER DEFAULT 0,
+        soma_valor_unitario REAL DEFAULT 0,
+        ultima_compra TEXT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agg_produto (
+        CODIGO_PRODUTO TEXT PRIMARY KEY,
+        PRODUTO TEXT,
+        compras INTEGER DEFAULT 0,
+        soma_quantidade REAL DEFAULT 0
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agg_fornecedor_produto (
+        CNPJ_FORNECEDOR TEXT,
+        CODIGO_PRODUTO TEXT,
+        RAZAO_FORNECEDOR TEXT,
+        compras INTEGER DEFAULT 0,
+        soma_quantidade REAL DEFAULT 0,
+        soma_valor_unitario REAL DEFAULT 0,
+        ultimo_valor_unitario REAL,
+        PRIMARY KEY (CNPJ_FORNECEDOR, CODIGO_PRODUTO)
+    )
+    ''')
+
+    # Feature store de fornecedores: estatísticas suficientes por mês (somáveis entre meses)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS feature_fornecedor (
+        periodo TEXT,
+        mes TEXT,
+        CNPJ_FORNECEDOR TEXT,
+        RAZAO_FORNECEDOR TEXT,
+        fornecedor_id INTEGER,
+        notas INTEGER DEFAULT 0,
+        n_prazo INTEGER DEFAULT 0,
+        soma_prazo REAL DEFAULT 0,
+        soma_prazo2 REAL DEFAULT 0,
+        soma_total_notafiscal REAL DEFAULT 0,
+        soma_total_produtos REAL DEFAULT 0,
+        soma_total_desconto REAL DEFAULT 0,
+        n_valor_unitario INTEGER DEFAULT 0,
+        soma_valor_unitario REAL DEFAULT 0,
+        PRIMARY KEY (periodo, mes, CNPJ_FORNECEDOR, RAZAO_FORNECEDOR)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ff_cnpj ON feature_fornecedor (CNPJ_FORNECEDOR, periodo)")
+
+    _criar_tabelas_classificacao(cursor)
+
+    # Índice materializado dos melhores fornecedores por produto (ver ranking_tools)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS top_fornecedores_produto (
+        periodo TEXT,
+        CODIGO_PRODUTO TEXT,
+        posicao INTEGER,
+        RAZAO_FORNECEDOR TEXT,
+        CNPJ_FORNECEDOR TEXT,
+        rating INTEGER,
+        classificacao TEXT,
+        preco_medio REAL,
+        recurrencia_local INTEGER,
+        PRODUTO TEXT,
+        fornecedor_id INTEGER,
+        PRIMARY KEY (periodo, CODIGO_PRODUTO, posicao)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS top_fornecedores_estado (
+        periodo TEXT PRIMARY KEY,
+        k INTEGER,
+        version_id INTEGER,
+        versao_dados TEXT,
+        atualizado_em TEXT
+    )
+    ''')
+
+    # Dimensões com chaves substitutas inteiras (ver resolucao_tools): o id de um
+    # fornecedor (chave de nome normalizada) ou produto nunca muda depois de criado
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS dim_fornecedor (
+        fornecedor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chave TEXT UNIQUE NOT NULL,
+        RAZAO_FORNECEDOR TEXT,
+        CNPJ_FORNECEDOR TEXT,
+        atualizado_em TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS dim_produto (
+        produto_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CODIGO_PRODUTO TEXT UNIQUE NOT NULL,
+        PRODUTO TEXT,
+        GRUPO TEXT,
+        MARCA TEXT,
+        atualizado_em TEXT
+    )
+    ''')
+
+    # Migração: risco de ruptura calculado pelo planejador
+    cursor.execute("PRAGMA table_info(run_items)")
+    if 'risco_ruptura' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE run_items ADD COLUMN risco_ruptura REAL")
+
+    # Migração: chaves das dimensões nas tabelas de itens
+    for tabela in ('run_items', 'orcamento_itens', 'cotacoes'):
+        cursor.execute(f"PRAGMA table_info({tabela})")
+        existing_columns = [col[1] for col in cursor.fetchall()]
+        for coluna in ('fornecedor_id', 'produto_id'):
+            if coluna not in existing_columns:
+                cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} INTEGER")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_produto ON {tabela} (produto_id)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_fornecedor ON {tabela} (fornecedor_id)")
+
+    # Migração: fornecedor resolvido (dim_fornecedor) nas notas e no índice de fornecedores por
+    # produto; o índice antigo, ordenado por razão social, é reconstruído na próxima consulta
+    cursor.execute("PRAGMA table_info(notas_fiscais)")
+    if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE notas_fiscais ADD COLUMN fornecedor_id INTEGER")
+    cursor.execute("PRAGMA table_info(top_fornecedores_produto)")
+    if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE top_fornecedores_produto ADD COLUMN fornecedor_id INTEGER")
+        cursor.execute("DELETE FROM top_fornecedores_estado")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nf_fornecedor ON notas_fiscais (fornecedor_id)")
+
+    # Migração: feature store somada por fornecedor_id (preenchido pela ingestão incremental)
+    cursor.execute("PRAGMA table_info(feature_fornecedor)")
+    if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE feature_fornecedor ADD COLUMN fornecedor_id INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ff_fornecedor ON feature_fornecedor (fornecedor_id, periodo)")
+
     conn.commit()
     conn.close()
     return f"Banco de dados inicializado em {DB_PATH}"
 
+# Colunas da classificação por fornecedor (mesma ordem da antiga fornecedores_classificados,
+# mais o fornecedor_id de dim_fornecedor)
+COLUNAS_CLASSIFICACAO = [
+    'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'avg_lead_time', 'std_lead_time', 'recurrence',
+    'total_spent', 'total_products_value', 'total_discount', 'discount_rate', 'avg_item_price',
+    'score', 'rating', 'classificacao', 'fornecedor_id'
+]
+MODELO_CLASSIFICADOR = "classificador_fornecedores"
+
+def _criar_tabelas_classificacao(cursor):
+    """
+    Registro versionado do classificador: cada treino grava uma versão nova e o
+    ponteiro em model_active indica a versão em uso.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS model_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        modelo TEXT,
+        dt_execucao TEXT,
+        hash_treino TEXT,
+        mae REAL,
+        mae_cv REAL,
+        n_fornecedores INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS supplier_classifications (
+        version_id INTEGER,
+        RAZAO_FORNECEDOR TEXT,
+        CNPJ_FORNECEDOR TEXT,
+        avg_lead_time REAL,
+        std_lead_time REAL,
+        recurrence INTEGER,
+        total_spent REAL,
+        total_products_value REAL,
+        total_discount REAL,
+        discount_rate REAL,
+        avg_item_price REAL,
+        score REAL,
+        rating INTEGER,
+        classificacao TEXT,
+        fornecedor_id INTEGER,
+        PRIMARY KEY (version_id, CNPJ_FORNECEDOR, RAZAO_FORNECEDOR),
+        FOREIGN KEY (version_id) REFERENCES model_versions (id)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sc_cnpj ON supplier_classifications (CNPJ_FORNECEDOR, version_id)")
+    # Migração: versões anteriores ficam sem fornecedor_id (resolvido pela razão social na leitura)
+    cursor.execute("PRAGMA table_info(supplier_classifications)")
+    if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE supplier_classifications ADD COLUMN fornecedor_id INTEGER")
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS model_active (
+        modelo TEXT PRIMARY KEY,
+        version_id INTEGER,
+        updated_at TEXT,
+        FOREIGN KEY (version_id) REFERENCES model_versions (id)
+    )
+    ''')
+
 def db_insert_run(user_query, status="started"):
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
@@ -144,10 +425,148 @@ def db_upsert_supplier(cnpj, razao, cidade, uf, brasilapi_json):
     conn.commit()
     conn.close()
 
+def db_get_active_model_version(modelo=MODELO_CLASSIFICADOR, db_path=None):
+    """
+    Retorna a versão ativa do modelo (dict de model_versions) ou None.
+    """
+    db_path = db_path or DB_PATH
+    if not os.path.exists(db_path):
+        return None
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='model_active'")
+        if not cursor.fetchone():
+            return None
+        cursor.execute('''
+        SELECT v.* FROM model_active a
+        JOIN model_versions v ON v.id = a.version_id
+        WHERE a.modelo = ?
+        ''', (modelo,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row))
+    finally:
+        conn.close()
+
+def db_register_model_version(df_classificacao, dt_execucao, hash_treino=None, mae=None, mae_cv=None,
+                              modelo=MODELO_CLASSIFICADOR, ativar=True, db_path=None):
+    """
+    Grava uma nova versão da classificação de fornecedores e (por padrão) a torna ativa.
+    A versão é escrita em uma única transação; leitores continuam vendo a versão
+    anterior até o ponteiro ser trocado no commit.
+    df_classificacao: DataFrame com as colunas de COLUNAS_CLASSIFICACAO.
+    """
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    try:
+        _criar_tabelas_classificacao(cursor)
+        cursor.execute('''
+        INSERT INTO model_versions (modelo, dt_execucao, hash_treino, mae, mae_cv, n_fornecedores)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (modelo, dt_execucao, hash_treino, mae, mae_cv, len(df_classificacao)))
+        version_id = cursor.lastrowid
+
+        df = df_classificacao[COLUNAS_CLASSIFICACAO].astype(object)
+        df = df.where(df.notna(), None)
+        linhas = [(version_id, *row) for row in df.itertuples(index=False, name=None)]
+        cursor.executemany(f'''
+        INSERT INTO supplier_classifications (version_id, {", ".join(COLUNAS_CLASSIFICACAO)})
+        VALUES ({", ".join("?" * (len(COLUNAS_CLASSIFICACAO) + 1))})
+        ''', linhas)
+
+        if ativar:
+            _set_active(cursor, modelo, version_id)
+        conn.commit()
+        return version_id
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+
+def _set_active(cursor, modelo, version_id):
+    cursor.execute('''
+    INSERT INTO model_active (modelo, version_id, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(modelo) DO UPDATE SET version_id=excluded.version_id, updated_at=excluded.updated_at
+    ''', (modelo, version_id, datetime.now().isoformat()))
+
+def db_set_active_model_version(version_id, modelo=MODELO_CLASSIFICADOR):
+    """
+    Aponta a versão ativa do modelo para version_id (ex.: rollback para uma versão anterior).
+    """
+    conn = get_connection(DB_PATH)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM model_versions WHERE id = ? AND modelo = ?", (version_id, modelo))
+        if not cursor.fetchone():
+            raise ValueError(f"Versão {version_id} do modelo {modelo} não encontrada.")
+        _set_active(cursor, modelo, version_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+def db_list_model_versions(modelo=MODELO_CLASSIFICADOR):
+    """
+    Lista as versões gravadas do modelo (mais recente primeiro), indicando a ativa.
+    """
+    if not os.path.exists(DB_PATH):
+        return []
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='model_versions'")
+        if not cursor.fetchone():
+            return []
+        cursor.execute('''
+        SELECT v.*, (a.version_id IS NOT NULL) AS ativa
+        FROM model_versions v
+        LEFT JOIN model_active a ON a.version_id = v.id AND a.modelo = v.modelo
+        WHERE v.modelo = ?
+        ORDER BY v.id DESC
+        ''', (modelo,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def db_get_classified_suppliers(version_id):
+    """
+    Recupera a classificação de fornecedores de uma versão específica (consulta indexada).
+    """
+    if not os.path.exists(DB_PATH):
+        return []
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'''
+        SELECT {", ".join("c." + col for col in COLUNAS_CLASSIFICACAO)}, v.dt_execucao
+        FROM supplier_classifications c
+        JOIN model_versions v ON v.id = c.version_id
+        WHERE c.version_id = ?
+        ''', (version_id,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
 def db_get_latest_classified_suppliers():
     """
-    Recupera a última execução do classificador de fornecedores do banco de dados.
+    Recupera a classificação de fornecedores da versão ativa do classificador.
+    Bancos sem registro de versões usam a última execução da tabela antiga
+    fornecedores_classificados.
     """
+    versao = db_get_active_model_version()
+    if versao:
+        return db_get_classified_suppliers(versao['id'])
+
     if not os.path.exists(DB_PATH):
         return []
     
@@ -176,11 +595,62 @@ def db_get_latest_classified_suppliers():
     conn.close()
     return results
 
-def db_insert_orcamento(razao_fornecedor, valor_total, itens, cnpj_fornecedor=None):
+def _tabela_existe(cursor, tabela):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (tabela,))
+    return cursor.fetchone() is not None
+
+def _sincronizar_dimensao(tabela, coluna_id, coluna_chave, colunas, registros):
+    """
+    Insere as chaves novas na dimensão (na ordem recebida), atualiza os
+    atributos das existentes e retorna {chave: id}. None se o banco ou a
+    tabela ainda não existem (db_init não executado).
+    """
+    if not os.path.exists(DB_PATH):
+        return None
+
+    conn = get_connection(DB_PATH)
+    cursor = conn.cursor()
+    try:
+        if not _tabela_existe(cursor, tabela):
+            return None
+        agora = datetime.now().isoformat()
+        cursor.executemany(f'''
+        INSERT INTO {tabela} ({coluna_chave}, {", ".join(colunas)}, atualizado_em)
+        VALUES (?, {", ".join("?" * len(colunas))}, ?)
+        ON CONFLICT({coluna_chave}) DO UPDATE SET
+            {", ".join(f"{col}=excluded.{col}" for col in colunas)}, atualizado_em=excluded.atualizado_em
+        WHERE {" OR ".join(f"{col} IS NOT excluded.{col}" for col in colunas)}
+        ''', [(*registro, agora) for registro in registros])
+        conn.commit()
+        cursor.execute(f"SELECT {coluna_chave}, {coluna_id} FROM {tabela}")
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+def db_sync_dim_fornecedor(registros):
+    """
+    Sincroniza dim_fornecedor com [(chave, razao_social, cnpj), ...].
+    Retorna {chave: fornecedor_id} ou None sem banco inicializado.
+    """
+    return _sincronizar_dimensao(
+        'dim_fornecedor', 'fornecedor_id', 'chave', ['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR'], registros
+    )
+
+def db_sync_dim_produto(registros):
+    """
+    Sincroniza dim_produto com [(codigo_produto, produto, grupo, marca), ...].
+    Retorna {codigo_produto: produto_id} ou None sem banco inicializado.
+    """
+    return _sincronizar_dimensao(
+        'dim_produto', 'produto_id', 'CODIGO_PRODUTO', ['PRODUTO', 'GRUPO', 'MARCA'], registros
+    )
+
+def db_insert_orcamento(razao_fornecedor, valor_total, itens, cnpj_fornecedor=None, fornecedor_id=None):
     """
     Insere um orçamento e seus itens no banco.
-    itens: lista de dicts [{'codigo_produto', 'preco_unitario', 'recorrencia'}, ...]
+    itens: lista de dicts [{'codigo_produto', 'preco_unitario', 'recorrencia', 'produto_id'}, ...]
     cnpj_fornecedor: CNPJ do fornecedor para consultar telefone via BrasilAPI
+    fornecedor_id / produto_id: chaves de dim_fornecedor / dim_produto já resolvidas (opcionais)
     """
     from iacompras.tools.external_tools import brasilapi_cnpj_lookup
     
@@ -208,9 +678,11 @@ def db_insert_orcamento(razao_fornecedor, valor_total, itens, cnpj_fornecedor=No
         
         for item in itens:
             cursor.execute('''
-                INSERT INTO orcamento_itens (orcamento_id, codigo_produto, preco_unitario, recorrencia)
-                VALUES (?, ?, ?, ?)
-            ''', (orc_id, item['codigo_produto'], item['preco_unitario'], item['recorrencia']))
+                INSERT INTO orcamento_itens (orcamento_id, codigo_produto, preco_unitario, recorrencia,
+                                             fornecedor_id, produto_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (orc_id, item['codigo_produto'], item['preco_unitario'], item['recorrencia'],
+                  fornecedor_id, item.get('produto_id')))
         
         conn.commit()
         return orc_id
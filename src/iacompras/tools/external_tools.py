@@ -1,6 +1,7 @@
 import requests
 import sqlite3
 from iacompras.tools.db_tools import db_upsert_supplier, DB_PATH
+from iacompras.tools.data_tools import cnpj_canonico
 
 def brasilapi_cnpj_lookup(cnpj):
     """
@@ -9,9 +10,10 @@ def brasilapi_cnpj_lookup(cnpj):
     """
     print(f"Consultando BrasilAPI para CNPJ: {cnpj}")
 
-    # Limpa o CNPJ (deixa apenas números) e garante 14 dígitos com zeros à esquerda
-    cnpj_clean = "".join(filter(str.isdigit, str(cnpj)))
-    cnpj_clean = cnpj_clean.zfill(14)  # Padding para 14 dígitos
+    # Mesma normalização das notas fiscais: apenas números, 14 dígitos com zeros à esquerda
+    cnpj_clean = cnpj_canonico(cnpj)
+    if cnpj_clean is None:
+        return {"error": f"CNPJ inválido: {cnpj}"}
     
     # 1. Tentar buscar no Cache (SQLite)
     conn = sqlite3.connect(DB_PATH)
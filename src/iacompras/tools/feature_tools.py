@@ -0,0 +1,275 @@
+"""
+Feature store de fornecedores - IACOMPRAS
+Guarda, por (fornecedor, mês), estatísticas suficientes das notas e itens
+(contagens, somas e somas de quadrados). Como são somáveis, novos meses entram
+por upsert na ingestão incremental e as features de qualquer conjunto de meses
+ou períodos são obtidas somando as linhas, sem reprocessar o histórico:
+
+    média = soma / n        desvio = sqrt((soma2 - soma² / n) / (n - 1))
+
+As linhas guardam a razão social e o CNPJ como vieram nas notas, com o
+fornecedor_id resolvido; as features são somadas por fornecedor_id, então
+grafias e filiais (CNPJs) do mesmo fornecedor formam uma única linha.
+"""
+import sqlite3
+import numpy as np
+import pandas as pd
+from iacompras.tools.db_tools import DB_PATH
+from iacompras.tools.data_tools import PERIODO_ATUAL, get_agregados_itens
+from iacompras.tools.warehouse_tools import wh_disponivel
+from iacompras.tools.resolucao_tools import get_indice_fornecedores, load_nf_headers_chaves, load_nf_fatos_chaves
+
+# Granularidade das estatísticas (feature store); as features saem por fornecedor_id
+CHAVES_FEATURE = ['fornecedor_id', 'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR']
+
+COLUNAS_FS_NOTAS = [
+    'notas', 'n_prazo', 'soma_prazo', 'soma_prazo2',
+    'soma_total_notafiscal', 'soma_total_produtos', 'soma_total_desconto'
+]
+COLUNAS_FS_ITENS = ['n_valor_unitario', 'soma_valor_unitario']
+
+# Janelas (em dias, até a data de referência) das features recentes por fornecedor
+JANELAS_DIAS = (90, 180, 365)
+
+
+def colunas_janelas(janelas=JANELAS_DIAS):
+    """Nomes das features por janela, na ordem usada pelo modelo."""
+    return [f"{feature}_{dias}d" for dias in janelas
+            for feature in ('avg_lead_time', 'recurrence', 'discount_rate')]
+
+
+def _mes(datas):
+    return pd.to_datetime(datas).dt.strftime('%Y-%m').fillna('')
+
+
+def estatisticas_notas(df_notas):
+    """
+    Estatísticas suficientes das notas (com fornecedor_id, ver
+    resolucao_tools.load_nf_headers_chaves) por fornecedor e mês da compra.
+    """
+    prazo = df_notas['PRAZO_ENTREGA_DIAS'].astype('float64')
+    df = df_notas.assign(mes=_mes(df_notas['DATA_COMPRA']), _prazo=prazo, _prazo2=prazo ** 2)
+    return df.groupby(CHAVES_FEATURE + ['mes'], observed=True, dropna=False).agg(
+        notas=('CODIGO_COMPRA', 'count'),
+        n_prazo=('_prazo', 'count'),
+        soma_prazo=('_prazo', 'sum'),
+        soma_prazo2=('_prazo2', 'sum'),
+        soma_total_notafiscal=('TOTAL_NOTAFISCAL', 'sum'),
+        soma_total_produtos=('TOTAL_PRODUTOS', 'sum'),
+        soma_total_desconto=('TOTAL_DESCONTO', 'sum')
+    )
+
+
+def estatisticas_itens(df_fatos):
+    """Estatísticas suficientes dos itens (já unidos à nota, com fornecedor_id) por fornecedor e mês da compra."""
+    df = df_fatos.assign(mes=_mes(df_fatos['DATA_COMPRA']))
+    return df.groupby(CHAVES_FEATURE + ['mes'], observed=True, dropna=False).agg(
+        n_valor_unitario=('VALOR_UNITARIO', 'count'),
+        soma_valor_unitario=('VALOR_UNITARIO', 'sum')
+    )
+
+
+def features_de_estatisticas(df_notas, df_itens=None):
+    """
+    Combina estatísticas (de qualquer granularidade: mês, período ou já somadas,
+    com o nível fornecedor_id no índice) nas features por fornecedor_id usadas
+    pelo classificador.
+    """
+    soma = df_notas[COLUNAS_FS_NOTAS].groupby(level='fornecedor_id').sum()
+    soma = soma[(soma['notas'] > 0) & (soma.index >= 0)]
+    if df_itens is not None:
+        soma = soma.join(df_itens[COLUNAS_FS_ITENS].groupby(level='fornecedor_id').sum())
+    else:
+        soma[COLUNAS_FS_ITENS] = 0
+
+    n = soma['n_prazo']
+    variancia = ((soma['soma_prazo2'] - soma['soma_prazo'] ** 2 / n) / (n - 1)).clip(lower=0)
+
+    features = pd.DataFrame({
+        'avg_lead_time': soma['soma_prazo'] / n,
+        'std_lead_time': np.sqrt(variancia),
+        'recurrence': soma['notas'].astype('int64'),
+        'total_spent': soma['soma_total_notafiscal'],
+        'total_products_value': soma['soma_total_produtos'],
+        'total_discount': soma['soma_total_desconto'],
+    }).fillna(0)
+
+    features['discount_rate'] = (
+        features['total_discount'] /
+        (features['total_products_value'] + 1e-6)
+    )
+    features['avg_item_price'] = soma['soma_valor_unitario'] / soma['n_valor_unitario']
+    return features.fillna(0)
+
+
+def features_janelas(df_notas, data_referencia=None, janelas=JANELAS_DIAS):
+    """
+    Prazo médio, recorrência e taxa de desconto de cada fornecedor nos últimos
+    N dias antes de `data_referencia` (padrão: última compra de df_notas).
+    Calculado para todos os fornecedores de uma vez: cada janela é uma máscara
+    sobre as notas e as somas por fornecedor saem de np.bincount nos códigos
+    do fornecedor_id.
+    """
+    ids = df_notas['fornecedor_id'].to_numpy(dtype='int64')
+    codigos, chaves = pd.factorize(ids)
+    validos = ids >= 0
+    n_grupos = len(chaves)
+
+    datas = pd.to_datetime(df_notas['DATA_COMPRA'])
+    referencia = pd.Timestamp(data_referencia) if data_referencia is not None else datas.max()
+    dias = (referencia - datas).dt.days.to_numpy(dtype='float64', na_value=np.nan)
+
+    prazo = df_notas['PRAZO_ENTREGA_DIAS'].to_numpy(dtype='float64', na_value=np.nan)
+    desconto = df_notas['TOTAL_DESCONTO'].to_numpy(dtype='float64', na_value=np.nan)
+    produtos = df_notas['TOTAL_PRODUTOS'].to_numpy(dtype='float64', na_value=np.nan)
+    tem_prazo = ~np.isnan(prazo)
+
+    def _somar(mascara, pesos=None):
+        if pesos is not None:
+            mascara = mascara & ~np.isnan(pesos)
+            pesos = pesos[mascara]
+        return np.bincount(codigos[mascara], weights=pesos, minlength=n_grupos)
+
+    colunas = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for janela in janelas:
+            na_janela = validos & (dias >= 0) & (dias < janela)
+            n_prazo = _somar(na_janela & tem_prazo)
+            colunas[f'avg_lead_time_{janela}d'] = np.nan_to_num(_somar(na_janela, prazo) / n_prazo)
+            colunas[f'recurrence_{janela}d'] = _somar(na_janela).astype('int64')
+            colunas[f'discount_rate_{janela}d'] = _somar(na_janela, desconto) / (_somar(na_janela, produtos) + 1e-6)
+
+    janelas_df = pd.DataFrame(colunas, index=pd.Index(chaves, name='fornecedor_id'))
+    return janelas_df[janelas_df.index >= 0][colunas_janelas(janelas)]
+
+
+def fs_disponivel(periodo=PERIODO_ATUAL, data_path=None):
+    """Indica se o período está ingerido e com a feature store preenchida."""
+    if not wh_disponivel(periodo, data_path):
+        return False
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='feature_fornecedor'")
+        if not cursor.fetchone():
+            return False
+        cursor.execute("SELECT 1 FROM feature_fornecedor WHERE periodo = ? LIMIT 1", (periodo,))
+        if not cursor.fetchone():
+            print(f"[!] Feature store vazia para {periodo}. Execute a ingestão com --completo.")
+            return False
+        cursor.execute("PRAGMA table_info(feature_fornecedor)")
+        if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+            return False
+        cursor.execute("SELECT 1 FROM feature_fornecedor WHERE periodo = ? AND fornecedor_id IS NULL LIMIT 1", (periodo,))
+        if cursor.fetchone():
+            print(f"[!] Feature store de {periodo} sem fornecedor_id. Execute a ingestão incremental.")
+            return False
+    finally:
+        conn.close()
+    return True
+
+
+def fs_estatisticas(periodos, mes_inicio=None, mes_fim=None, fornecedor_ids=None):
+    """
+    Soma as estatísticas da feature store por fornecedor_id nos períodos/meses
+    informados, opcionalmente só para alguns fornecedores (consulta indexada).
+    """
+    colunas = ", ".join(f"SUM({c}) AS {c}" for c in COLUNAS_FS_NOTAS + COLUNAS_FS_ITENS)
+    filtro = f"periodo IN ({','.join('?' * len(periodos))})"
+    params = list(periodos)
+    if mes_inicio:
+        filtro += " AND mes >= ?"
+        params.append(mes_inicio)
+    if mes_fim:
+        filtro += " AND mes <= ?"
+        params.append(mes_fim)
+    if fornecedor_ids is not None:
+        filtro += f" AND fornecedor_id IN ({','.join('?' * len(fornecedor_ids))})"
+        params += [int(i) for i in fornecedor_ids]
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        df = pd.read_sql_query(f'''
+        SELECT fornecedor_id, {colunas}
+        FROM feature_fornecedor
+        WHERE {filtro}
+        GROUP BY fornecedor_id
+        ''', conn, params=params)
+    finally:
+        conn.close()
+    return df.set_index('fornecedor_id')
+
+
+def get_features_fornecedores(periodos=(PERIODO_ATUAL,), data_path=None, mes_inicio=None, mes_fim=None,
+                              cnpjs=None, janelas=None):
+    """
+    Features por fornecedor_id dos períodos informados (opcionalmente restritas a
+    um intervalo de meses 'AAAA-MM' e aos fornecedores de alguns CNPJs
+    normalizados), com o nome canônico e o CNPJ principal de cada fornecedor.
+    Lê da feature store quando todos os períodos estão ingeridos; senão calcula
+    as mesmas estatísticas em memória. Com `janelas` (ex.: JANELAS_DIAS) inclui
+    as features dos últimos N dias de cada período (ver features_janelas), contadas
+    a partir da última compra do período, com ou sem filtro de CNPJs.
+    """
+    if isinstance(periodos, str):
+        periodos = [periodos]
+    periodos = list(periodos)
+
+    indice = get_indice_fornecedores(data_path=data_path)
+    ids = None
+    if cnpjs:
+        ids = np.unique(indice.resolver_varios(cnpjs))
+        ids = ids[ids >= 0]
+
+    features = _features_historico(periodos, data_path, mes_inicio, mes_fim, ids)
+    posicoes = indice.posicoes(features.index.to_numpy())
+    features.insert(0, 'RAZAO_FORNECEDOR', indice.razoes[posicoes].to_numpy(dtype=object))
+    features.insert(1, 'CNPJ_FORNECEDOR', indice.cnpjs[posicoes])
+    if not janelas:
+        return features
+
+    df_notas = pd.concat([load_nf_headers_chaves(periodo, data_path) for periodo in periodos])
+    if mes_fim:
+        df_notas = df_notas[_mes(df_notas['DATA_COMPRA']) <= mes_fim]
+    # Referência das janelas: última compra do período, não a do fornecedor filtrado
+    referencia = pd.to_datetime(df_notas['DATA_COMPRA']).max()
+    if ids is not None:
+        df_notas = df_notas[df_notas['fornecedor_id'].isin(ids)]
+    recentes = features_janelas(df_notas, data_referencia=referencia, janelas=janelas)
+    return features.join(recentes).fillna({col: 0 for col in recentes.columns})
+
+
+def _features_historico(periodos, data_path, mes_inicio, mes_fim, ids):
+
+    if all(fs_disponivel(periodo, data_path) for periodo in periodos):
+        df = fs_estatisticas(periodos, mes_inicio, mes_fim, ids)
+        return features_de_estatisticas(df, df)
+
+    def _dos_fornecedores(df):
+        if ids is None:
+            return df
+        return df[df.index.get_level_values('fornecedor_id').isin(ids)]
+
+    def _no_intervalo(df):
+        mes = df.index.get_level_values('mes')
+        mascara = np.ones(len(df), dtype=bool)
+        if mes_inicio:
+            mascara &= mes >= mes_inicio
+        if mes_fim:
+            mascara &= mes <= mes_fim
+        return df[mascara]
+
+    indice = get_indice_fornecedores(data_path=data_path)
+    notas, itens = [], []
+    for periodo in periodos:
+        notas.append(_dos_fornecedores(_no_intervalo(estatisticas_notas(load_nf_headers_chaves(periodo, data_path)))))
+        if mes_inicio or mes_fim:
+            itens.append(_dos_fornecedores(_no_intervalo(estatisticas_itens(load_nf_fatos_chaves(periodo, data_path)))))
+        else:
+            # Sem recorte por mês os agregados por fornecedor bastam (e funcionam em streaming)
+            agregados = get_agregados_itens(periodo, data_path)['fornecedor'][COLUNAS_FS_ITENS]
+            razoes = agregados.index.get_level_values('RAZAO_FORNECEDOR')
+            agregados = agregados.set_axis(pd.Index(indice.ids_razoes(razoes), name='fornecedor_id'))
+            itens.append(_dos_fornecedores(agregados))
+    return features_de_estatisticas(pd.concat(notas), pd.concat(itens))
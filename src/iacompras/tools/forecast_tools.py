@@ -0,0 +1,114 @@
+"""
+Previsão de demanda por produto - IACOMPRAS
+Monta a matriz produto x mês com as quantidades compradas nas notas fiscais e
+aplica suavização exponencial simples a todos os produtos de uma vez: o laço
+percorre apenas os meses e cada passo é uma operação sobre a coluna inteira.
+
+    nível[t] = alpha * demanda[t] + (1 - alpha) * nível[t - 1]
+
+A previsão do próximo mês é o último nível. O resultado fica em cache por
+versão dos dados (ver data_tools.versao_nf) e só é recalculado quando algum
+workbook muda.
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+from iacompras.tools.data_tools import NF_ARQUIVOS, get_demanda_mensal, versao_nf
+
+# Peso do mês mais recente na suavização exponencial
+ALPHA_DEMANDA = float(os.getenv("IACOMPRAS_ALPHA_DEMANDA", "0.3"))
+
+_PREVISOES = {}
+_PREVISOES_LOCK = threading.Lock()
+
+
+def matriz_demanda(demanda):
+    """
+    Converte a demanda por (CODIGO_PRODUTO, mes 'AAAA-MM') em uma matriz densa
+    produto x mês, com zeros nos meses sem compra e todos os meses entre o
+    primeiro e o último registro. Retorna (produtos, meses, matriz).
+    """
+    demanda = demanda[demanda.index.get_level_values('mes') != '']
+    codigos_produto, produtos = pd.factorize(demanda.index.get_level_values('CODIGO_PRODUTO'), sort=True)
+    # Converte só os meses distintos; cada linha recebe o ordinal pelo código
+    codigos_mes, meses_distintos = pd.factorize(demanda.index.get_level_values('mes'))
+    meses_distintos = pd.PeriodIndex(meses_distintos, freq='M')
+    ordinal = meses_distintos.asi8[codigos_mes]
+
+    if len(ordinal) == 0:
+        return pd.Index(produtos, name='CODIGO_PRODUTO'), pd.PeriodIndex([], freq='M'), np.zeros((len(produtos), 0))
+
+    inicio = ordinal.min()
+    n_meses = int(ordinal.max() - inicio) + 1
+    posicao = codigos_produto * n_meses + (ordinal - inicio)
+    matriz = np.bincount(
+        posicao, weights=demanda.to_numpy(dtype='float64', na_value=0.0), minlength=len(produtos) * n_meses
+    ).reshape(len(produtos), n_meses)
+
+    meses = pd.period_range(meses_distintos.min(), periods=n_meses, freq='M')
+    return pd.Index(produtos, name='CODIGO_PRODUTO'), meses, matriz
+
+
+def suavizacao_exponencial(matriz, alpha=ALPHA_DEMANDA):
+    """
+    Suavização exponencial simples de cada linha da matriz (um produto por
+    linha, meses nas colunas). Retorna o último nível de cada linha.
+    """
+    if matriz.shape[1] == 0:
+        return np.zeros(matriz.shape[0])
+
+    nivel = matriz[:, 0].copy()
+    for t in range(1, matriz.shape[1]):
+        nivel *= 1 - alpha
+        nivel += alpha * matriz[:, t]
+    return nivel
+
+
+def _calcular_previsao(periodos, data_path, alpha):
+    demanda = pd.concat([get_demanda_mensal(periodo, data_path) for periodo in periodos])
+    demanda = demanda.groupby(level=['CODIGO_PRODUTO', 'mes'], observed=True).sum()
+    produtos, meses, matriz = matriz_demanda(demanda)
+
+    compras = matriz > 0
+    ultimo_mes = np.where(compras.any(axis=1), matriz.shape[1] - 1 - np.argmax(compras[:, ::-1], axis=1), -1)
+    previsao = pd.DataFrame({
+        'quantidade_prevista': suavizacao_exponencial(matriz, alpha),
+        'media_mensal': matriz.mean(axis=1) if matriz.shape[1] else 0.0,
+        'meses_com_compra': compras.sum(axis=1),
+        'ultimo_mes': [str(meses[i]) if i >= 0 else '' for i in ultimo_mes],
+    }, index=produtos)
+    print(f"[*] Previsão de demanda: {len(produtos)} produtos x {len(meses)} meses")
+    return previsao
+
+
+def get_previsao_demanda(periodos=None, data_path=None, alpha=ALPHA_DEMANDA):
+    """
+    Previsão de demanda do próximo mês para todos os produtos do histórico
+    (padrão: todos os períodos de NF_ARQUIVOS). DataFrame indexado por
+    CODIGO_PRODUTO com quantidade_prevista, media_mensal, meses_com_compra e
+    ultimo_mes. Calculada uma vez por versão dos dados.
+    """
+    periodos = tuple(periodos or NF_ARQUIVOS)
+    versoes = tuple(versao_nf(periodo, data_path) for periodo in periodos)
+    chave = (str(data_path), periodos, alpha)
+
+    entrada = _PREVISOES.get(chave)
+    if entrada is not None and entrada[0] == versoes:
+        return entrada[1]
+
+    with _PREVISOES_LOCK:
+        entrada = _PREVISOES.get(chave)
+        if entrada is None or entrada[0] != versoes:
+            entrada = (versoes, _calcular_previsao(periodos, data_path, alpha))
+            _PREVISOES[chave] = entrada
+    return entrada[1]
+
+
+def prever_demanda(codigos, periodos=None, data_path=None):
+    """
+    Quantidade prevista para o próximo mês de cada código de produto
+    ({codigo: quantidade}); produtos sem histórico recebem 0.
+    """
+    previsao = get_previsao_demanda(periodos, data_path)['quantidade_prevista']
+    return previsao.reindex(list(codigos)).fillna(0.0).round(2).to_dict()
@@ -0,0 +1,112 @@
+"""
+Matriz de incidência fornecedor x produto - IACOMPRAS
+Matriz esparsa (CSR) com o número de compras de cada par fornecedor x produto
+do período, montada uma vez por versão dos dados. As regras de sugestão de
+produtos ("presente em todos os selecionados", "comprado de 2 ou mais
+fornecedores", "recorrente") viram somas e máximos sobre o subconjunto de
+linhas dos fornecedores selecionados, sem filtrar o histórico a cada seleção.
+As linhas são os fornecedores do índice de resolucao_tools (em ordem
+alfabética): grafias diferentes da mesma razão social somam na mesma linha.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from iacompras.tools.data_tools import PERIODO_ATUAL, versao_nf
+from iacompras.tools.warehouse_tools import wh_disponivel, consultar_fornecedor_produto
+from iacompras.tools.resolucao_tools import adicionar_chaves, get_indice_fornecedores
+
+_MATRIZES = {}
+_MATRIZES_LOCK = threading.Lock()
+
+
+class IncidenciaFornecedorProduto:
+    """
+    Agregado fornecedor x produto indexado por posição: as linhas de `compras`
+    (CSR) são as posições do índice de fornecedores (`fornecedores` = nome
+    canônico) e as colunas os `produtos`. `pares` traz os atributos de cada par,
+    na ordem das linhas e colunas, com as chaves int32 fornecedor_id e produto_id.
+    """
+
+    def __init__(self, df_pares, indice_fornecedores, versao=None, data_path=None):
+        df = adicionar_chaves(df_pares.assign(
+            RAZAO_FORNECEDOR=df_pares['RAZAO_FORNECEDOR'].astype(object),
+            CODIGO_PRODUTO=df_pares['CODIGO_PRODUTO'].astype(object),
+        ), data_path)
+        df = df[df['fornecedor_id'] >= 0]
+        self.fornecedores = indice_fornecedores.razoes
+        linha = indice_fornecedores.posicoes(df['fornecedor_id'])
+        coluna, self.produtos = pd.factorize(df['CODIGO_PRODUTO'], sort=True)
+        grafia, _ = pd.factorize(df['RAZAO_FORNECEDOR'], sort=True)
+
+        # Pares ordenados por (linha, coluna, grafia); grafias da mesma razão dividem a célula
+        ordem = np.lexsort((grafia, coluna, linha))
+        self.pares = df.iloc[ordem].reset_index(drop=True)
+        self.compras = sparse.csr_matrix(
+            (df['compras'].to_numpy(dtype='int64')[ordem], (linha[ordem], coluna[ordem])),
+            shape=(len(self.fornecedores), len(self.produtos))
+        )
+        self.compras.sum_duplicates()
+        # Início dos pares de cada linha em `pares` (como compras.indptr, contando cada grafia)
+        self.indptr_pares = np.searchsorted(linha[ordem], np.arange(len(self.fornecedores) + 1))
+        self.indice_fornecedores = indice_fornecedores
+        self.versao = versao
+
+    def linhas(self, fornecedores):
+        """Linhas (ordenadas) das razões sociais ou CNPJs encontrados no índice de fornecedores."""
+        return self.linhas_ids(self.indice_fornecedores.resolver_varios(fornecedores))
+
+    def linhas_ids(self, ids):
+        """Linhas (ordenadas, sem repetição) dos ids de fornecedor válidos."""
+        linhas = self.indice_fornecedores.posicoes(ids)
+        return np.unique(linhas[linhas >= 0])
+
+    def posicoes_pares(self, linhas):
+        """Posições em `pares` dos pares das linhas informadas, na ordem da matriz."""
+        inicio = self.indptr_pares[linhas]
+        tamanho = self.indptr_pares[linhas + 1] - inicio
+        deslocamento = np.repeat(inicio - np.cumsum(tamanho) + tamanho, tamanho)
+        return np.arange(tamanho.sum()) + deslocamento
+
+    def pares_de(self, fornecedores):
+        """Pares dos fornecedores informados (equivale a consultar_fornecedor_produto)."""
+        return self.pares.iloc[self.posicoes_pares(self.linhas(fornecedores))].reset_index(drop=True)
+
+    def fornecedores_por_produto(self, linhas):
+        """Quantos dos fornecedores (linhas) compraram cada produto."""
+        return np.asarray((self.compras[linhas] > 0).sum(axis=0)).ravel()
+
+    def max_compras_por_produto(self, linhas):
+        """Maior número de compras de cada produto entre os fornecedores (linhas)."""
+        if len(linhas) == 0:
+            return np.zeros(len(self.produtos), dtype='int64')
+        return self.compras[linhas].max(axis=0).toarray().ravel()
+
+    def compras_por_produto(self, linhas):
+        """Total de compras de cada produto entre os fornecedores (linhas)."""
+        return np.asarray(self.compras[linhas].sum(axis=0)).ravel()
+
+
+def get_incidencia(periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Matriz de incidência do período, montada uma vez por versão dos dados
+    (a partir do warehouse quando ingerido, senão dos agregados em memória).
+    """
+    indice_fornecedores = get_indice_fornecedores(data_path=data_path)
+    versao = (versao_nf(periodo, data_path), wh_disponivel(periodo, data_path), indice_fornecedores.versao)
+    chave = (str(data_path), periodo)
+
+    entrada = _MATRIZES.get(chave)
+    if entrada is not None and entrada.versao == versao:
+        return entrada
+
+    with _MATRIZES_LOCK:
+        entrada = _MATRIZES.get(chave)
+        if entrada is None or entrada.versao != versao:
+            entrada = IncidenciaFornecedorProduto(
+                consultar_fornecedor_produto(periodo=periodo, data_path=data_path), indice_fornecedores, versao, data_path
+            )
+            _MATRIZES[chave] = entrada
+            print(f"[*] Matriz fornecedor x produto ({periodo}): "
+                  f"{len(entrada.fornecedores)} x {len(entrada.produtos)}, {entrada.compras.nnz} pares")
+    return entrada
@@ -0,0 +1,366 @@
+"""
+Ingestão incremental das notas fiscais no SQLite - IACOMPRAS
+Mantém uma marca d'água (último CODIGO_COMPRA) por arquivo de origem e grava
+apenas as notas novas, atualizando os agregados de fornecedor e produto.
+
+Uso:
+    python -m iacompras.tools.ingest_tools [--periodo 2025] [--completo]
+"""
+import argparse
+import pandas as pd
+from datetime import datetime
+from iacompras.tools.db_tools import db_init, get_connection, DB_PATH
+from iacompras.tools.feature_tools import (
+    COLUNAS_FS_NOTAS,
+    COLUNAS_FS_ITENS,
+    estatisticas_notas,
+    estatisticas_itens
+)
+from iacompras.tools.ranking_tools import atualizar_indice_top
+from iacompras.tools.resolucao_tools import get_indice_fornecedores
+from iacompras.tools.data_tools import (
+    NF_ARQUIVOS,
+    nf_paths,
+    normalizar_headers,
+    read_excel_cached,
+    iter_blocos_excel,
+    ler_workbooks_paralelo,
+    STREAMING_LIMIAR_BYTES
+)
+
+COLUNAS_NOTAS = [
+    'CODIGO_COMPRA', 'NUMERO_NOTAFISCAL', 'DATA_COMPRA', 'DATA_ENTREGA',
+    'TOTAL_PRODUTOS', 'TOTAL_DESCONTO', 'TOTAL_NOTAFISCAL', 'FORMA_PAGTO',
+    'CNPJ_FORNECEDOR', 'RAZAO_FORNECEDOR', 'CIDADE_FORNECEDOR', 'UF_FORNECEDOR',
+    'PRAZO_ENTREGA_DIAS', 'arquivo_origem', 'fornecedor_id'
+]
+
+COLUNAS_ITENS = [
+    'CODIGO_COMPRA', 'ITEM', 'CODIGO_PRODUTO', 'PRODUTO', 'QUANTIDADE_COMPRA',
+    'VALOR_UNITARIO', 'VALOR_DESCONTO', 'VALOR_LIQUIDO', 'GRUPO', 'MARCA',
+    'UNIDADE_MEDIDA', 'arquivo_origem'
+]
+
+TABELAS_INGESTAO = [
+    'notas_fiscais', 'nota_fiscal_itens', 'nf_watermark',
+    'agg_fornecedor', 'agg_produto', 'agg_fornecedor_produto', 'feature_fornecedor',
+    'top_fornecedores_produto', 'top_fornecedores_estado'
+]
+
+
+def _linhas_sqlite(df, colunas):
+    """
+    Converte o DataFrame em tuplas de tipos nativos (datas em texto, NaN -> None).
+    """
+    df = df[[c for c in colunas if c in df.columns]].copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.columns), list(df.itertuples(index=False, name=None))
+
+
+def _filtrar_novos(cursor, tabela, df, chaves):
+    """
+    Mantém apenas as linhas cuja chave (`chaves`, a restrição única da tabela)
+    ainda não está gravada nem se repete no próprio bloco; são exatamente as
+    linhas que o INSERT OR IGNORE vai gravar, e só elas entram nos agregados.
+    """
+    codigos = df['CODIGO_COMPRA']
+    cursor.execute(
+        f"SELECT {', '.join(chaves)} FROM {tabela} WHERE CODIGO_COMPRA BETWEEN ? AND ? "
+        + "".join(f"AND {c} IS NOT NULL " for c in chaves),
+        (int(codigos.min()), int(codigos.max()))
+    )
+    existentes = pd.MultiIndex.from_frame(pd.DataFrame(cursor.fetchall(), columns=chaves).astype(object))
+    completas = df[chaves].notna().all(axis=1).to_numpy()
+    gravadas = pd.MultiIndex.from_frame(df[chaves].astype(object)).isin(existentes) & completas
+    repetidas = df.duplicated(chaves).to_numpy() & completas
+    return df[~(gravadas | repetidas)]
+
+
+def _inserir(cursor, tabela, df, colunas):
+    cols, linhas = _linhas_sqlite(df, colunas)
+    placeholders = ", ".join("?" * len(cols))
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {tabela} ({', '.join(cols)}) VALUES ({placeholders})",
+        linhas
+    )
+    return cursor.rowcount
+
+
+def _get_watermark(cursor, arquivo):
+    cursor.execute("SELECT ultimo_codigo_compra FROM nf_watermark WHERE arquivo = ?", (arquivo,))
+    row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def _set_watermark(cursor, arquivo, ultimo_codigo, ultima_data, linhas, stat):
+    """
+    Grava a marca d'água do arquivo junto com a assinatura (mtime e tamanho)
+    do workbook lido; wh_disponivel compara essa assinatura com a do disco.
+    """
+    cursor.execute('''
+    INSERT INTO nf_watermark (arquivo, ultimo_codigo_compra, ultima_data_compra, linhas, atualizado_em,
+                              mtime_ns, tamanho)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(arquivo) DO UPDATE SET
+        ultimo_codigo_compra=excluded.ultimo_codigo_compra,
+        ultima_data_compra=COALESCE(excluded.ultima_data_compra, nf_watermark.ultima_data_compra),
+        linhas=nf_watermark.linhas + excluded.linhas,
+        atualizado_em=excluded.atualizado_em,
+        mtime_ns=excluded.mtime_ns,
+        tamanho=excluded.tamanho
+    ''', (arquivo, ultimo_codigo, ultima_data, linhas, datetime.now().isoformat(), stat.st_mtime_ns, stat.st_size))
+
+
+def _preencher_fornecedor_id(cursor, indice):
+    """
+    Resolve o fornecedor_id das notas e linhas da feature store gravadas sem
+    ele (ingeridas antes da coluna existir).
+    """
+    for tabela in ('notas_fiscais', 'feature_fornecedor'):
+        cursor.execute(f"SELECT DISTINCT RAZAO_FORNECEDOR FROM {tabela} WHERE fornecedor_id IS NULL")
+        razoes = [row[0] for row in cursor.fetchall()]
+        if not razoes:
+            continue
+        cursor.executemany(
+            f"UPDATE {tabela} SET fornecedor_id = ? WHERE fornecedor_id IS NULL AND RAZAO_FORNECEDOR = ?",
+            [(int(i), razao) for i, razao in zip(indice.ids_razoes(razoes), razoes) if i >= 0]
+        )
+
+
+def _atualizar_agregados_notas(cursor, df_notas):
+    """Soma as notas novas aos agregados por fornecedor."""
+    delta = df_notas.groupby('CNPJ_FORNECEDOR').agg(
+        RAZAO_FORNECEDOR=('RAZAO_FORNECEDOR', 'last'),
+        notas=('CODIGO_COMPRA', 'count'),
+        valor_total=('TOTAL_NOTAFISCAL', 'sum'),
+        ultima_compra=('DATA_COMPRA', 'max')
+    ).reset_index()
+
+    cols, linhas = _linhas_sqlite(delta, ['CNPJ_FORNECEDOR', 'RAZAO_FORNECEDOR', 'notas', 'valor_total', 'ultima_compra'])
+    cursor.executemany('''
+    INSERT INTO agg_fornecedor (CNPJ_FORNECEDOR, RAZAO_FORNECEDOR, notas, valor_total, ultima_compra)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(CNPJ_FORNECEDOR) DO UPDATE SET
+        RAZAO_FORNECEDOR=excluded.RAZAO_FORNECEDOR,
+        notas=agg_fornecedor.notas + excluded.notas,
+        valor_total=agg_fornecedor.valor_total + excluded.valor_total,
+        ultima_compra=MAX(COALESCE(agg_fornecedor.ultima_compra, ''), excluded.ultima_compra)
+    ''', linhas)
+
+
+def _atualizar_agregados_itens(cursor, df_itens):
+    """
+    Soma os itens novos (já unidos ao fornecedor da nota) aos agregados por
+    fornecedor, produto e fornecedor x produto.
+    """
+    por_fornecedor = df_itens.groupby('CNPJ_FORNECEDOR').agg(
+        RAZAO_FORNECEDOR=('RAZAO_FORNECEDOR', 'last'),
+        itens=('CODIGO_PRODUTO', 'size'),
+        soma_valor_unitario=('VALOR_UNITARIO', 'sum')
+    ).reset_index()
+    _, linhas = _linhas_sqlite(por_fornecedor, ['CNPJ_FORNECEDOR', 'RAZAO_FORNECEDOR', 'itens', 'soma_valor_unitario'])
+    cursor.executemany('''
+    INSERT INTO agg_fornecedor (CNPJ_FORNECEDOR, RAZAO_FORNECEDOR, itens, soma_valor_unitario)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(CNPJ_FORNECEDOR) DO UPDATE SET
+        itens=agg_fornecedor.itens + excluded.itens,
+        soma_valor_unitario=agg_fornecedor.soma_valor_unitario + excluded.soma_valor_unitario
+    ''', linhas)
+
+    por_produto = df_itens.groupby('CODIGO_PRODUTO').agg(
+        PRODUTO=('PRODUTO', 'last'),
+        compras=('CODIGO_PRODUTO', 'size'),
+        soma_quantidade=('QUANTIDADE_COMPRA', 'sum')
+    ).reset_index()
+    _, linhas = _linhas_sqlite(por_produto, ['CODIGO_PRODUTO', 'PRODUTO', 'compras', 'soma_quantidade'])
+    cursor.executemany('''
+    INSERT INTO agg_produto (CODIGO_PRODUTO, PRODUTO, compras, soma_quantidade)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(CODIGO_PRODUTO) DO UPDATE SET
+        PRODUTO=excluded.PRODUTO,
+        compras=agg_produto.compras + excluded.compras,
+        soma_quantidade=agg_produto.soma_quantidade + excluded.soma_quantidade
+    ''', linhas)
+
+    por_par = df_itens.groupby(['CNPJ_FORNECEDOR', 'CODIGO_PRODUTO']).agg(
+        RAZAO_FORNECEDOR=('RAZAO_FORNECEDOR', 'last'),
+        compras=('CODIGO_PRODUTO', 'size'),
+        soma_quantidade=('QUANTIDADE_COMPRA', 'sum'),
+        soma_valor_unitario=('VALOR_UNITARIO', 'sum'),
+        ultimo_valor_unitario=('VALOR_UNITARIO', 'last')
+    ).reset_index()
+    _, linhas = _linhas_sqlite(por_par, [
+        'CNPJ_FORNECEDOR', 'CODIGO_PRODUTO', 'RAZAO_FORNECEDOR', 'compras',
+        'soma_quantidade', 'soma_valor_unitario', 'ultimo_valor_unitario'
+    ])
+    cursor.executemany('''
+    INSERT INTO agg_fornecedor_produto (CNPJ_FORNECEDOR, CODIGO_PRODUTO, RAZAO_FORNECEDOR, compras,
+                                        soma_quantidade, soma_valor_unitario, ultimo_valor_unitario)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(CNPJ_FORNECEDOR, CODIGO_PRODUTO) DO UPDATE SET
+        RAZAO_FORNECEDOR=excluded.RAZAO_FORNECEDOR,
+        compras=agg_fornecedor_produto.compras + excluded.compras,
+        soma_quantidade=agg_fornecedor_produto.soma_quantidade + excluded.soma_quantidade,
+        soma_valor_unitario=agg_fornecedor_produto.soma_valor_unitario + excluded.soma_valor_unitario,
+        ultimo_valor_unitario=excluded.ultimo_valor_unitario
+    ''', linhas)
+
+
+def _atualizar_feature_store(cursor, periodo, estatisticas, colunas):
+    """Soma estatísticas suficientes (por fornecedor e mês) à feature store."""
+    df = estatisticas.reset_index().assign(periodo=periodo)
+    chaves = ['periodo', 'mes', 'CNPJ_FORNECEDOR', 'RAZAO_FORNECEDOR', 'fornecedor_id']
+    _, linhas = _linhas_sqlite(df, chaves + colunas)
+    atualizacao = ",\n        ".join(f"{c}=feature_fornecedor.{c} + excluded.{c}" for c in colunas)
+    cursor.executemany(f'''
+    INSERT INTO feature_fornecedor ({", ".join(chaves + colunas)})
+    VALUES ({", ".join("?" * len(chaves + colunas))})
+    ON CONFLICT(periodo, mes, CNPJ_FORNECEDOR, RAZAO_FORNECEDOR) DO UPDATE SET
+        fornecedor_id=COALESCE(excluded.fornecedor_id, feature_fornecedor.fornecedor_id),
+        {atualizacao}
+    ''', linhas)
+
+
+def ingerir_periodo(conn, periodo, data_path=None, frames=None):
+    """
+    Ingere as notas e itens novos de um período (acima da marca d'água de cada arquivo).
+    Notas com CODIGO_COMPRA menor ou igual à marca d'água são consideradas já ingeridas,
+    e as chaves que já estão no banco são descartadas antes de somar os agregados.
+    As marcas d'água dos dois arquivos são carimbadas a cada passada, com ou sem linhas novas.
+    `frames` ({path: DataFrame}) permite reaproveitar workbooks já lidos.
+    """
+    frames = frames or {}
+    headers_path, items_path = nf_paths(periodo, data_path)
+    # Assinatura tomada antes da leitura: uma alteração durante a ingestão deixa o warehouse desatualizado
+    stat_notas, stat_itens = headers_path.stat(), items_path.stat()
+    cursor = conn.cursor()
+
+    df_headers = frames.get(headers_path)
+    if df_headers is None:
+        df_headers = read_excel_cached(headers_path)
+    df_headers = normalizar_headers(df_headers)
+
+    # Fornecedor resolvido (dim_fornecedor); ids posicionais, sem a dimensão no banco, não são gravados
+    indice = get_indice_fornecedores(data_path=data_path)
+    if indice.persistido:
+        ids = pd.Series(indice.ids_razoes(df_headers['RAZAO_FORNECEDOR']), index=df_headers.index)
+        df_headers['fornecedor_id'] = ids.where(ids >= 0).astype('Int64')
+        _preencher_fornecedor_id(cursor, indice)
+    else:
+        df_headers['fornecedor_id'] = pd.Series(pd.NA, index=df_headers.index, dtype='Int64')
+        print("[!] dim_fornecedor indisponível: notas gravadas sem fornecedor_id.")
+    wm_notas = _get_watermark(cursor, headers_path.name)
+    candidatas = df_headers[df_headers['CODIGO_COMPRA'] > wm_notas]
+
+    notas_novas = 0
+    ultimo_codigo, ultima_data = wm_notas, None
+    if not candidatas.empty:
+        ultimo_codigo = int(candidatas['CODIGO_COMPRA'].max())
+        novas = _filtrar_novos(cursor, 'notas_fiscais', candidatas, ['CODIGO_COMPRA'])
+        if len(novas) < len(candidatas):
+            print(f"[!] {headers_path.name}: {len(candidatas) - len(novas)} notas já gravadas ignoradas")
+        if not novas.empty:
+            novas = novas.assign(arquivo_origem=headers_path.name)
+            notas_novas = _inserir(cursor, 'notas_fiscais', novas, COLUNAS_NOTAS)
+            _atualizar_agregados_notas(cursor, novas)
+            _atualizar_feature_store(cursor, periodo, estatisticas_notas(novas), COLUNAS_FS_NOTAS)
+            ultima_data = novas['DATA_COMPRA'].max().strftime('%Y-%m-%d %H:%M:%S')
+    # Carimba a marca d'água mesmo sem notas novas: o arquivo foi conferido agora
+    _set_watermark(cursor, headers_path.name, ultimo_codigo, ultima_data, notas_novas, stat_notas)
+
+    mapa_fornecedor = df_headers[['CODIGO_COMPRA', 'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'DATA_COMPRA', 'fornecedor_id']]
+    wm_itens = _get_watermark(cursor, items_path.name)
+    itens_novos = 0
+    produtos_novos = set()
+    ultimo_codigo = wm_itens
+    blocos = [frames[items_path]] if items_path in frames else iter_blocos_excel(items_path)
+    for bloco in blocos:
+        bloco = bloco[bloco['CODIGO_COMPRA'] > wm_itens]
+        if bloco.empty:
+            continue
+        ultimo_codigo = max(ultimo_codigo, int(bloco['CODIGO_COMPRA'].max()))
+        bloco = _filtrar_novos(cursor, 'nota_fiscal_itens', bloco, ['CODIGO_COMPRA', 'ITEM'])
+        if bloco.empty:
+            continue
+        bloco = bloco.assign(arquivo_origem=items_path.name)
+        itens_novos += _inserir(cursor, 'nota_fiscal_itens', bloco, COLUNAS_ITENS)
+        bloco_fatos = bloco.merge(mapa_fornecedor, on='CODIGO_COMPRA', how='left')
+        _atualizar_agregados_itens(cursor, bloco_fatos)
+        _atualizar_feature_store(cursor, periodo, estatisticas_itens(bloco_fatos), COLUNAS_FS_ITENS)
+        produtos_novos.update(bloco['CODIGO_PRODUTO'].dropna().astype(str))
+
+    _set_watermark(cursor, items_path.name, ultimo_codigo, None, itens_novos, stat_itens)
+
+    return {"notas_novas": notas_novas, "itens_novos": itens_novos, "produtos_novos": produtos_novos}
+
+
+def ingerir_notas_incremental(periodos=None, data_path=None, completo=False):
+    """
+    Executa a ingestão incremental dos períodos informados (padrão: todos).
+    Com completo=True as tabelas de ingestão são esvaziadas e recarregadas.
+    Cada período é gravado em uma única transação.
+    """
+    db_init()
+    periodos = periodos or list(NF_ARQUIVOS)
+
+    conn = get_connection(DB_PATH)
+    resumo = {}
+    try:
+        if completo:
+            for tabela in TABELAS_INGESTAO:
+                conn.execute(f"DELETE FROM {tabela}")
+            conn.commit()
+
+        # Os workbooks de todos os períodos são lidos juntos (em paralelo); a gravação
+        # no SQLite continua sequencial. Itens grandes seguem em streaming.
+        paths = []
+        for periodo in periodos:
+            headers_path, items_path = nf_paths(periodo, data_path)
+            if headers_path.exists():
+                paths.append(headers_path)
+            if items_path.exists() and items_path.stat().st_size < STREAMING_LIMIAR_BYTES:
+                paths.append(items_path)
+
+        frames = {}
+        try:
+            frames = ler_workbooks_paralelo(paths)
+        except Exception as e:
+            print(f"[!] Leitura paralela falhou, lendo por período: {e}")
+
+        for periodo in periodos:
+            try:
+                resumo[periodo] = ingerir_periodo(conn, periodo, data_path, frames)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"[!] Falha na ingestão do período {periodo}: {e}")
+                resumo[periodo] = {"error": str(e)}
+                continue
+            print(f"[*] Ingestão {periodo}: {resumo[periodo]['notas_novas']} notas e "
+                  f"{resumo[periodo]['itens_novos']} itens novos")
+
+            # Reordena no índice de fornecedores apenas os produtos com itens novos
+            try:
+                atualizar_indice_top(periodo, data_path, produtos=resumo[periodo].pop('produtos_novos'))
+            except Exception as e:
+                print(f"[!] Falha ao atualizar o índice de fornecedores de {periodo}: {e}")
+    finally:
+        conn.close()
+    return resumo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão incremental das notas fiscais no SQLite.")
+    parser.add_argument("--periodo", action="append", choices=list(NF_ARQUIVOS),
+                        help="Período a ingerir (pode repetir). Padrão: todos.")
+    parser.add_argument("--completo", action="store_true",
+                        help="Descarta o que já foi ingerido e recarrega tudo.")
+    args = parser.parse_args()
+    ingerir_notas_incremental(args.periodo, completo=args.completo)
+
+
+if __name__ == "__main__":
+    main()
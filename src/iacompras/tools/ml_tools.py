@@ -1,6 +1,7 @@
 import pandas as pd
 import sys
 import os
+import threading
 from pathlib import Path
 
 # Adiciona o diretório src ao path para importar o modelo
@@ -9,8 +10,8 @@ sys.path.append(str(Path(__file__).resolve().parents[2]))
 try:
     from iacompras.ml.treinar_classificador_fornecedor import (
         treinar_modelo_avaliacao_fornecedores, 
-        engenharia_features_fornecedores,
         rating_to_label,
+        FEATURES_MODELO,
         MODEL_DIR,
         DATA_DIR
     )
@@ -27,19 +28,71 @@ except ImportError:
     supp_ml = importlib.util.module_from_spec(spec_supp)
     spec_supp.loader.exec_module(supp_ml)
     treinar_modelo_avaliacao_fornecedores = supp_ml.treinar_modelo_avaliacao_fornecedores
-    engenharia_features_fornecedores = supp_ml.engenharia_features_fornecedores
     rating_to_label = supp_ml.rating_to_label
+    FEATURES_MODELO = supp_ml.FEATURES_MODELO
     MODEL_DIR = supp_ml.MODEL_DIR
     DATA_DIR = supp_ml.DATA_DIR
 
 from iacompras.tools.db_tools import db_get_latest_classified_suppliers
+from iacompras.ml.floresta_numpy import FlorestaNumpy
+from iacompras.tools.data_tools import PERIODO_ATUAL, nf_paths, precarregar_nf, cnpj_canonico
+from iacompras.tools.feature_tools import JANELAS_DIAS, colunas_janelas, fs_disponivel, get_features_fornecedores
+from iacompras.tools.resolucao_tools import resolver_fornecedores
+
+# Modelos carregados no processo: caminho -> (assinatura do arquivo, objeto)
+_MODELOS = {}
+_MODELOS_LOCK = threading.Lock()
+
+
+def _joblib_load_mmap(path):
+    import joblib
+
+    try:
+        return joblib.load(path, mmap_mode='r')
+    except (ValueError, OSError) as e:
+        print(f"[!] Não foi possível mapear {path.name} em memória, carregando normalmente: {e}")
+        return joblib.load(path)
+
+
+def carregar_modelo(path, carregador=None):
+    """
+    Retorna o objeto serializado em `path`, carregado uma única vez por processo e
+    compartilhado entre sessões e threads. Só recarrega quando o arquivo muda no
+    disco (tamanho/mtime). Por padrão lê com joblib, mapeando os arrays numpy em
+    memória quando possível; `carregador(path)` substitui a leitura.
+    """
+    path = Path(path)
+    stat = path.stat()
+    assinatura = (stat.st_size, stat.st_mtime_ns)
+    chave = str(path.resolve())
+
+    entrada = _MODELOS.get(chave)
+    if entrada is not None and entrada[0] == assinatura:
+        return entrada[1]
+
+    with _MODELOS_LOCK:
+        entrada = _MODELOS.get(chave)
+        if entrada is None or entrada[0] != assinatura:
+            if carregador is not None:
+                obj = carregador(path)
+            else:
+                obj = _joblib_load_mmap(path)
+            entrada = (assinatura, obj)
+            _MODELOS[chave] = entrada
+            print(f"[*] Modelo carregado: {path.name}")
+    return entrada[1]
+
 
 def train_supplier_classifier():
     """
     Executa o script de treinamento do classificador de fornecedores.
     """
-    treinar_modelo_avaliacao_fornecedores()
-    return {"status": "success", "message": "Modelo de classificação de fornecedores treinado com sucesso."}
+    tempos = treinar_modelo_avaliacao_fornecedores()
+    if tempos and 'verificacao' in tempos:
+        mensagem = "Dados de treino inalterados: modelo de classificação de fornecedores reaproveitado."
+    else:
+        mensagem = "Modelo de classificação de fornecedores treinado com sucesso."
+    return {"status": "success", "message": mensagem, "tempos": tempos}
 
 def get_classified_suppliers():
     """
@@ -52,45 +105,76 @@ def get_classified_suppliers():
     
     return suppliers
 
-def classify_suppliers_2025():
+def carregar_classificador():
     """
-    Usa o modelo treinado para classificar os fornecedores com base nos dados de 2025.
-    Salva o resultado em fornecedores_classificados_2025.csv.
+    Retorna o classificador de fornecedores a partir do cache de modelos, ou None
+    se ainda não foi treinado. Usa a exportação NumPy (sem scikit-learn) quando
+    ela está em dia com o modelo; senão, a tupla (modelo, escalonador) do sklearn.
     """
-    import joblib
-    import numpy as np
+    model_path = MODEL_DIR / "modelo_classificacao_fornecedores.pkl"
+    scaler_path = MODEL_DIR / "escalonador_fornecedores.pkl"
+    npz_path = MODEL_DIR / "classificador_fornecedores.npz"
 
-    nf_path = DATA_DIR / "IACOMPRAS_NOTASFISCAIS_2025.xlsx"
-    items_path = DATA_DIR / "IACOMPRAS_NOTAFISCALITENS_2025.xlsx"
+    if npz_path.exists() and (not model_path.exists() or npz_path.stat().st_mtime >= model_path.stat().st_mtime):
+        return carregar_modelo(npz_path, FlorestaNumpy)
 
-    if not nf_path.exists() or not items_path.exists():
-        return {"error": "Arquivos de dados de 2025 não encontrados em data/samples/"}
+    if not model_path.exists() or not scaler_path.exists():
+        return None
+    return carregar_modelo(model_path), carregar_modelo(scaler_path)
 
-    df_nf = pd.read_excel(nf_path)
-    df_items = pd.read_excel(items_path)
 
-    print("[*] Gerando features para dados de 2025...")
-    supplier_features = engenharia_features_fornecedores(df_nf, df_items)
+def features_do_classificador(classificador):
+    """Features (na ordem do treino) esperadas pelo classificador carregado."""
+    if isinstance(classificador, FlorestaNumpy):
+        features = classificador.features
+    else:
+        features = list(getattr(classificador[1], 'feature_names_in_', []))
+    return features or FEATURES_MODELO
 
-    model_path = MODEL_DIR / "modelo_classificacao_fornecedores.pkl"
-    scaler_path = MODEL_DIR / "escalonador_fornecedores.pkl"
 
-    if not model_path.exists() or not scaler_path.exists():
-        return {"error": "Modelo ou escalonador não encontrados. Treine o classificador primeiro."}
+def _janelas_do_classificador(classificador):
+    """JANELAS_DIAS se o classificador foi treinado com as features recentes."""
+    if set(colunas_janelas(JANELAS_DIAS)) & set(features_do_classificador(classificador)):
+        return JANELAS_DIAS
+    return None
+
 
-    model = joblib.load(model_path)
-    scaler = joblib.load(scaler_path)
+def prever_rating(classificador, X):
+    """Rating (1 a 5) previsto pelo classificador para as features X."""
+    import numpy as np
+
+    if isinstance(classificador, FlorestaNumpy):
+        preds = classificador.predict(X)
+    else:
+        model, scaler = classificador
+        preds = model.predict(scaler.transform(X))
+    return np.clip(np.round(preds), 1, 5).astype(int)
 
-    X = supplier_features[[
-        'avg_lead_time', 'std_lead_time', 'recurrence',
-        'total_spent', 'discount_rate', 'avg_item_price'
-    ]]
 
-    X_scaled = scaler.transform(X)
-    preds = model.predict(X_scaled)
-    preds_rounded = np.clip(np.round(preds), 1, 5).astype(int)
+def classify_suppliers_2025():
+    """
+    Usa o modelo treinado para classificar os fornecedores com base nos dados de 2025.
+    Salva o resultado em fornecedores_classificados_2025.csv.
+    """
+    nf_path, items_path = nf_paths("2025", DATA_DIR)
 
-    supplier_features['rating'] = preds_rounded
+    if not nf_path.exists() or not items_path.exists():
+        return {"error": "Arquivos de dados de 2025 não encontrados em data/samples/"}
+
+    classificador = carregar_classificador()
+    if classificador is None:
+        return {"error": "Modelo ou escalonador não encontrados. Treine o classificador primeiro."}
+
+    print("[*] Gerando features para dados de 2025...")
+    if not fs_disponivel("2025", DATA_DIR):
+        precarregar_nf(["2025"], DATA_DIR)
+    supplier_features = get_features_fornecedores(
+        ["2025"], DATA_DIR, janelas=_janelas_do_classificador(classificador)
+    )
+
+    supplier_features['rating'] = prever_rating(
+        classificador, supplier_features[features_do_classificador(classificador)]
+    )
     supplier_features['classificacao'] = supplier_features['rating'].apply(rating_to_label)
 
     output_path = MODEL_DIR / "fornecedores_classificados_2025.csv"
@@ -98,3 +182,60 @@ def classify_suppliers_2025():
     
     print(f"[*] Classificação 2025 salva em: {output_path}")
     return {"status": "success", "message": f"Classificação 2025 gerada em {output_path}"}
+
+
+def score_suppliers(fornecedores, periodos=(PERIODO_ATUAL,)):
+    """
+    Pontua fornecedores sob demanda com o modelo em cache, sem rodar o lote completo.
+
+    Args:
+        fornecedores: CNPJ (texto ou número), dict com as features do modelo
+            (ver features_do_classificador) ou uma lista desses itens.
+        periodos: Períodos do histórico usados para montar as features dos CNPJs.
+
+    Returns:
+        {"status": "success", "fornecedores": [...]} com as features, 'rating' e
+        'classificacao' de cada fornecedor (um registro por fornecedor_id: CNPJs de
+        filiais do mesmo fornecedor são pontuados juntos; CNPJs sem histórico no
+        período trazem 'error'), ou {"status": "error", "error": ..., "fornecedores": []}.
+    """
+    if not isinstance(fornecedores, (list, tuple)):
+        fornecedores = [fornecedores]
+
+    classificador = carregar_classificador()
+    if classificador is None:
+        return {"status": "error", "fornecedores": [],
+                "error": "Modelo ou escalonador não encontrados. Treine o classificador primeiro."}
+
+    features = features_do_classificador(classificador)
+    entradas_features = [f for f in fornecedores if isinstance(f, dict)]
+    cnpjs = [cnpj_canonico(f) for f in fornecedores if not isinstance(f, dict)]
+    cnpjs = list(dict.fromkeys(cnpj for cnpj in cnpjs if cnpj))
+
+    partes = []
+    if cnpjs:
+        partes.append(get_features_fornecedores(
+            periodos, DATA_DIR, cnpjs=cnpjs, janelas=_janelas_do_classificador(classificador)
+        ).reset_index())
+    if entradas_features:
+        df_entradas = pd.DataFrame(entradas_features)
+        faltantes = [col for col in features if col not in df_entradas.columns]
+        if faltantes:
+            return {"status": "error", "fornecedores": [], "error": f"Features ausentes: {', '.join(faltantes)}"}
+        partes.append(df_entradas)
+
+    resultados = []
+    if partes:
+        df = pd.concat(partes, ignore_index=True)
+        df['rating'] = prever_rating(classificador, df[features].astype(float))
+        df['classificacao'] = df['rating'].apply(rating_to_label)
+        df = df.astype(object).where(df.notna(), None)
+        resultados = df.to_dict(orient='records')
+
+    encontrados = {r.get('fornecedor_id') for r in resultados}
+    ids = resolver_fornecedores(cnpjs, DATA_DIR) if cnpjs else []
+    resultados += [
+        {"CNPJ_FORNECEDOR": cnpj, "error": "Fornecedor sem histórico de notas no período."}
+        for cnpj, fornecedor_id in zip(cnpjs, ids) if fornecedor_id < 0 or int(fornecedor_id) not in encontrados
+    ]
+    return {"status": "success", "fornecedores": resultados}
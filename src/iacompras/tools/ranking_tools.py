@@ -0,0 +1,254 @@
+"""
+Índice dos melhores fornecedores por produto - IACOMPRAS
+Materializa, para cada CODIGO_PRODUTO, os K fornecedores mais recomendados
+(rating do classificador, menor preço médio e maior recorrência local), de modo
+que a seleção final do planejador seja uma busca de K linhas por produto.
+
+Com o período ingerido o índice fica no SQLite (top_fornecedores_produto);
+senão, em memória. A atualização é incremental:
+- nova versão do classificador: só os produtos dos fornecedores cuja
+  classificação mudou são reordenados;
+- notas novas na ingestão: só os produtos com itens novos são reordenados;
+- dados alterados por outro caminho (ou índice ausente): reconstrução completa.
+"""
+import os
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime
+from iacompras.tools.db_tools import (
+    DB_PATH,
+    get_connection,
+    db_get_active_model_version,
+    db_get_classified_suppliers,
+    db_get_latest_classified_suppliers
+)
+from iacompras.tools.data_tools import PERIODO_ATUAL, cnpj_canonico, versao_nf
+from iacompras.tools.warehouse_tools import wh_disponivel, consultar_fornecedor_produto
+from iacompras.tools.resolucao_tools import get_indice_fornecedores
+
+# Fornecedores mantidos por produto no índice
+K_TOP_FORNECEDORES = int(os.getenv("IACOMPRAS_TOP_FORNECEDORES", "3"))
+
+COLUNAS_CLASSE = ['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'rating', 'classificacao', 'recurrence', 'fornecedor_id']
+COLUNAS_INDICE = [
+    'CODIGO_PRODUTO', 'posicao', 'RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR', 'rating',
+    'classificacao', 'preco_medio', 'recurrencia_local', 'PRODUTO', 'fornecedor_id'
+]
+
+_INDICES = {}
+_INDICES_LOCK = threading.Lock()
+
+
+def carregar_classificacao(version_id=None, data_path=None):
+    """
+    Rating e classificação por fornecedor de uma versão do classificador
+    (None = versão ativa, ou a tabela antiga em bancos sem versões) com o
+    fornecedor_id gravado; versões anteriores à coluna usam o da razão social
+    (-1 se fora do índice de fornecedores).
+    """
+    registros = db_get_classified_suppliers(version_id) if version_id else db_get_latest_classified_suppliers()
+    df = pd.DataFrame(registros or [], columns=COLUNAS_CLASSE)
+    df['CNPJ_FORNECEDOR'] = df['CNPJ_FORNECEDOR'].map(cnpj_canonico).astype(object)
+    resolvidos = get_indice_fornecedores(data_path=data_path).ids_razoes(df['RAZAO_FORNECEDOR'])
+    df['fornecedor_id'] = df['fornecedor_id'].astype('float64').fillna(pd.Series(resolvidos, index=df.index)).astype('int64')
+    return df
+
+
+def _uma_classificacao_por_fornecedor(df_class, chave):
+    """
+    Uma linha de classificação por fornecedor (`chave`): filiais com outro CNPJ
+    e grafias da mesma razão social usam a classificação do CNPJ com mais notas
+    (recurrence), desempate pelo menor CNPJ.
+    """
+    return df_class[df_class[chave] >= 0].sort_values(
+        ['recurrence', 'CNPJ_FORNECEDOR'], ascending=[False, True], kind='stable', na_position='last'
+    ).drop_duplicates(chave)
+
+
+def ranquear_fornecedores(df_pares, df_class, k=K_TOP_FORNECEDORES):
+    """
+    Top-k fornecedores de cada produto a partir do agregado fornecedor x produto
+    (formato de consultar_fornecedor_produto) e da classificação, unidos pelo
+    fornecedor_id. Ordenação estável por rating (não classificados = 1), preço
+    médio e recorrência local.
+    """
+    if df_pares.empty:
+        return pd.DataFrame(columns=COLUNAS_INDICE)
+
+    df = df_pares.assign(
+        CODIGO_PRODUTO=df_pares['CODIGO_PRODUTO'].astype(object),
+        RAZAO_FORNECEDOR=df_pares['RAZAO_FORNECEDOR'].astype(object),
+        fornecedor_id=df_pares['fornecedor_id'].astype('int64'),
+        PRODUTO=df_pares['PRODUTO'].astype(object),
+        preco_medio=df_pares['soma_valor_unitario'] / df_pares['n_valor_unitario'],
+    ).rename(columns={'compras': 'recurrencia_local'})
+
+    # Descrição do registro mais recente de cada produto
+    descricao = df.sort_values('ultima_linha').drop_duplicates('CODIGO_PRODUTO', keep='last')
+    descricao = descricao.set_index('CODIGO_PRODUTO')['PRODUTO']
+
+    classe = _uma_classificacao_por_fornecedor(df_class, 'fornecedor_id')
+    df = df[['CODIGO_PRODUTO', 'fornecedor_id', 'RAZAO_FORNECEDOR', 'preco_medio', 'recurrencia_local']].merge(
+        classe[['fornecedor_id', 'CNPJ_FORNECEDOR', 'rating', 'classificacao']], on='fornecedor_id', how='left'
+    )
+    df['rating'] = df['rating'].fillna(1).astype(int)  # Neutro se não classificado
+    df['classificacao'] = df['classificacao'].fillna('N/A')
+
+    top = df.sort_values(
+        by=['rating', 'preco_medio', 'recurrencia_local'],
+        ascending=[False, True, False]
+    ).groupby('CODIGO_PRODUTO', sort=False).head(k)
+    if top.duplicated(['CODIGO_PRODUTO', 'fornecedor_id']).any():
+        raise ValueError("Índice de fornecedores com o mesmo fornecedor repetido em um produto.")
+    top['posicao'] = top.groupby('CODIGO_PRODUTO', sort=False).cumcount() + 1
+    top['PRODUTO'] = descricao.reindex(top['CODIGO_PRODUTO']).to_numpy()
+    return top[COLUNAS_INDICE].reset_index(drop=True)
+
+
+def _fornecedores_alterados(version_antiga, version_nova):
+    """
+    Razões sociais cuja classificação difere entre duas versões do classificador
+    (comparando todas as linhas da razão social, inclusive filiais com outro CNPJ);
+    consultar_fornecedor_produto as resolve para o fornecedor_id.
+    """
+    linhas = pd.concat([carregar_classificacao(version_antiga), carregar_classificacao(version_nova)]).astype(str)
+    return linhas.drop_duplicates(keep=False)['RAZAO_FORNECEDOR'].unique().tolist()
+
+
+def _produtos_a_atualizar(estado, versao_dados, version_id, k, produtos, periodo, data_path):
+    """
+    Decide a atualização do índice: None = reconstrução completa, senão o
+    conjunto de produtos a reordenar (vazio = índice em dia).
+    """
+    if estado is None or estado['k'] != k:
+        return None
+    if estado['versao_dados'] != versao_dados and produtos is None:
+        return None
+
+    afetados = set(produtos or [])
+    if estado['version_id'] != version_id:
+        if estado['version_id'] is None or version_id is None:
+            return None
+        alterados = _fornecedores_alterados(estado['version_id'], version_id)
+        if alterados:
+            pares = consultar_fornecedor_produto(fornecedores=alterados, periodo=periodo, data_path=data_path)
+            afetados |= set(pares['CODIGO_PRODUTO'].astype(object))
+    return afetados
+
+
+def _ranking(produtos, periodo, data_path, k, version_id):
+    df_pares = consultar_fornecedor_produto(
+        produtos=sorted(produtos) if produtos is not None else None, periodo=periodo, data_path=data_path
+    )
+    return ranquear_fornecedores(df_pares, carregar_classificacao(version_id, data_path), k)
+
+
+def _ler_estado(cursor, periodo):
+    cursor.execute("SELECT k, version_id, versao_dados FROM top_fornecedores_estado WHERE periodo = ?", (periodo,))
+    row = cursor.fetchone()
+    return dict(zip(['k', 'version_id', 'versao_dados'], row)) if row else None
+
+
+def _atualizar_sqlite(periodo, data_path, k, produtos, versao_dados, version_id):
+    conn = get_connection(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        estado = _ler_estado(cursor, periodo)
+        afetados = _produtos_a_atualizar(estado, versao_dados, version_id, k, produtos, periodo, data_path)
+        if afetados is None:
+            ranking = _ranking(None, periodo, data_path, k, version_id)
+            cursor.execute("DELETE FROM top_fornecedores_produto WHERE periodo = ?", (periodo,))
+        elif afetados:
+            ranking = _ranking(afetados, periodo, data_path, k, version_id)
+            cursor.executemany(
+                "DELETE FROM top_fornecedores_produto WHERE periodo = ? AND CODIGO_PRODUTO = ?",
+                [(periodo, produto) for produto in afetados]
+            )
+        elif (estado['versao_dados'], estado['version_id']) == (versao_dados, version_id):
+            return 0
+        else:
+            ranking = pd.DataFrame(columns=COLUNAS_INDICE)
+
+        linhas = ranking.astype(object).where(ranking.notna(), None)
+        cursor.executemany(f'''
+        INSERT INTO top_fornecedores_produto (periodo, {", ".join(COLUNAS_INDICE)})
+        VALUES (?, {", ".join("?" * len(COLUNAS_INDICE))})
+        ''', [(periodo, *linha) for linha in linhas.itertuples(index=False, name=None)])
+        cursor.execute('''
+        INSERT INTO top_fornecedores_estado (periodo, k, version_id, versao_dados, atualizado_em)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(periodo) DO UPDATE SET
+            k=excluded.k, version_id=excluded.version_id,
+            versao_dados=excluded.versao_dados, atualizado_em=excluded.atualizado_em
+        ''', (periodo, k, version_id, versao_dados, datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    return len(afetados) if afetados is not None else ranking['CODIGO_PRODUTO'].nunique()
+
+
+def _atualizar_memoria(periodo, data_path, k, produtos, versao_dados, version_id):
+    chave = (str(data_path), periodo)
+    with _INDICES_LOCK:
+        entrada = _INDICES.get(chave)
+        afetados = _produtos_a_atualizar(entrada, versao_dados, version_id, k, produtos, periodo, data_path)
+        if afetados is None:
+            indice = _ranking(None, periodo, data_path, k, version_id)
+        elif afetados:
+            indice = pd.concat([
+                entrada['indice'][~entrada['indice']['CODIGO_PRODUTO'].isin(afetados)],
+                _ranking(afetados, periodo, data_path, k, version_id)
+            ], ignore_index=True)
+        else:
+            indice = entrada['indice']
+
+        if afetados is None or afetados:
+            # Indexado por CODIGO_PRODUTO para a busca por produto em top_fornecedores
+            indice = indice.set_index(indice['CODIGO_PRODUTO'].rename(None)).sort_index(kind='stable')
+        _INDICES[chave] = {'k': k, 'version_id': version_id, 'versao_dados': versao_dados, 'indice': indice}
+    return len(afetados) if afetados is not None else indice['CODIGO_PRODUTO'].nunique()
+
+
+def atualizar_indice_top(periodo=PERIODO_ATUAL, data_path=None, produtos=None, k=K_TOP_FORNECEDORES):
+    """
+    Coloca o índice do período em dia com os dados e a versão ativa do
+    classificador. `produtos` informa os produtos com itens novos (ingestão
+    incremental). Retorna o número de produtos reordenados (0 = já estava em dia).
+    """
+    ativa = db_get_active_model_version()
+    version_id = ativa['id'] if ativa else None
+    versao_dados = versao_nf(periodo, data_path)
+
+    if wh_disponivel(periodo, data_path):
+        atualizados = _atualizar_sqlite(periodo, data_path, k, produtos, versao_dados, version_id)
+    else:
+        atualizados = _atualizar_memoria(periodo, data_path, k, produtos, versao_dados, version_id)
+    if atualizados:
+        print(f"[*] Índice de fornecedores ({periodo}): {atualizados} produto(s) reordenado(s)")
+    return atualizados
+
+
+def top_fornecedores(produtos, periodo=PERIODO_ATUAL, data_path=None, k=K_TOP_FORNECEDORES):
+    """
+    Melhores fornecedores (até k, limitado a K_TOP_FORNECEDORES) de cada produto,
+    lidos do índice materializado. Uma linha por (produto, posição).
+    """
+    atualizar_indice_top(periodo, data_path)
+    produtos = list(dict.fromkeys(produtos))
+
+    if wh_disponivel(periodo, data_path):
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            return pd.read_sql_query(f'''
+            SELECT {", ".join(COLUNAS_INDICE)} FROM top_fornecedores_produto
+            WHERE periodo = ? AND posicao <= ? AND CODIGO_PRODUTO IN ({",".join("?" * len(produtos))})
+            ORDER BY CODIGO_PRODUTO, posicao
+            ''', conn, params=[periodo, k] + produtos)
+        finally:
+            conn.close()
+
+    # Busca pelo índice (hash) de CODIGO_PRODUTO, sem percorrer o índice inteiro
+    indice = _INDICES[(str(data_path), periodo)]['indice']
+    top = indice.loc[[produto for produto in produtos if produto in indice.index]]
+    return top[top['posicao'] <= k].reset_index(drop=True)
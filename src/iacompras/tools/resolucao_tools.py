@@ -0,0 +1,342 @@
+"""
+Resolução de fornecedores - IACOMPRAS
+Mapeia razões sociais (com variações de grafia) e CNPJs (com ou sem
+formatação) para um único id inteiro por fornecedor, de modo que seleções e
+junções usem o id em vez do texto livre.
+
+- Nome: chave normalizada (sem acentos, pontuação e sufixos societários como
+  LTDA, ME, EPP, S.A.), então "TOLEAGRI - TOLEDO PECAS AGRICOLAS LTDA - EPP" e
+  "TOLEAGRI - TOLEDO PECAS AGRICOLAS LTDA" são o mesmo fornecedor.
+- CNPJ: 14 dígitos (data_tools.cnpj_canonico); na falta do CNPJ completo vale a
+  raiz (8 dígitos, informada sozinha ou tirada do CNPJ) quando ela pertence a
+  um único fornecedor.
+- Demais grafias: o nome mais próximo por trigramas (search_tools), acima de
+  LIMIAR_FORNECEDOR, memorizado (LRU de APROXIMADOS_MAX consultas) e registrado
+  no log com o nome canônico escolhido.
+
+Os ids são as chaves substitutas de dim_fornecedor (e produto_id de
+dim_produto): atribuídos na primeira vez que a chave aparece e estáveis entre
+versões dos dados. O índice é montado uma vez por versão; sem banco
+inicializado os ids são a posição alfabética do nome canônico + 1, válidos só
+em memória (chaves_dimensoes não os entrega para gravação).
+"""
+import os
+import re
+import json
+import hashlib
+import functools
+import threading
+import unicodedata
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from iacompras.tools.data_tools import (
+    NF_ARQUIVOS,
+    PERIODO_ATUAL,
+    cnpj_canonico,
+    load_nf_headers,
+    load_nf_fatos,
+    versao_nf
+)
+from iacompras.tools.db_tools import db_sync_dim_fornecedor, db_sync_dim_produto
+from iacompras.tools.search_tools import N_TRIGRAMAS, get_indice_produtos, normalizar_texto, trigramas
+
+# Similaridade (Dice de trigramas) mínima para aceitar um nome aproximado
+LIMIAR_FORNECEDOR = float(os.getenv("IACOMPRAS_LIMIAR_FORNECEDOR", "0.8"))
+# Consultas aproximadas memorizadas por índice
+APROXIMADOS_MAX = int(os.getenv("IACOMPRAS_APROXIMADOS_MAX", "4096"))
+
+# Sufixos societários ignorados na comparação de nomes
+SUFIXOS_SOCIETARIOS = r'(\s+(ltda|me|epp|eireli|mei|sa|s a|cia))+$'
+
+_INDICES = {}
+_PRODUTOS = {}
+_INDICES_LOCK = threading.Lock()
+# Notas e fatos com as chaves inteiras, por período (montados uma vez por versão)
+_COM_CHAVES = {}
+_COM_CHAVES_LOCK = threading.Lock()
+
+
+def chave_nome(nomes):
+    """Chave de comparação das razões sociais (Series alinhada)."""
+    return normalizar_texto(nomes).str.replace(SUFIXOS_SOCIETARIOS, '', regex=True)
+
+
+def _chave_nome_texto(nome):
+    """chave_nome de um único texto, sem passar pelo pandas (consultas pontuais)."""
+    texto = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii').lower()
+    texto = re.sub(r'[^a-z0-9]+', ' ', texto).strip()
+    return re.sub(SUFIXOS_SOCIETARIOS, '', texto)
+
+
+class IndiceFornecedores:
+    """
+    Índice de resolução: `razoes` é o nome canônico de cada fornecedor (em ordem
+    alfabética), `ids` a chave substituta de cada um (dim_fornecedor) e `cnpjs` o
+    CNPJ mais frequente; `por_nome`, `por_cnpj` e `por_raiz` são os dicionários de busca.
+    `persistido` indica se os ids vieram de dim_fornecedor (e não da posição).
+    """
+
+    def __init__(self, df_fornecedores, versao=None, dimensao=None):
+        df = df_fornecedores.assign(
+            RAZAO_FORNECEDOR=df_fornecedores['RAZAO_FORNECEDOR'].astype(object),
+            CNPJ_FORNECEDOR=df_fornecedores['CNPJ_FORNECEDOR'].astype(object),
+        )
+        df = df[df['RAZAO_FORNECEDOR'].notna()]
+        df['chave'] = chave_nome(df['RAZAO_FORNECEDOR']).to_numpy()
+
+        # Nome canônico: a grafia com mais notas de cada chave
+        notas_nome = df.groupby(['chave', 'RAZAO_FORNECEDOR'])['notas'].sum().reset_index()
+        canonicos = notas_nome.sort_values('notas', ascending=False, kind='stable').drop_duplicates('chave')
+        canonicos = canonicos.sort_values('RAZAO_FORNECEDOR', kind='stable').reset_index(drop=True)
+
+        self.razoes = pd.Index(canonicos['RAZAO_FORNECEDOR'], name='RAZAO_FORNECEDOR')
+        self.chaves = canonicos['chave'].to_numpy()
+        df['posicao'] = df['chave'].map(dict(zip(self.chaves, range(len(self.chaves)))))
+
+        # CNPJ -> fornecedor com mais notas naquele CNPJ
+        por_cnpj = (
+            df[df['CNPJ_FORNECEDOR'].notna()]
+            .groupby(['CNPJ_FORNECEDOR', 'posicao'])['notas'].sum().reset_index()
+            .sort_values('notas', ascending=False, kind='stable')
+        )
+        cnpjs = por_cnpj.drop_duplicates('posicao').set_index('posicao')['CNPJ_FORNECEDOR'].reindex(range(len(self.razoes)))
+        self.cnpjs = cnpjs.astype(object).where(cnpjs.notna(), None).to_numpy()
+
+        # Chaves substitutas persistidas em dim_fornecedor (sem banco: posição + 1)
+        mapa = dimensao(list(zip(self.chaves, self.razoes, self.cnpjs))) if dimensao else None
+        ids = [mapa[chave] for chave in self.chaves] if mapa else range(1, len(self.chaves) + 1)
+        self.persistido = bool(mapa)
+        self.ids = np.asarray(ids, dtype='int32')
+        self._posicao_do_id = np.full(int(self.ids.max(initial=0)) + 1, -1, dtype='int64')
+        self._posicao_do_id[self.ids] = np.arange(len(self.ids))
+
+        self.por_nome = dict(zip(self.chaves, self.ids.tolist()))
+        self.por_nome.update(zip(df['RAZAO_FORNECEDOR'], self.ids[df['posicao'].to_numpy()].tolist()))
+        por_cnpj['fornecedor_id'] = self.ids[por_cnpj['posicao'].to_numpy()]
+        self.por_cnpj = dict(por_cnpj.drop_duplicates('CNPJ_FORNECEDOR')[['CNPJ_FORNECEDOR', 'fornecedor_id']].to_numpy().tolist())
+        raizes = por_cnpj.assign(raiz=por_cnpj['CNPJ_FORNECEDOR'].str[:8]).drop_duplicates(['raiz', 'fornecedor_id'])
+        raizes = raizes.drop_duplicates('raiz', keep=False)
+        self.por_raiz = dict(raizes[['raiz', 'fornecedor_id']].to_numpy().tolist())
+
+        documento, trigrama = trigramas(self.chaves)
+        self._postings = sparse.csr_matrix(
+            (np.ones(len(trigrama), dtype='int32'), (trigrama, documento)), shape=(N_TRIGRAMAS, len(self.chaves))
+        )
+        self._postings.sum_duplicates()
+        self._postings.data[:] = 1
+        self._n_trigramas = np.diff(self._postings.tocsc().indptr)
+        self._aproximados = functools.lru_cache(maxsize=APROXIMADOS_MAX)(self._mais_proximo)
+        self.versao = versao
+
+    def posicoes(self, ids):
+        """Posição em `razoes` de cada id (-1 para ids desconhecidos)."""
+        ids = np.asarray(ids, dtype='int64')
+        validos = (ids >= 0) & (ids < len(self._posicao_do_id))
+        return np.where(validos, self._posicao_do_id[np.where(validos, ids, 0)], -1)
+
+    def nomes(self, ids):
+        """Nome canônico de cada id."""
+        return self.razoes[self.posicoes(ids)]
+
+    def resolver(self, valor):
+        """Id do fornecedor de uma razão social ou CNPJ, ou None se não encontrado."""
+        if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+            return None
+        texto = str(valor).strip()
+        if texto in self.por_nome:
+            return self.por_nome[texto]
+
+        # CNPJ: apenas dígitos e pontuação de CNPJ
+        if texto and all(c.isdigit() or c in ".-/ " for c in texto) or isinstance(valor, (int, float)):
+            cnpj = cnpj_canonico(valor)
+            if cnpj is None:
+                return None
+            # Raiz informada sozinha (8 dígitos): consultada antes do preenchimento com zeros
+            digitos = cnpj.lstrip('0') if isinstance(valor, (int, float)) else "".join(filter(str.isdigit, texto))
+            if len(digitos) == 8 and digitos in self.por_raiz:
+                return self.por_raiz[digitos]
+            return self.por_cnpj.get(cnpj, self.por_raiz.get(cnpj[:8]))
+
+        chave = _chave_nome_texto(texto)
+        if chave in self.por_nome:
+            return self.por_nome[chave]
+        return self._aproximados(chave)
+
+    def resolver_varios(self, valores):
+        """Ids dos valores informados (array int32, -1 para os não encontrados)."""
+        ids = [self.resolver(valor) for valor in valores]
+        return np.array([-1 if i is None else i for i in ids], dtype='int32')
+
+    def ids_razoes(self, razoes):
+        """
+        Ids das razões sociais como aparecem nas notas (vetorizado sobre as
+        grafias distintas; -1 para razões fora do índice).
+        """
+        razoes = pd.Series(razoes, dtype=object)
+        distintas = pd.Series(razoes.unique())
+        ids = distintas.map(self.por_nome)
+        faltantes = ids.isna() & distintas.notna()
+        if faltantes.any():
+            ids[faltantes] = chave_nome(distintas[faltantes]).map(self.por_nome).to_numpy()
+        mapa = pd.Series(ids.fillna(-1).astype('int32').to_numpy(), index=distintas)
+        return mapa.reindex(razoes).to_numpy()
+
+    def _mais_proximo(self, chave):
+        consulta = np.unique(trigramas([chave])[1])
+        if len(consulta) == 0 or len(self.chaves) == 0:
+            return None
+        comuns = np.asarray(self._postings[consulta].sum(axis=0)).ravel()
+        dice = 2 * comuns / (len(consulta) + self._n_trigramas)
+        melhor = int(np.argmax(dice))
+        if dice[melhor] < LIMIAR_FORNECEDOR:
+            return None
+        print(f"[*] Fornecedor '{chave}' resolvido por aproximação: {self.razoes[melhor]} "
+              f"(similaridade {dice[melhor]:.2f})")
+        return int(self.ids[melhor])
+
+
+def _fornecedores_periodos(periodos, data_path):
+    """Pares (razão social, CNPJ) das notas de todos os períodos, com o número de notas."""
+    partes = [
+        load_nf_headers(periodo, data_path)[['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR']].astype(object)
+        for periodo in periodos
+    ]
+    df = pd.concat(partes, ignore_index=True)
+    return df.groupby(['RAZAO_FORNECEDOR', 'CNPJ_FORNECEDOR'], dropna=False).size().rename('notas').reset_index()
+
+
+def get_indice_fornecedores(periodos=None, data_path=None):
+    """
+    Índice de resolução dos fornecedores de todos os períodos (padrão:
+    NF_ARQUIVOS), montado uma vez por versão dos dados.
+    """
+    periodos = tuple(periodos or NF_ARQUIVOS)
+    versoes = [versao_nf(periodo, data_path) for periodo in periodos]
+    versao = hashlib.sha1(json.dumps([periodos, versoes]).encode()).hexdigest()[:12]
+    chave = (str(data_path), periodos)
+
+    entrada = _INDICES.get(chave)
+    if entrada is not None and entrada.versao == versao:
+        return entrada
+
+    with _INDICES_LOCK:
+        entrada = _INDICES.get(chave)
+        if entrada is None or entrada.versao != versao:
+            entrada = IndiceFornecedores(_fornecedores_periodos(periodos, data_path), versao, db_sync_dim_fornecedor)
+            _INDICES[chave] = entrada
+            print(f"[*] Índice de fornecedores: {len(entrada.razoes)} fornecedores, "
+                  f"{len(entrada.por_cnpj)} CNPJs")
+    return entrada
+
+
+def resolver_fornecedores(valores, data_path=None):
+    """Ids dos fornecedores (razões sociais ou CNPJs), -1 para os não encontrados."""
+    return get_indice_fornecedores(data_path=data_path).resolver_varios(valores)
+
+
+def _entrada_produtos(periodos, data_path):
+    """(versão, ids por código, ids vindos de dim_produto) dos períodos, em cache por versão."""
+    produtos = get_indice_produtos(periodos, data_path)
+    chave = (str(data_path), tuple(periodos or NF_ARQUIVOS))
+
+    entrada = _PRODUTOS.get(chave)
+    if entrada is not None and entrada[0] == produtos.versao:
+        return entrada
+
+    with _INDICES_LOCK:
+        entrada = _PRODUTOS.get(chave)
+        if entrada is None or entrada[0] != produtos.versao:
+            df = produtos.produtos[['CODIGO_PRODUTO', 'PRODUTO', 'GRUPO', 'MARCA']].astype(object)
+            df = df.where(df.notna(), None)
+            mapa = db_sync_dim_produto(df.itertuples(index=False, name=None))
+            codigos = df['CODIGO_PRODUTO']
+            ids = codigos.map(mapa) if mapa else pd.Series(range(1, len(df) + 1))
+            entrada = (
+                produtos.versao,
+                pd.Series(ids.to_numpy(dtype='int32'), index=pd.Index(codigos, name='CODIGO_PRODUTO')),
+                bool(mapa)
+            )
+            _PRODUTOS[chave] = entrada
+    return entrada
+
+
+def get_ids_produtos(periodos=None, data_path=None):
+    """
+    Chave substituta (produto_id, dim_produto) de cada CODIGO_PRODUTO dos
+    períodos, como Series int32 indexada pelo código. Sincronizada com a
+    dimensão uma vez por versão dos dados (sem banco: posição + 1).
+    """
+    return _entrada_produtos(periodos, data_path)[1]
+
+
+def ids_produtos(codigos, data_path=None):
+    """produto_id de cada código (array int32, -1 para códigos desconhecidos)."""
+    ids = get_ids_produtos(data_path=data_path).reindex(pd.Index(list(codigos), dtype=object))
+    return ids.fillna(-1).to_numpy(dtype='int32')
+
+
+def adicionar_chaves(df, data_path=None):
+    """
+    Acrescenta a um frame de fatos as chaves int32 fornecedor_id (de
+    RAZAO_FORNECEDOR) e produto_id (de CODIGO_PRODUTO), para as colunas presentes.
+    """
+    chaves = {}
+    if 'RAZAO_FORNECEDOR' in df:
+        chaves['fornecedor_id'] = get_indice_fornecedores(data_path=data_path).ids_razoes(df['RAZAO_FORNECEDOR'])
+    if 'CODIGO_PRODUTO' in df:
+        chaves['produto_id'] = ids_produtos(df['CODIGO_PRODUTO'].astype(object), data_path)
+    return df.assign(**chaves)
+
+
+def _com_chaves(periodo, data_path, tipo, carregar):
+    """
+    Frame do período com adicionar_chaves aplicado, em cache até mudar a versão
+    dos dados ou dos índices. As chaves não entram no próprio DatasetNF porque
+    os índices de fornecedores e produtos são montados a partir dos datasets.
+    """
+    indice = get_indice_fornecedores(data_path=data_path)
+    versao = (versao_nf(periodo, data_path), indice.versao)
+    if tipo == 'fatos':
+        versao += (_entrada_produtos(None, data_path)[0],)
+    chave = (str(data_path), periodo, tipo)
+
+    entrada = _COM_CHAVES.get(chave)
+    if entrada is not None and entrada[0] == versao:
+        return entrada[1]
+
+    with _COM_CHAVES_LOCK:
+        entrada = _COM_CHAVES.get(chave)
+        if entrada is None or entrada[0] != versao:
+            entrada = (versao, adicionar_chaves(carregar(periodo, data_path), data_path))
+            _COM_CHAVES[chave] = entrada
+    return entrada[1]
+
+
+def load_nf_headers_chaves(periodo=PERIODO_ATUAL, data_path=None):
+    """Cabeçalhos das notas fiscais com o fornecedor_id (int32) de cada nota."""
+    return _com_chaves(periodo, data_path, 'headers', load_nf_headers).copy(deep=False)
+
+
+def load_nf_fatos_chaves(periodo=PERIODO_ATUAL, data_path=None):
+    """Tabela fato (itens unidos à nota) com fornecedor_id e produto_id (int32)."""
+    return _com_chaves(periodo, data_path, 'fatos', load_nf_fatos).copy(deep=False)
+
+
+def chaves_dimensoes(fornecedores, codigos, data_path=None):
+    """
+    fornecedor_id de cada fornecedor (razão social ou CNPJ) e produto_id de cada
+    código, como listas com None para os não resolvidos, para gravar no banco.
+    Sem as dimensões no banco os ids são posicionais e não são entregues (tudo None).
+    """
+    indice = get_indice_fornecedores(data_path=data_path)
+    _, ids_codigos, produtos_persistidos = _entrada_produtos(None, data_path)
+
+    fornecedor_ids = [None] * len(fornecedores)
+    if indice.persistido:
+        fornecedor_ids = [int(i) if i >= 0 else None for i in indice.resolver_varios(fornecedores)]
+    produto_ids = [None] * len(codigos)
+    if produtos_persistidos:
+        ids = ids_codigos.reindex(pd.Index(list(codigos), dtype=object)).fillna(-1).to_numpy(dtype='int32')
+        produto_ids = [int(i) if i >= 0 else None for i in ids]
+    return fornecedor_ids, produto_ids
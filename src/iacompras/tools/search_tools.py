@@ -0,0 +1,233 @@
+"""
+Busca de produtos por descrição - IACOMPRAS
+Índice invertido de trigramas sobre PRODUTO, GRUPO e MARCA (e o próprio
+CODIGO_PRODUTO) dos itens das notas fiscais. Cada termo é normalizado (sem
+acentos, minúsculo, só letras e dígitos) e decomposto em trigramas com as
+bordas da palavra ("  parafuso" -> " pa", "par", ..., "so "), de modo que uma
+consulta vira a soma das listas de produtos dos seus trigramas:
+
+- trecho exato ("inox 304"): todos os trigramas presentes, cobertura 1;
+- erro de digitação ("parafuzo"): a maior parte dos trigramas ainda coincide.
+
+O índice é uma matriz esparsa trigrama x produto (scipy CSR), montada uma vez
+por versão dos dados e gravada em `.cache/` ao lado dos workbooks, de onde é
+recarregada enquanto os workbooks não mudam.
+"""
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from iacompras.tools.data_tools import CACHE_DIRNAME, NF_ARQUIVOS, get_agregados_itens, nf_paths, versao_nf
+
+# Fração mínima dos trigramas da consulta presentes no produto
+LIMIAR_BUSCA = float(os.getenv("IACOMPRAS_LIMIAR_BUSCA", "0.5"))
+LIMITE_BUSCA = 10
+# Consultas sem nenhuma palavra deste tamanho (um trigrama completo) não são buscadas:
+# com uma ou duas letras todo produto que as contém teria cobertura 1
+BUSCA_MIN_CARACTERES = 3
+
+# Alfabeto dos textos normalizados: espaço, dígitos e letras (trigrama = número de 3 dígitos na base 37)
+ALFABETO = " 0123456789abcdefghijklmnopqrstuvwxyz"
+N_TRIGRAMAS = len(ALFABETO) ** 3
+
+COLUNAS_PRODUTO = ['CODIGO_PRODUTO', 'PRODUTO', 'GRUPO', 'MARCA', 'compras', 'texto']
+
+_INDICES = {}
+_INDICES_LOCK = threading.Lock()
+
+_CODIGOS_ALFABETO = np.full(256, -1, dtype='int64')
+_CODIGOS_ALFABETO[np.frombuffer(ALFABETO.encode(), dtype='uint8')] = np.arange(len(ALFABETO))
+
+
+def normalizar_texto(textos):
+    """Minúsculas, sem acentos e com qualquer sequência fora de [a-z0-9] reduzida a um espaço."""
+    return (
+        pd.Series(textos, dtype=object).fillna('').astype(str)
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+        .str.lower().str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+    )
+
+
+def trigramas(textos):
+    """
+    Trigramas de cada texto já normalizado. Retorna (documento, trigrama) em
+    arrays alinhados, com repetições; os textos são processados de uma vez,
+    concatenados e separados por um marcador que invalida os trigramas da junção.
+    """
+    textos = list(textos)
+    if not textos:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+
+    # " texto " + marcador: as bordas das palavras entram nos trigramas
+    bruto = "".join(f" {texto} \x00" for texto in textos).encode('ascii')
+    codigos = _CODIGOS_ALFABETO[np.frombuffer(bruto, dtype='uint8')]
+    documento = np.repeat(np.arange(len(textos)), [len(texto) + 3 for texto in textos])
+
+    c0, c1, c2 = codigos[:-2], codigos[1:-1], codigos[2:]
+    base = len(ALFABETO)
+    # Descarta trigramas com o marcador e os que atravessam duas palavras (espaço no meio)
+    validos = (c0 >= 0) & (c1 > 0) & (c2 >= 0)
+    trigrama = (c0 * base + c1) * base + c2
+    return documento[:-2][validos], trigrama[validos]
+
+
+class IndiceProdutos:
+    """
+    Índice invertido trigrama -> produtos. `produtos` traz os atributos de cada
+    produto (mesma ordem das colunas de `postings`) e `n_trigramas` o número de
+    trigramas distintos de cada um.
+    """
+
+    def __init__(self, produtos, postings, versao=None):
+        self.produtos = produtos.reset_index(drop=True)
+        self.postings = postings
+        self.n_trigramas = np.diff(postings.tocsc().indptr)
+        self.versao = versao
+        self._textos = self.produtos['texto'].to_numpy(dtype=str)
+        self._compras = self.produtos['compras'].to_numpy(dtype='int64')
+
+    @classmethod
+    def montar(cls, produtos, versao=None):
+        produtos = produtos.assign(texto=normalizar_texto(
+            produtos['CODIGO_PRODUTO'].astype(str) + " " + produtos['PRODUTO'].astype(str) + " " +
+            produtos['GRUPO'].fillna('').astype(str) + " " + produtos['MARCA'].fillna('').astype(str)
+        ).to_numpy())
+        documento, trigrama = trigramas(produtos['texto'])
+        postings = sparse.csr_matrix(
+            (np.ones(len(trigrama), dtype='int8'), (trigrama, documento)), shape=(N_TRIGRAMAS, len(produtos))
+        )
+        postings.sum_duplicates()
+        postings.data[:] = 1
+        return cls(produtos[COLUNAS_PRODUTO], postings, versao)
+
+    def buscar(self, consulta, limite=LIMITE_BUSCA, limiar=LIMIAR_BUSCA):
+        """
+        Produtos mais próximos da consulta, do melhor para o pior: primeiro os
+        que contêm o trecho exato, depois pela cobertura dos trigramas da
+        consulta, pela similaridade (Dice) e pelo número de compras.
+        DataFrame com os atributos do produto e `score` (cobertura, 0 a 1);
+        vazio para consultas curtas demais (BUSCA_MIN_CARACTERES).
+        """
+        termo = normalizar_texto([consulta]).iloc[0]
+        if max(map(len, termo.split()), default=0) < BUSCA_MIN_CARACTERES:
+            return self.produtos.iloc[:0].assign(score=pd.Series(dtype='float64'))
+        consulta_trigramas = np.unique(trigramas([termo])[1])
+        if len(consulta_trigramas) == 0 or len(self.produtos) == 0:
+            return self.produtos.iloc[:0].assign(score=pd.Series(dtype='float64'))
+
+        # Concatena as listas de produtos dos trigramas da consulta e conta as ocorrências
+        inicio = self.postings.indptr[consulta_trigramas]
+        tamanho = self.postings.indptr[consulta_trigramas + 1] - inicio
+        deslocamento = np.repeat(inicio - np.cumsum(tamanho) + tamanho, tamanho)
+        documentos = self.postings.indices[np.arange(tamanho.sum()) + deslocamento]
+        comuns = np.bincount(documentos, minlength=len(self.produtos))
+
+        cobertura = comuns / len(consulta_trigramas)
+        candidatos = np.flatnonzero(cobertura >= limiar)
+        if len(candidatos) == 0:
+            return self.produtos.iloc[:0].assign(score=pd.Series(dtype='float64'))
+
+        dice = 2 * comuns[candidatos] / (len(consulta_trigramas) + self.n_trigramas[candidatos])
+        exato = np.char.find(self._textos[candidatos], termo) >= 0
+        compras = self._compras[candidatos]
+
+        ordem = np.lexsort((-compras, -dice, -cobertura[candidatos], ~exato))[:limite]
+        resultado = self.produtos.iloc[candidatos[ordem]].reset_index(drop=True)
+        resultado['score'] = np.round(cobertura[candidatos[ordem]], 4)
+        return resultado
+
+
+def _produtos_periodos(periodos, data_path):
+    """Um registro por produto: atributos do período mais recente e compras somadas."""
+    partes = [
+        get_agregados_itens(periodo, data_path)['produto'][['compras', 'PRODUTO', 'GRUPO', 'MARCA']]
+        .reset_index().astype({'CODIGO_PRODUTO': object, 'PRODUTO': object, 'GRUPO': object, 'MARCA': object})
+        for periodo in periodos
+    ]
+    df = pd.concat(partes, ignore_index=True)
+    compras = df.groupby('CODIGO_PRODUTO', sort=False)['compras'].sum()
+    df = df.drop_duplicates('CODIGO_PRODUTO', keep='last').sort_values('CODIGO_PRODUTO', kind='stable')
+    return df.assign(compras=compras.reindex(df['CODIGO_PRODUTO']).to_numpy())
+
+
+def _prefixo_cache(periodos):
+    """Prefixo dos arquivos do índice de um conjunto de períodos (um arquivo vigente por conjunto)."""
+    return f"indice_produtos_{hashlib.sha1(json.dumps(list(periodos)).encode()).hexdigest()[:8]}_"
+
+
+def _arquivos_cache(periodos, data_path, versao):
+    cache_dir = nf_paths(periodos[0], data_path)[0].parent / CACHE_DIRNAME
+    nome = f"{_prefixo_cache(periodos)}{versao}"
+    return cache_dir / f"{nome}.parquet", cache_dir / f"{nome}.npz"
+
+
+def _carregar(periodos, data_path, versao):
+    produtos_path, postings_path = _arquivos_cache(periodos, data_path, versao)
+    if not (produtos_path.exists() and postings_path.exists()):
+        return None
+    try:
+        with np.load(postings_path) as arrays:
+            postings = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape'])
+            )
+        return IndiceProdutos(pd.read_parquet(produtos_path), postings, versao)
+    except Exception as e:
+        print(f"[!] Índice de busca inválido, remontando: {e}")
+        return None
+
+
+def _gravar(indice, periodos, data_path):
+    produtos_path, postings_path = _arquivos_cache(periodos, data_path, indice.versao)
+    try:
+        os.makedirs(produtos_path.parent, exist_ok=True)
+        indice.produtos.to_parquet(produtos_path.with_suffix(".parquet.tmp"), index=False)
+        with open(postings_path.with_suffix(".npz.tmp"), "wb") as f:
+            np.savez(f, data=indice.postings.data, indices=indice.postings.indices,
+                     indptr=indice.postings.indptr, shape=np.array(indice.postings.shape))
+        os.replace(produtos_path.with_suffix(".parquet.tmp"), produtos_path)
+        os.replace(postings_path.with_suffix(".npz.tmp"), postings_path)
+        # Remove os índices de versões anteriores dos mesmos períodos (outros conjuntos
+        # de períodos, usados por outros chamadores, continuam válidos)
+        for antigo in produtos_path.parent.glob(f"{_prefixo_cache(periodos)}*"):
+            if antigo not in (produtos_path, postings_path):
+                antigo.unlink(missing_ok=True)
+    except Exception as e:
+        print(f"[!] Não foi possível gravar o índice de busca: {e}")
+
+
+def get_indice_produtos(periodos=None, data_path=None):
+    """
+    Índice de busca dos produtos de todos os períodos (padrão: NF_ARQUIVOS),
+    montado uma vez por versão dos dados e persistido em `.cache/`.
+    """
+    periodos = tuple(periodos or NF_ARQUIVOS)
+    versoes = [versao_nf(periodo, data_path) for periodo in periodos]
+    versao = hashlib.sha1(json.dumps([periodos, versoes]).encode()).hexdigest()[:12]
+    chave = (str(data_path), periodos)
+
+    entrada = _INDICES.get(chave)
+    if entrada is not None and entrada.versao == versao:
+        return entrada
+
+    with _INDICES_LOCK:
+        entrada = _INDICES.get(chave)
+        if entrada is None or entrada.versao != versao:
+            entrada = _carregar(periodos, data_path, versao)
+            if entrada is None:
+                entrada = IndiceProdutos.montar(_produtos_periodos(periodos, data_path), versao)
+                _gravar(entrada, periodos, data_path)
+                print(f"[*] Índice de busca de produtos: {len(entrada.produtos)} produtos, "
+                      f"{entrada.postings.nnz} trigramas indexados")
+            _INDICES[chave] = entrada
+    return entrada
+
+
+def buscar_produtos(consulta, limite=LIMITE_BUSCA, periodos=None, data_path=None):
+    """
+    Produtos cuja descrição, grupo, marca ou código correspondem à consulta em
+    texto livre (trecho ou com erros de digitação), em ordem de relevância.
+    """
+    return get_indice_produtos(periodos, data_path).buscar(consulta, limite)
@@ -0,0 +1,185 @@
+"""
+Consultas ao warehouse de notas fiscais no SQLite - IACOMPRAS
+As tabelas notas_fiscais / nota_fiscal_itens são carregadas por ingest_tools e
+indexadas por fornecedor e produto; filtrar poucos fornecedores ou produtos vira
+uma busca indexada em vez de percorrer todo o histórico em memória.
+
+O agregado fornecedor x produto é agrupado pelo fornecedor resolvido
+(fornecedor_id, ver resolucao_tools), com o nome canônico do fornecedor:
+grafias diferentes da mesma razão social são um único fornecedor.
+
+Enquanto o warehouse não estiver carregado (ou estiver desatualizado em relação
+aos workbooks) as consultas usam os agregados em memória de data_tools.
+"""
+import os
+import sqlite3
+import pandas as pd
+from iacompras.tools.db_tools import DB_PATH
+from iacompras.tools.data_tools import ATRIBUTOS_ITEM, PERIODO_ATUAL, nf_paths, get_agregados_itens
+from iacompras.tools.resolucao_tools import get_indice_fornecedores
+
+COLUNAS_SOMA = ['compras', 'soma_quantidade', 'soma_valor_unitario', 'n_valor_unitario']
+
+# Mesmas colunas do agregado 'fornecedor_produto' de data_tools, por fornecedor_id
+SQL_FORNECEDOR_PRODUTO = '''
+SELECT g.fornecedor_id, d.RAZAO_FORNECEDOR, g.CODIGO_PRODUTO, g.compras, g.soma_quantidade,
+       g.soma_valor_unitario, g.n_valor_unitario, g.primeira_linha, g.ultima_linha,
+       u.PRODUTO, u.VALOR_UNITARIO, u.GRUPO, u.MARCA
+FROM (
+    SELECT n.fornecedor_id, i.CODIGO_PRODUTO,
+           COUNT(*) AS compras,
+           SUM(i.QUANTIDADE_COMPRA) AS soma_quantidade,
+           SUM(i.VALOR_UNITARIO) AS soma_valor_unitario,
+           COUNT(i.VALOR_UNITARIO) AS n_valor_unitario,
+           MIN(i.id) AS primeira_linha,
+           MAX(i.id) AS ultima_linha
+    FROM nota_fiscal_itens i
+    JOIN notas_fiscais n ON n.CODIGO_COMPRA = i.CODIGO_COMPRA
+    WHERE i.arquivo_origem = ? {filtro}
+    GROUP BY n.fornecedor_id, i.CODIGO_PRODUTO
+) g
+JOIN nota_fiscal_itens u ON u.id = g.ultima_linha
+JOIN dim_fornecedor d ON d.fornecedor_id = g.fornecedor_id
+ORDER BY d.RAZAO_FORNECEDOR, g.CODIGO_PRODUTO
+'''
+
+
+def wh_disponivel(periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Indica se o período foi ingerido no warehouse, se os workbooks no disco são
+    os mesmos da última ingestão (mesmo mtime e tamanho gravados na marca d'água)
+    e se todas as notas têm o fornecedor resolvido (fornecedor_id).
+    """
+    if not os.path.exists(DB_PATH):
+        return False
+
+    paths = nf_paths(periodo, data_path)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        # Sem a tabela (ou sem a assinatura dos arquivos, anterior à migração) não há o que comparar
+        cursor.execute("PRAGMA table_info(nf_watermark)")
+        if 'mtime_ns' not in [col[1] for col in cursor.fetchall()]:
+            return False
+
+        for path in paths:
+            cursor.execute("SELECT mtime_ns, tamanho FROM nf_watermark WHERE arquivo = ?", (path.name,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            if path.exists() and tuple(row) != (path.stat().st_mtime_ns, path.stat().st_size):
+                print(f"[!] Warehouse desatualizado para {path.name}. Execute a ingestão incremental.")
+                return False
+
+        cursor.execute("PRAGMA table_info(notas_fiscais)")
+        if 'fornecedor_id' not in [col[1] for col in cursor.fetchall()]:
+            return False
+        cursor.execute("SELECT 1 FROM notas_fiscais WHERE fornecedor_id IS NULL AND arquivo_origem = ? LIMIT 1",
+                       (paths[0].name,))
+        if cursor.fetchone():
+            print(f"[!] Notas de {paths[0].name} sem fornecedor_id. Execute a ingestão incremental.")
+            return False
+    finally:
+        conn.close()
+    return True
+
+
+def _placeholders(valores):
+    return ",".join("?" * len(valores))
+
+
+def _ids_fornecedores(fornecedores, data_path):
+    """fornecedor_id (sem repetição) dos fornecedores encontrados no índice de resolução."""
+    ids = get_indice_fornecedores(data_path=data_path).resolver_varios(fornecedores)
+    return sorted({int(i) for i in ids if i >= 0})
+
+
+def _pares_por_fornecedor(df, data_path):
+    """
+    Reagrupa o agregado em memória (por razão social como aparece nas notas)
+    por fornecedor_id: somas e contagens somam, posições usam min/max e os
+    atributos vêm do registro mais recente. RAZAO_FORNECEDOR vira o nome canônico.
+    """
+    indice = get_indice_fornecedores(data_path=data_path)
+    df = df.assign(fornecedor_id=indice.ids_razoes(df['RAZAO_FORNECEDOR'].astype(object)))
+    df = df[df['fornecedor_id'] >= 0].sort_values('ultima_linha', kind='stable')
+    grupos = df.groupby(['fornecedor_id', 'CODIGO_PRODUTO'], observed=True)
+    pares = grupos[COLUNAS_SOMA].sum()
+    pares['primeira_linha'] = grupos['primeira_linha'].min()
+    pares['ultima_linha'] = grupos['ultima_linha'].max()
+    pares[ATRIBUTOS_ITEM] = grupos[ATRIBUTOS_ITEM].last()
+    pares = pares.reset_index()
+    pares.insert(1, 'RAZAO_FORNECEDOR', indice.nomes(pares['fornecedor_id']).to_numpy())
+    return pares.sort_values(['RAZAO_FORNECEDOR', 'CODIGO_PRODUTO'], kind='stable')
+
+
+def wh_fornecedor_produto(fornecedores=None, produtos=None, periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Agregado fornecedor x produto do período via SQL, filtrado por fornecedores
+    (razões sociais ou CNPJs, resolvidos para fornecedor_id) e/ou códigos de
+    produto (consultas indexadas).
+    """
+    _, items_path = nf_paths(periodo, data_path)
+    filtro = ""
+    params = [items_path.name]
+    if fornecedores:
+        ids = _ids_fornecedores(fornecedores, data_path)
+        filtro += f" AND n.fornecedor_id IN ({_placeholders(ids)})"
+        params += ids
+    if produtos:
+        filtro += f" AND i.CODIGO_PRODUTO IN ({_placeholders(produtos)})"
+        params += list(produtos)
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return pd.read_sql_query(SQL_FORNECEDOR_PRODUTO.format(filtro=filtro), conn, params=params)
+    finally:
+        conn.close()
+
+
+def wh_produtos_mais_comprados(limite=20, periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Códigos dos produtos mais comprados no período (empates pela primeira aparição).
+    """
+    _, items_path = nf_paths(periodo, data_path)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT CODIGO_PRODUTO FROM nota_fiscal_itens
+        WHERE arquivo_origem = ? AND CODIGO_PRODUTO IS NOT NULL
+        GROUP BY CODIGO_PRODUTO
+        ORDER BY COUNT(*) DESC, MIN(id)
+        LIMIT ?
+        ''', (items_path.name, limite))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def consultar_fornecedor_produto(fornecedores=None, produtos=None, periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Retorna o agregado fornecedor x produto filtrado (uma linha por fornecedor_id
+    e produto), usando o warehouse quando disponível e os agregados em memória
+    caso contrário.
+    """
+    if wh_disponivel(periodo, data_path):
+        return wh_fornecedor_produto(fornecedores, produtos, periodo, data_path)
+
+    df = _pares_por_fornecedor(get_agregados_itens(periodo, data_path)['fornecedor_produto'].reset_index(), data_path)
+    if fornecedores:
+        df = df[df['fornecedor_id'].isin(_ids_fornecedores(fornecedores, data_path))]
+    if produtos:
+        df = df[df['CODIGO_PRODUTO'].isin(produtos)]
+    return df.reset_index(drop=True)
+
+
+def consultar_produtos_mais_comprados(limite=20, periodo=PERIODO_ATUAL, data_path=None):
+    """
+    Produtos mais comprados do período (mesma ordenação de value_counts).
+    """
+    if wh_disponivel(periodo, data_path):
+        return wh_produtos_mais_comprados(limite, periodo, data_path)
+
+    df_produtos = get_agregados_itens(periodo, data_path)['produto'].sort_values('primeira_linha')
+    return df_produtos['compras'].sort_values(ascending=False, kind='stable').head(limite).index.tolist()